@@ -26,3 +26,7 @@ PRIORITY = {"默认": 1, "普通": 2, "紧急": 3}
 STATUS = {"未处理": 1, "处理中": 2, "已处理": 3}
 STATUS_R = {1: "未处理", 2: "处理中", 3: "已处理"}
 PRIORITY_R = {1: "默认", 2: "普通", 3: "紧急"}
+DASHBOARD_TIME_BUDGET = 20
+ANALYTICS_TIME_BUDGET = 10
+LIST_TIME_BUDGET = 5
+MAX_PAGE_SIZE = 500
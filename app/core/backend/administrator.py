@@ -8,26 +8,79 @@ import pandas as pd
 from fastapi import HTTPException
 
 from app.constant import USER_DICT_REVERSE, USER_COLUMNS, STATUS, PRIORITY, STATUS_R, PRIORITY_R
-from app.core.database import get_user, delete_user, insert_users, USER_DICT
-from app.core.database.message import get_message, delete_message, update_message
+from app.core.database import delete_user, insert_users, USER_DICT
+from app.core.database import aio
+from app.core.database.message import delete_message, update_message, triage_messages, get_filter as message_filter, \
+    MESSAGE_SORT_FIELDS
+from app.core.database.user import USER_SORT_FIELDS
 from app.core.backend.auth import AuthHandler
+from app.core.tracing import traced
 
 auth = AuthHandler()
 
 
-def get_users(u_id: Union[str, list[str]] = None,
-              name: Union[str, list[str]] = None,
-              user_type: Union[str, list[str]] = None):
-    users = get_user(u_id=u_id, name=name, user_type=user_type)
+def _format_user(x):
+    return {"user_type": USER_DICT_REVERSE.get(x["user_type"]),
+            "insert_datetime": x["insert_datetime"].strftime("%Y-%m-%d %H:%M:%S"),
+            "u_id": x["u_id"], "name": x["name"]}
+
+
+def _format_message(x):
+    x["status"] = STATUS_R.get(x["status"])
+    x["priority"] = PRIORITY_R.get(x["priority"])
+    x["insert_time"] = x["insert_time"].strftime("%Y-%m-%d %H:%M:%S")
+    return x
+
+
+def _message_codes(status: Union[list[str], str] = None, priority: Union[list[str], str] = None):
+    """Turn status and priority labels into their stored codes, any unknown label is a 400."""
+    if status:
+        labels = [status] if isinstance(status, str) else status
+        if not isinstance(labels, list) or any(x not in STATUS for x in labels):
+            raise HTTPException(status_code=400, detail="Something went wrong, please check status.")
+        status = STATUS[status] if isinstance(status, str) else [STATUS[x] for x in status]
+    if priority:
+        labels = [priority] if isinstance(priority, str) else priority
+        if not isinstance(labels, list) or any(x not in PRIORITY for x in labels):
+            raise HTTPException(status_code=400, detail="Something went wrong, please check priority.")
+        priority = PRIORITY[priority] if isinstance(priority, str) else [PRIORITY[x] for x in priority]
+    return status, priority
+
+
+@traced()
+async def get_users(u_id: Union[str, list[str]] = None,
+                    name: Union[str, list[str]] = None,
+                    user_type: Union[str, list[str]] = None):
+    users = await aio.get_user(u_id=u_id, name=name, user_type=user_type)
     if len(users) == 0:
         return []
     else:
-        ls_users = list(map(lambda x: {"user_type": USER_DICT_REVERSE.get(x["user_type"]),
-                                       "insert_datetime": x["insert_datetime"].strftime("%Y-%m-%d %H:%M:%S"),
-                                       "u_id": x["u_id"], "name": x["name"]}, users))
+        ls_users = list(map(lambda x: _format_user(x), users))
         return ls_users
 
 
+@traced()
+async def get_users_page(page: int,
+                         limit_size: int,
+                         sort_by: str = None,
+                         descending: bool = None,
+                         u_id: Union[str, list[str]] = None,
+                         name: Union[str, list[str]] = None,
+                         user_type: Union[str, list[str]] = None):
+    """
+    Get one sorted page of users.
+
+    :return: {"total": number of matching users, "data": users of the page}
+    """
+    if sort_by is not None and sort_by not in USER_SORT_FIELDS:
+        raise HTTPException(status_code=400, detail=f"sort_by should be one of {','.join(USER_SORT_FIELDS)}.")
+    res = await aio.get_user_page(page=page, limit_size=limit_size, sort_by=sort_by or "u_id",
+                                  descending=bool(descending), u_id=u_id, name=name, user_type=user_type)
+    res["data"] = list(map(lambda x: _format_user(x), res["data"]))
+    return res
+
+
+@traced()
 def delete_user_by_uid(u_id: Union[list, str]):
     res = delete_user(u_id=u_id)
     if res == "unsuccessful":
@@ -36,6 +89,7 @@ def delete_user_by_uid(u_id: Union[list, str]):
         return res
 
 
+@traced()
 def add_users_by_file(f_users: str):
     df = pd.read_excel(f_users).rename(columns=USER_COLUMNS)
     # check columns
@@ -49,39 +103,57 @@ def add_users_by_file(f_users: str):
         HTTPException(status_code=400, detail="Columns do not fit for restriction.")
 
 
-def get_message_by_filter(status: Union[list[str], str] = None,
-                          priority: Union[list[str], str] = None,
-                          begin_time: datetime = None,
-                          end_time: datetime = None,
-                          u_id: str = None):
-    if status:
-        if isinstance(status, str):
-            status = STATUS.get(status)
-        elif isinstance(status, list):
-            status = list(map(lambda x: STATUS.get(x), status))
-        else:
-            raise HTTPException(status_code=400, detail="Something went wrong, please check status.")
-    if priority:
-        if isinstance(priority, str):
-            priority = PRIORITY.get(priority)
-        elif isinstance(priority, list):
-            priority = list(map(lambda x: PRIORITY.get(x), priority))
-        else:
-            raise HTTPException(status_code=400, detail="Something went wrong, please check priority.")
-    res = get_message(status=status, priority=priority, begin_time=begin_time, end_time=end_time, u_id=u_id)
+@traced()
+async def get_message_by_filter(status: Union[list[str], str] = None,
+                                priority: Union[list[str], str] = None,
+                                begin_time: datetime = None,
+                                end_time: datetime = None,
+                                u_id: str = None):
+    status, priority = _message_codes(status=status, priority=priority)
+    res = await aio.get_message(status=status, priority=priority, begin_time=begin_time, end_time=end_time, u_id=u_id)
     if len(res) == 0:
         return []
     else:
-        def _format_message(x):
-            x["status"] = STATUS_R.get(x["status"])
-            x["priority"] = PRIORITY_R.get(x["priority"])
-            x["insert_time"] = x["insert_time"].strftime("%Y-%m-%d %H:%M:%S")
-            return x
-
         res = list(map(lambda x: _format_message(x), res))
         return res
 
 
+@traced()
+async def get_message_page_by_filter(page: int,
+                                     limit_size: int,
+                                     sort_by: str = None,
+                                     descending: bool = None,
+                                     status: Union[list[str], str] = None,
+                                     priority: Union[list[str], str] = None,
+                                     begin_time: datetime = None,
+                                     end_time: datetime = None,
+                                     u_id: str = None):
+    """
+    Get one sorted page of messages, newest first by default.
+
+    :return: {"total": number of matching messages, "data": messages of the page}
+    """
+    if sort_by is not None and sort_by not in MESSAGE_SORT_FIELDS:
+        raise HTTPException(status_code=400, detail=f"sort_by should be one of {','.join(MESSAGE_SORT_FIELDS)}.")
+    status, priority = _message_codes(status=status, priority=priority)
+    res = await aio.get_message_page(page=page, limit_size=limit_size, sort_by=sort_by or "insert_time",
+                                     descending=True if descending is None else descending, status=status,
+                                     priority=priority, begin_time=begin_time, end_time=end_time, u_id=u_id)
+    res["data"] = list(map(lambda x: _format_message(x), res["data"]))
+    return res
+
+
+@traced()
+async def get_message_count():
+    """
+    Get the counters of all messages.
+
+    :return: {"unhandled": messages not handled yet, "unread": 0}
+    """
+    return await aio.get_message_counts()
+
+
+@traced()
 def delete_message_by_mid(m_id: int):
     res = delete_message(m_id=m_id)
     if res == "unsuccessful":
@@ -90,13 +162,70 @@ def delete_message_by_mid(m_id: int):
         return res
 
 
+@traced()
 def update_message_by_mid(m_id: int, status: str = None, priority: str = None, feedback: str = None):
-    if status:
-        status = STATUS.get(status)
-    if priority:
-        priority = PRIORITY.get(priority)
+    if isinstance(status, list) or isinstance(priority, list):
+        raise HTTPException(status_code=400, detail="Something went wrong, please check status and priority.")
+    status, priority = _message_codes(status=status, priority=priority)
     res = update_message(m_id=m_id, status=status, priority=priority, feedback=feedback)
     if res == "unsuccessful":
         raise HTTPException(status_code=400, detail="Something went wrong, please check m_id.")
     else:
         return res
+
+
+@traced()
+def triage_messages_by_filter(m_id: list[int] = None,
+                              status_filter: Union[list[str], str] = None,
+                              priority_filter: Union[list[str], str] = None,
+                              begin_time: datetime = None,
+                              end_time: datetime = None,
+                              u_id: str = None,
+                              status: str = None,
+                              priority: str = None,
+                              feedback: str = None,
+                              delete: bool = False):
+    """
+    Update or delete a batch of messages, chosen by id or by filter, in one bulk write.
+
+    :param m_id: ids of the messages, can't be combined with the filter
+    :param status_filter: only messages with these statuses
+    :param priority_filter: only messages with these priorities
+    :param begin_time: only messages sent from begin_time
+    :param end_time: only messages sent before end_time
+    :param u_id: only messages of this user
+    :param status: new status
+    :param priority: new priority
+    :param feedback: new feedback
+    :param delete: delete the messages instead of updating them
+    :return: list of {m_id, result}, result is "updated", "deleted", "conflict" or an error message
+    """
+    status_filter, priority_filter = _message_codes(status=status_filter, priority=priority_filter)
+    f = message_filter(status=status_filter, priority=priority_filter, begin_time=begin_time, end_time=end_time,
+                       u_id=u_id)
+    if m_id is not None:
+        if f:
+            raise HTTPException(status_code=400, detail="Select messages either by m_id or by filter.")
+        f = message_filter(m_id=m_id)
+    elif not f:
+        raise HTTPException(status_code=400, detail="Select messages by m_id or by filter.")
+
+    new_value = None
+    if not delete:
+        new_value = {}
+        if status:
+            new_value["status"] = STATUS.get(status)
+        if priority:
+            new_value["priority"] = PRIORITY.get(priority)
+        if feedback:
+            new_value["feedback"] = feedback
+        if not new_value or None in new_value.values():
+            raise HTTPException(status_code=400, detail="Something went wrong, please check status and priority.")
+
+    res = triage_messages(f=f, new_value=new_value)
+    if res["msg"] == "unsuccessful":
+        raise HTTPException(status_code=500, detail="Something went wrong")
+    results = [{"m_id": k, "result": v} for k, v in res["results"].items()]
+    if m_id is not None:
+        results += [{"m_id": x, "result": "not found"} for x in m_id if x not in res["results"]]
+    return results
@@ -3,11 +3,15 @@ import pandas as pd
 from dateutil.relativedelta import relativedelta
 
 from app.constant import PRICE_MAP
-from app.core.backend.surgery import get_surgery_by_tds
+from app.core.backend.surgery import get_surgery_frame_by_tds
 from app.core.database import user, surgery, apparatus, supplies
+from app.core.database.base import for_read
 from app.core.database.message import get_message
+from app.core.deadline import check_deadline, max_time_kwargs
+from app.core.tracing import traced, span
 
 
+@traced()
 def get_detail_count(df, name: str):
     """Helper function to get instrument or consumables time series info"""
 
@@ -42,6 +46,7 @@ def get_detail_count(df, name: str):
     return count, accident_count
 
 
+@traced()
 def get_doctor_contribution(df: list, name: str):
     """Helper functions to get doctor's daily contributions"""
     df = pd.DataFrame(df)
@@ -50,6 +55,7 @@ def get_doctor_contribution(df: list, name: str):
     return df.to_dict("records")
 
 
+@traced()
 def get_time_series(df, name: str):
     """Helper function to get instrument or consumables time series"""
     x_axis = df["date"].drop_duplicates().sort_values()
@@ -72,6 +78,7 @@ def get_time_series(df, name: str):
     return {"xAxis": x_axis.tolist(), "series": data, "legend": legend}
 
 
+@traced()
 def get_benefit_analysis(df):
     """
     Helper function to get benefit analysis data
@@ -84,10 +91,11 @@ def get_benefit_analysis(df):
         instruments = x["instruments"].split(',')
         consumables = x["consumables"].split(',')
         i_sum = 0
+        # items without a known price, e.g. 密封件, don't add to the cost
         for i in instruments:
-            i_sum += PRICE_MAP[i]
+            i_sum += PRICE_MAP.get(i, 0)
         for j in consumables:
-            i_sum += PRICE_MAP[j]
+            i_sum += PRICE_MAP.get(j, 0)
         return i_sum
 
     df["sum"] = df.apply(lambda x: calculate_price(x[["instruments", "consumables"]]), axis=1)
@@ -101,39 +109,44 @@ def get_benefit_analysis(df):
                "consumables", "sum", "real_sum", "gap"]], sum_all
 
 
+@traced()
 def get_surgery_dashboard(begin_time: datetime = None, end_time: datetime = None):
     # By default, the data of the past year is obtained
     if begin_time is None and end_time is None:
         end_time = datetime.now()
         begin_time = end_time - relativedelta(years=1)
 
-    df = pd.DataFrame(get_surgery_by_tds(begin_time=begin_time, end_time=end_time))
+    df = get_surgery_frame_by_tds(begin_time=begin_time, end_time=end_time)
     if len(df) == 0:
         return {"surgeon_count": [], "nurse_count": [], "department_count": [], "top_ten": [[], []],
                 "instrument_count": [], "accident_instrument_count": [], "consumable_count": [],
                 "accident_consumable_count": [], "instrument_time_series": [], "instrument_acc_time_series": [],
                 "consumable_time_series": [], "consumable_acc_time_series": [], "df_benefits": [], "sum_all": []}
 
+    check_deadline()
     # get surgeon and department count
-    surgeon_count = df.groupby(["department",
-                                "chief_surgeon"]).count()["p_name"].reset_index().rename(columns={"p_name": "c_count"})
-    grouped = surgeon_count.groupby(["department"])["c_count"].sum().reset_index().rename(
-        columns={"c_count": "d_count"})
-    surgeon_count = surgeon_count.merge(grouped, how="left", on="department", validate="m:1")
-    department_count = surgeon_count[["department", "d_count"]].drop_duplicates().rename(
-        columns={"department": "name", "d_count": "value"})
+    with span("pandas.surgeon_count", rows=len(df)):
+        surgeon_count = df.groupby(["department", "chief_surgeon"]).count()["p_name"].reset_index().rename(
+            columns={"p_name": "c_count"})
+        grouped = surgeon_count.groupby(["department"])["c_count"].sum().reset_index().rename(
+            columns={"c_count": "d_count"})
+        surgeon_count = surgeon_count.merge(grouped, how="left", on="department", validate="m:1")
+        department_count = surgeon_count[["department", "d_count"]].drop_duplicates().rename(
+            columns={"department": "name", "d_count": "value"})
 
     # get nurse count
-    df_instrument = df.apply(lambda x: x["instrument_nurse"].split(','), axis=1).explode().reset_index()
-    df_circulate = df.apply(lambda x: x["circulating_nurse"].split(','), axis=1).explode().reset_index()
-    df_circulate = df_circulate.groupby([0]).count()["index"].reset_index().rename(
-        columns={0: "name", "index": "count"})
-    df_instrument = df_instrument.groupby([0]).count()["index"].reset_index().rename(
-        columns={0: "name", "index": "count"})
-    df_nurse = df_circulate.merge(df_instrument, how="outer", on="name", validate="1:1").fillna(0).rename(
-        columns={"count_x": "count_circulate", "count_y": "count_instrument"})
-    df_nurse["sum"] = df_nurse["count_circulate"] + df_nurse["count_instrument"]
-
+    with span("pandas.nurse_count", rows=len(df)):
+        df_instrument = df.apply(lambda x: x["instrument_nurse"].split(','), axis=1).explode().reset_index()
+        df_circulate = df.apply(lambda x: x["circulating_nurse"].split(','), axis=1).explode().reset_index()
+        df_circulate = df_circulate.groupby([0]).count()["index"].reset_index().rename(
+            columns={0: "name", "index": "count"})
+        df_instrument = df_instrument.groupby([0]).count()["index"].reset_index().rename(
+            columns={0: "name", "index": "count"})
+        df_nurse = df_circulate.merge(df_instrument, how="outer", on="name", validate="1:1").fillna(0).rename(
+            columns={"count_x": "count_circulate", "count_y": "count_instrument"})
+        df_nurse["sum"] = df_nurse["count_circulate"] + df_nurse["count_instrument"]
+
+    check_deadline()
     # get top 10 surgeon
     if len(df) < 10:
         df_top_ten = surgeon_count.sort_values("c_count")[["chief_surgeon", "c_count"]]
@@ -144,42 +157,47 @@ def get_surgery_dashboard(begin_time: datetime = None, end_time: datetime = None
     instrument_count, accident_instrument_count = get_detail_count(df, "instruments")
     consumable_count, accident_consumable_count = get_detail_count(df, "consumables")
 
+    check_deadline()
     # get time series
     instrument_time_series = get_time_series(instrument_count, "instruments")
     instrument_accident_time_series = get_time_series(accident_instrument_count, "instruments")
     consumable_time_series = get_time_series(consumable_count, "consumables")
     consumable_accident_time_series = get_time_series(accident_consumable_count, "consumables")
 
+    check_deadline()
     # get benefit analysis
     df_benefits, sum_all = get_benefit_analysis(df)
 
-    return {"df": df[["chief_surgeon", "date", "p_name"]].to_dict('records'),
-            "surgeon_count": surgeon_count.to_dict('records'),
-            "nurse_count": df_nurse.to_dict('records'), "department_count": department_count.to_dict('records'),
-            "top_ten": [df_top_ten["c_count"].tolist(), df_top_ten["chief_surgeon"].tolist()],
-            "instrument_count": instrument_count.to_dict('records'),
-            "accident_instrument_count": accident_instrument_count.to_dict('records'),
-            "consumable_count": consumable_count.to_dict('records'),
-            "accident_consumable_count": accident_consumable_count.to_dict('records'),
-            "instrument_time_series": instrument_time_series,
-            "instrument_acc_time_series": instrument_accident_time_series,
-            "consumable_time_series": consumable_time_series,
-            "consumable_acc_time_series": consumable_accident_time_series,
-            "df_benefits": df_benefits.to_dict('records'), "sum_all": sum_all}
-
-
+    with span("pandas.to_records"):
+        return {"df": df[["chief_surgeon", "date", "p_name"]].to_dict('records'),
+                "surgeon_count": surgeon_count.to_dict('records'),
+                "nurse_count": df_nurse.to_dict('records'), "department_count": department_count.to_dict('records'),
+                "top_ten": [df_top_ten["c_count"].tolist(), df_top_ten["chief_surgeon"].tolist()],
+                "instrument_count": instrument_count.to_dict('records'),
+                "accident_instrument_count": accident_instrument_count.to_dict('records'),
+                "consumable_count": consumable_count.to_dict('records'),
+                "accident_consumable_count": accident_consumable_count.to_dict('records'),
+                "instrument_time_series": instrument_time_series,
+                "instrument_acc_time_series": instrument_accident_time_series,
+                "consumable_time_series": consumable_time_series,
+                "consumable_acc_time_series": consumable_accident_time_series,
+                "df_benefits": df_benefits.to_dict('records'), "sum_all": sum_all}
+
+
+@traced()
 def get_general_data():
     """
     Count collection lengths of users, surgery, apparatus, supply
     :return: dict of lengths of collections
     """
-    users = user.count_documents({})
-    surgeries = surgery.count_documents({})
-    instrument = apparatus.count_documents({})
-    consumable = supplies.count_documents({})
+    users = for_read(user).count_documents({}, **max_time_kwargs())
+    surgeries = for_read(surgery).count_documents({}, **max_time_kwargs())
+    instrument = for_read(apparatus).count_documents({}, **max_time_kwargs())
+    consumable = for_read(supplies).count_documents({}, **max_time_kwargs())
     end_time = datetime.now()
     begin_time = end_time.replace(day=1, hour=0, minute=0, second=0)
-    df = pd.DataFrame(get_surgery_by_tds(begin_time=begin_time, end_time=end_time))
+    df = get_surgery_frame_by_tds(begin_time=begin_time, end_time=end_time)
+    check_deadline()
     if len(df) != 0:
         df, sum_all = get_benefit_analysis(df)
         if len(sum_all) != 0:
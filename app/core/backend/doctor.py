@@ -6,24 +6,26 @@ import pandas as pd
 from dateutil.relativedelta import relativedelta
 from fastapi import HTTPException
 
-from app.core.database import get_surgery, get_user, get_instrument, get_supply
-from app.core.database.message import insert_message, get_message
+from app.core.database import get_surgery, get_user, get_instrument, get_supply, get_surgery_frame
+from app.core.database import aio
+from app.core.deadline import check_deadline
+from app.core.tracing import traced
 
 
+@traced()
 def get_general_data_by_month(surgeon_id: str, begin_time: datetime = None, end_time: datetime = None):
     if begin_time is None and end_time is None:
         # this month by default
         end_time = datetime.now()
         begin_time = end_time - relativedelta(month=1)
-    surgery = get_surgery(chief_surgeon=surgeon_id, begin_time=begin_time, end_time=end_time)
-    df = pd.DataFrame(surgery)[["s_id", "date", "begin_time", "end_time", "instruments", "consumables", "s_name"]]
+    df = get_surgery_frame({"s_id": "int64", "s_name": object, "instruments": object, "consumables": object,
+                            "names": object}, chief_surgeon=surgeon_id, begin_time=begin_time, end_time=end_time)
     if len(df) == 0:
         return {"surgery_count": 0, "instrument_count": 0, "consumables_count": 0,
                 "ins_detail_count": [],
                 "con_detail_count": [],
                 "sur_detail_count": []}
     else:
-        df = df[["s_id", "date", "begin_time", "end_time", "instruments", "consumables", "s_name"]]
         df["instrument_count"] = df.apply(lambda x: len(x["instruments"]), axis=1)
         df["consumable_count"] = df.apply(lambda x: len(x["consumables"]), axis=1)
         sur_count, ins_count, con_count = len(df), df["instrument_count"].sum(), df["consumable_count"].sum()
@@ -32,17 +34,26 @@ def get_general_data_by_month(surgeon_id: str, begin_time: datetime = None, end_
         surgery_type_count = df.groupby("s_name").count()["s_id"].reset_index().rename(columns={"s_name": "name",
                                                                                                 "s_id": "value"})
         surgery_type_count["value"] = surgery_type_count["value"]
-        df_ins = df.explode("instruments").reset_index(drop=True)[["s_id", "instruments", "instrument_count"]]
-        df_con = df.explode("consumables").reset_index(drop=True)[["s_id", "consumables", "consumable_count"]]
+        df_ins = df.explode("instruments").reset_index(drop=True)[["s_id", "instruments", "instrument_count", "names"]]
+        df_con = df.explode("consumables").reset_index(drop=True)[["s_id", "consumables", "consumable_count", "names"]]
 
         def _get_instrument_type(x):
-            x["instruments"] = get_instrument(i_id=x["instruments"]["id"])[0]["i_name"]
+            i_id = x["instruments"]["id"]
+            if isinstance(x["names"], dict) and str(i_id) in x["names"]["instruments"]:
+                x["instruments"] = x["names"]["instruments"][str(i_id)]
+            else:
+                x["instruments"] = get_instrument(i_id=i_id)[0]["i_name"]
             return x
 
         def _get_consumable_type(x):
-            x["consumables"] = get_supply(c_id=x["consumables"])[0]["c_name"]
+            c_id = x["consumables"]
+            if isinstance(x["names"], dict) and str(c_id) in x["names"]["consumables"]:
+                x["consumables"] = x["names"]["consumables"][str(c_id)]["name"]
+            else:
+                x["consumables"] = get_supply(c_id=c_id)[0]["c_name"]
             return x
 
+        check_deadline()
         df_ins = df_ins.apply(lambda x: _get_instrument_type(x), axis=1)
         df_con = df_con.apply(lambda x: _get_consumable_type(x), axis=1)
         df_ins_count = df_ins.groupby("instruments").count()["s_id"].reset_index().rename(columns={"instruments": "name",
@@ -57,6 +68,7 @@ def get_general_data_by_month(surgeon_id: str, begin_time: datetime = None, end_
                 "sur_detail_count": surgery_type_count.to_dict('records')}
 
 
+@traced()
 def get_surgery_time_series(surgeon_id: str, mode: str = None):
     """
     Get surgery, instrument, consumables time series.
@@ -88,6 +100,7 @@ def get_surgery_time_series(surgeon_id: str, mode: str = None):
         else:
             df["time"] = df["date"].dt.date
 
+        check_deadline()
         surgery_count = df.groupby("time").count()["s_id"].reset_index().rename(columns={"s_id": "s_count"})
 
         return {"category": surgery_count["time"].tolist(), "data": surgery_count["s_count"].tolist()}
@@ -95,6 +108,7 @@ def get_surgery_time_series(surgeon_id: str, mode: str = None):
         return []
 
 
+@traced()
 def get_contribution_matrix(surgeon_id):
     """Turn doctor's contribution into a 7*10 matrix"""
     # get begin_time and end_time
@@ -104,19 +118,20 @@ def get_contribution_matrix(surgeon_id):
     begin_time = end_time - relativedelta(days=weekday + 63)
 
     # get surgery count
-    df = pd.DataFrame(get_surgery(chief_surgeon=surgeon_id, begin_time=begin_time, end_time=end_time))
+    df = get_surgery_frame({"s_id": "int64", "date": "datetime64[ns]"},
+                           chief_surgeon=surgeon_id, begin_time=begin_time, end_time=end_time)
     if len(df) == 0:
         matrix = [[0]*10 for _ in range(10)]
         hours = 0
     else:
-        df = df[["s_id", "date"]]
-        df_month = pd.DataFrame(get_surgery(chief_surgeon=surgeon_id, end_time=end_time,
-                                            begin_time=end_time.replace(day=1, hour=0, minute=0, second=0)))
+        check_deadline()
+        df_month = get_surgery_frame({"s_id": "int64", "begin_time": "datetime64[ns]", "end_time": "datetime64[ns]"},
+                                     chief_surgeon=surgeon_id, end_time=end_time,
+                                     begin_time=end_time.replace(day=1, hour=0, minute=0, second=0))
 
         if len(df_month) == 0:
             hours = 0
         else:
-            df_month = df_month[["s_id", "begin_time", "end_time"]]
             df_month["hours"] = df_month["end_time"] - df_month["begin_time"]
             hours = df_month["hours"].sum().seconds/3600
 
@@ -145,6 +160,7 @@ def get_contribution_matrix(surgeon_id):
     return {"matrix": matrix, "month": month, "hours": "%.1f" % hours}
 
 
+@traced()
 def get_surgery_by_date(surgeon_id: str, date: datetime = None):
     """Get surgery rank detail by date."""
     if not date:
@@ -158,6 +174,7 @@ def get_surgery_by_date(surgeon_id: str, date: datetime = None):
         df = df[["s_id", "s_name", "chief_surgeon", "instruments", "consumables", "begin_time", "end_time"]]
         df["instruments"] = df["instruments"].apply(lambda x: len(x))
         df["consumables"] = df["consumables"].apply(lambda x: len(x))
+        check_deadline()
         df_surgery_count = df.groupby("chief_surgeon").count().rename(
             columns={"s_id": "s_count"})[["s_count"]].rank(method="min").reset_index()
         surgery_rank = df_surgery_count[
@@ -186,6 +203,7 @@ def get_surgery_by_date(surgeon_id: str, date: datetime = None):
             pre += duration
             return ls
 
+        check_deadline()
         df["duration"] = df.apply(lambda x: _get_dur_ls(x), axis=1)
         df.rename(columns={"s_name": "name", "duration": "data"}, inplace=True)
 
@@ -193,25 +211,55 @@ def get_surgery_by_date(surgeon_id: str, date: datetime = None):
                 "series": df[["name", "data"]].to_dict('records'), "categories": list(range(dur_sum)), "len": dur_sum}
 
 
-def send_message(u_id: str, u_name: str, message: str):
-    res = insert_message(u_id=u_id, u_name=u_name, content=message)
+@traced()
+async def send_message(u_id: str, u_name: str, message: str):
+    res = await aio.insert_message(u_id=u_id, u_name=u_name, content=message)
     if res == "unsuccessful":
         raise HTTPException(status_code=400, detail="Insert failure, please check your info.")
     else:
         return res
 
 
-def get_message_by_uid(u_id: str):
+@traced()
+async def get_message_by_uid(u_id: str):
     """
     Get message sent from user.
     """
-    res = get_message(u_id=u_id)
+    res = await aio.get_message(u_id=u_id)
     if len(res) == 0:
         return []
     else:
-        def _format_message(x):
-            x["status"] = x["status"]-1
-            x["insert_time"] = x["insert_time"].strftime("%Y-%m-%d %H:%M:%S")
-            return x
-        res = list(map(lambda x: _format_message(x), res))
+        res = list(map(lambda x: _format_own_message(x), res))
         return res
+
+
+def _format_own_message(x):
+    x["status"] = x["status"]-1
+    x["insert_time"] = x["insert_time"].strftime("%Y-%m-%d %H:%M:%S")
+    return x
+
+
+@traced()
+async def get_message_page_by_uid(u_id: str, page: int, limit_size: int):
+    """
+    Get one page of the user's inbox, newest first, and mark the inbox as read.
+
+    :return: {"total": number of messages, "data": messages of the page}
+    """
+    if not u_id:
+        raise HTTPException(status_code=400, detail="u_id is required.")
+    res = await aio.get_message_page(page=page, limit_size=limit_size, sort_by="insert_time", descending=True,
+                                     u_id=u_id)
+    await aio.mark_messages_read(u_id=u_id)
+    res["data"] = list(map(lambda x: _format_own_message(x), res["data"]))
+    return res
+
+
+@traced()
+async def get_message_count_by_uid(u_id: str):
+    """
+    Get the user's inbox counters.
+
+    :return: {"unhandled": messages not handled yet, "unread": updates the user has not seen}
+    """
+    return await aio.get_message_counts(u_id=u_id)
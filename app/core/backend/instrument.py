@@ -1,31 +1,34 @@
+import logging
 import os.path
 from datetime import datetime
 from typing import Union
-import numpy as np
 from fastapi import HTTPException
 
 from app.constant import INSTRUMENT_COLUMNS, BASE_DATA_TEMP_DIR
-from app.core.database import get_instrument, update_instrument, delete_instrument, insert_instrument
+from app.core.database import get_instrument, update_instrument, delete_instrument, insert_instrument, \
+    use_instruments, get_instrument_page, INSTRUMENT_SORT_FIELDS
 import pandas as pd
 
 from app.core.utils import pack_files
+from app.core.tracing import traced
 
+log = logging.getLogger(__name__)
 
+
+def _format_instrument(x):
+    return {"i_id": x["i_id"], "i_name": x["i_name"], "times": x["times"], "insert_time": x["insert_time"],
+            "validity": "有效" if x["times"] > 0 else "失效"}
+
+
+@traced()
 def get_all_instrument():
     """
     Get all instruments.
     """
-    instruments = get_instrument()
-    if len(instruments) == 0:
-        return []
-    else:
-        df = pd.DataFrame(instruments)[["i_id", "i_name", "times", "insert_time"]]
-        conditions = [(df['times'] <= 0), (df['times'] > 0)]
-        values = ['失效', '有效']
-        df["validity"] = np.select(conditions, values)
-        return df.to_dict('records')
+    return list(map(_format_instrument, get_instrument()))
 
 
+@traced()
 def get_instrument_general(begin_time: datetime | None = None,
                            end_time: datetime | None = None,
                            i_id: int | list[int] | None = None,
@@ -37,16 +40,35 @@ def get_instrument_general(begin_time: datetime | None = None,
     """
     instruments = get_instrument(begin_time=begin_time, end_time=end_time, i_id=i_id, i_name=i_name, times=times,
                                  validity=validity)
-    if len(instruments) == 0:
-        return []
-    else:
-        df = pd.DataFrame(instruments)[["i_id", "i_name", "times", "insert_time"]]
-        conditions = [(df['times'] <= 0), (df['times'] > 0)]
-        values = ['失效', '有效']
-        df["validity"] = np.select(conditions, values)
-        return df.to_dict('records')
+    return list(map(_format_instrument, instruments))
+
+
+@traced()
+def get_instrument_page_general(page: int,
+                                limit_size: int,
+                                sort_by: str = None,
+                                descending: bool = None,
+                                begin_time: datetime | None = None,
+                                end_time: datetime | None = None,
+                                i_id: int | list[int] | None = None,
+                                i_name: str | list[str] | None = None,
+                                times: int | list[int] | None = None,
+                                validity: bool = None):
+    """
+    Get one sorted page of instruments.
+
+    :return: {"total": number of matching instruments, "data": instruments of the page}
+    """
+    if sort_by is not None and sort_by not in INSTRUMENT_SORT_FIELDS:
+        raise HTTPException(status_code=400, detail=f"sort_by should be one of {','.join(INSTRUMENT_SORT_FIELDS)}.")
+    res = get_instrument_page(page=page, limit_size=limit_size, sort_by=sort_by or "i_id",
+                              descending=bool(descending), begin_time=begin_time, end_time=end_time, i_id=i_id,
+                              i_name=i_name, times=times, validity=validity)
+    res["data"] = list(map(_format_instrument, res["data"]))
+    return res
 
 
+@traced()
 def revise_instrument(i_id: int,
                       times: int):
     """
@@ -59,6 +81,26 @@ def revise_instrument(i_id: int,
         return res
 
 
+@traced()
+def use_instruments_by_id(i_id: list[int]) -> list[int]:
+    """
+    Record one use of every instrument in a surgery.
+
+    :param i_id: ids of the instruments used
+    :return: ids the uses were taken off, to give back with return_instruments if the surgery is not recorded
+    """
+    res = use_instruments(i_id=i_id)
+    if res["missing"]:
+        raise HTTPException(status_code=400, detail=f"Can't find instruments {res['missing']}")
+    if res["msg"] == "unsuccessful":
+        raise HTTPException(status_code=500, detail="Something went wrong")
+    exhausted = [x["i_id"] for x in res["instruments"] if x["exhausted"]]
+    if exhausted:
+        log.warning(f"instruments {exhausted} are exhausted")
+    return res["used"]
+
+
+@traced()
 def download_instrument_qr_code(i_id: int):
     """
     Download one qr_code.
@@ -68,7 +110,7 @@ def download_instrument_qr_code(i_id: int):
         return f_path
     else:
         try:
-            qr_code = get_instrument(i_id=i_id)[0]["qr_code"]
+            qr_code = get_instrument(i_id=i_id, qr_code=True)[0]["qr_code"]
         except Exception as e:
             raise HTTPException(status_code=400, detail=f"Can't find instrument{str(i_id)}, and raise: {e}")
         with open('temp.png', 'wb') as fp:
@@ -76,6 +118,7 @@ def download_instrument_qr_code(i_id: int):
         return "temp.png"
 
 
+@traced()
 def add_instruments_by_file(f_instruments: str):
     """
     Add instruments by excel.
@@ -97,6 +140,7 @@ def add_instruments_by_file(f_instruments: str):
         return pack_files(res["files"])
 
 
+@traced()
 def add_one_instrument(i_name: str, times: int = None):
     """
     Add one instrument into database.
@@ -108,6 +152,7 @@ def add_one_instrument(i_name: str, times: int = None):
         return {"file": res["files"][0], "file_name": res["file_name"]}
 
 
+@traced()
 def delete_instruments_by_id(i_id: Union[int, list[int]]):
     """
     Delete one or many instruments by instrument id.
@@ -7,36 +7,41 @@ from datetime import datetime
 import json
 from typing import Union
 
-import pandas as pd
 from fastapi import HTTPException
 
-from app.constant import BASE_CORE_DIR
-from app.core.database import get_instrument, update_instrument, insert_surgery, update_supply, get_supply, \
-    get_newest_supply, get_user
+from app.constant import BASE_CORE_DIR, DC_DEPARTMENT
+from app.core.backend.supply import allocate_consumables
+from app.core.database import insert_surgery, get_user, use_instruments, return_instruments, return_supplies
+from app.core.database import aio
+from app.core.tracing import traced
 
 log = logging.getLogger(__name__)
 
 
-def update_instrument_times_info(i_id: int) -> dict:
+@traced()
+def update_instrument_times_info(ls_i_id: list[int]) -> dict:
     """
-    Update instrument times info and return status message
+    Update instruments times info and return status message
 
-    :param i_id: instrument id
-    :return: instrument's status message and times
+    :param ls_i_id: list of instrument id
+    :return: status message, instruments' times, the ids that do not exist and the uses taken off
     """
-    instrument = get_instrument(i_id=i_id)[0]
-    times = instrument["times"]
-    if times > 0:
-        times = times - 1
-        if update_instrument(v_times=times, i_id=i_id) == "success":
-            instrument.update({'times': times})
-            return {"msg": "successfully updated instrument times info", "instrument": instrument}
-        else:
-            return {"msg": "something went wrong when updating instrument info", "instrument": instrument}
-    else:
-        return {"msg": "The instrument is dumped", "instrument": instrument}
-
-
+    res = use_instruments(i_id=ls_i_id)
+    if res["missing"]:
+        return {"msg": f"Can't find instruments {res['missing']}", "instruments": [], "missing": res["missing"],
+                "used": []}
+    if res["msg"] == "unsuccessful":
+        return {"msg": "something went wrong when updating instrument info", "instruments": [], "missing": [],
+                "used": []}
+    exhausted = [x["i_id"] for x in res["instruments"] if x["exhausted"]]
+    if exhausted:
+        return {"msg": f"The instruments {exhausted} are dumped", "instruments": res["instruments"], "missing": [],
+                "used": res["used"]}
+    return {"msg": "successfully updated instrument times info", "instruments": res["instruments"], "missing": [],
+            "used": res["used"]}
+
+
+@traced()
 def get_consumable_ls(instruments: list) -> list:
     """
     Get consumable list.
@@ -50,6 +55,7 @@ def get_consumable_ls(instruments: list) -> list:
     return ls_consumables
 
 
+@traced()
 def get_surgery_names():
     """
     Get surgery list.
@@ -60,6 +66,7 @@ def get_surgery_names():
     return list(dc_surgery_instrument.keys())
 
 
+@traced()
 def get_instrument_ls(s_name: str) -> list:
     """
     Get instrument list.
@@ -72,25 +79,19 @@ def get_instrument_ls(s_name: str) -> list:
     return dc_surgery_instrument[s_name]
 
 
-def get_consumable_stock(instruments: list) -> list:
+@traced()
+async def get_consumable_stock(instruments: list) -> list:
     """
     Check if stock has enough consumables for input.
 
     :param instruments: list of instruments
     :return: list of consumables that do not match
     """
-    ls_c_name = get_supply(c_name=get_consumable_ls(instruments=instruments))
-    df = pd.DataFrame(ls_c_name)
-    df = df[df["description"] == ""].groupby('c_name').count().reset_index().rename(columns={"c_id": "nums"})
-    return df[["c_name", "nums"]].to_dict('records')
-
-
-def _update_and_get_supply(x):
-    c_id = get_newest_supply(n_limit=1, c_name=x["c_name"])[0]["c_id"]
-    update_supply(c_id=c_id, description=x["description"])
-    return get_supply(c_id=c_id)[0]["c_id"]
+    stock = await aio.get_supply_stock(c_name=get_consumable_ls(instruments=instruments), available=True)
+    return list(map(lambda x: {"c_name": x["c_name"], "nums": x["available"]}, stock))
 
 
+@traced()
 def insert_surgery_info(ls_c_name: list,
                         ls_i_id: list,
                         p_name: str,
@@ -121,21 +122,36 @@ def insert_surgery_info(ls_c_name: list,
     :return: message of whether successfully inserted
     """
     try:
-        instruments = list(map(lambda x: update_instrument_times_info(x)["instrument"]["i_id"], ls_i_id))
-        consumables = list(map(lambda x: _update_and_get_supply(x), ls_c_name))
-        chief_surgeon = get_user(name=chief_surgeon)["u_id"]
-        associate_surgeon = get_user(name=associate_surgeon)["u_id"]
+        chief_surgeon = get_user(name=chief_surgeon)[0]["u_id"]
+        associate_surgeon = get_user(name=associate_surgeon)[0]["u_id"]
         if isinstance(instrument_nurse, str):
-            instrument_nurse = [get_user(name=instrument_nurse)["u_id"]]
-        else:
-            instrument_nurse = list(map(lambda x: get_user(name=x)["u_id"], instrument_nurse))
+            instrument_nurse = [instrument_nurse]
+        instrument_nurse = list(map(lambda x: get_user(name=x)[0]["u_id"], instrument_nurse))
         if isinstance(circulating_nurse, str):
-            circulating_nurse = [get_user(name=circulating_nurse)["u_id"]]
-        else:
-            circulating_nurse = list(map(lambda x: get_user(name=x)["u_id"], circulating_nurse))
+            circulating_nurse = [circulating_nurse]
+        circulating_nurse = list(map(lambda x: get_user(name=x)[0]["u_id"], circulating_nurse))
     except Exception as e:
         raise HTTPException(status_code=400, detail=f"Input parameters have errors, and raise {e}")
-    return insert_surgery(p_name=p_name, admission_number=admission_number, department=department, s_name=s_name,
-                          chief_surgeon=chief_surgeon, associate_surgeon=associate_surgeon,
-                          instrument_nurse=instrument_nurse, circulating_nurse=circulating_nurse, begin_time=begin_time,
-                          end_time=end_time, instruments=instruments, consumables=consumables)
+
+    # nothing is written before the staff is known, and the supplies are claimed last
+    res = update_instrument_times_info(ls_i_id)
+    if res["missing"]:
+        raise HTTPException(status_code=400, detail=res["msg"])
+    log.info(res["msg"])
+    try:
+        consumables = allocate_consumables(ls_c_name)
+    except HTTPException:
+        return_instruments(res["used"])
+        raise
+    # stored like the surgeries of insert_surgery_user, on the day the surgery began
+    inserted = insert_surgery(p_name=p_name, admission_number=admission_number,
+                              department=DC_DEPARTMENT.get(department), s_name=s_name, chief_surgeon=chief_surgeon,
+                              associate_surgeon=associate_surgeon, instrument_nurse=instrument_nurse,
+                              circulating_nurse=circulating_nurse,
+                              date=begin_time.replace(hour=0, minute=0, second=0, microsecond=0),
+                              begin_time=begin_time, end_time=end_time,
+                              instruments=[{"id": x, "description": "默认"} for x in ls_i_id], consumables=consumables)
+    if inserted == "unsuccessful":
+        return_instruments(res["used"])
+        return_supplies(consumables)
+    return inserted
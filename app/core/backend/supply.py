@@ -3,9 +3,12 @@ from typing import Union
 
 from fastapi import HTTPException
 
-from app.core.database import get_supply, update_supply, insert_supply, delete_supply
+from app.core.database import get_supply, update_supply, delete_supply, allocate_supplies, insert_supplies_bulk, \
+    get_supply_page, SUPPLY_SORT_FIELDS, get_supply_inventory
+from app.core.tracing import traced
 
 
+@traced()
 def get_supply_general(begin_time: datetime = None,
                        end_time: datetime = None,
                        c_id: Union[int, list[int]] = None,
@@ -31,6 +34,57 @@ def get_supply_general(begin_time: datetime = None,
         return supplies
 
 
+@traced()
+def get_supply_page_general(page: int,
+                            limit_size: int,
+                            sort_by: str = None,
+                            descending: bool = None,
+                            begin_time: datetime = None,
+                            end_time: datetime = None,
+                            c_id: Union[int, list[int]] = None,
+                            c_name: Union[str, list[str]] = None,
+                            description: Union[str, list[str]] = None,
+                            validity: bool = None):
+    """
+    Get one sorted page of supplies.
+
+    :return: {"total": number of matching supplies, "data": supplies of the page}
+    """
+    if sort_by is not None and sort_by not in SUPPLY_SORT_FIELDS:
+        raise HTTPException(status_code=400, detail=f"sort_by should be one of {','.join(SUPPLY_SORT_FIELDS)}.")
+    return get_supply_page(page=page, limit_size=limit_size, sort_by=sort_by or "c_id", descending=bool(descending),
+                           begin_time=begin_time, end_time=end_time, c_id=c_id, c_name=c_name,
+                           description=description, validity=validity)
+
+
+@traced()
+def get_supply_inventory_general(c_name: Union[str, list[str]] = None,
+                                 detail: bool = False,
+                                 page: int = 1,
+                                 limit_size: int = 20,
+                                 sort_by: str = None,
+                                 descending: bool = None):
+    """
+    Get available, used and flagged counts and the latest intake per supply name.
+
+    :param c_name: supply's name, all names by default
+    :param detail: also return one page of the individual supplies of c_name
+    :param page: page of the drill-down
+    :param limit_size: page size of the drill-down
+    :param sort_by: sort field of the drill-down
+    :param descending: sort order of the drill-down
+    :return: {"inventory": [...]} plus {"items": {"total", "data"}} on drill-down
+    """
+    res = {"inventory": get_supply_inventory(c_name=c_name)}
+    if detail:
+        if c_name is None:
+            raise HTTPException(status_code=400, detail="c_name is required to list individual supplies.")
+        res["items"] = get_supply_page_general(page=page, limit_size=limit_size, sort_by=sort_by,
+                                               descending=descending, c_name=c_name)
+    return res
+
+
+@traced()
 def update_supply_description(c_id: int, description: str):
     res = update_supply(c_id=c_id, description=description)
     if res == "unsuccessful":
@@ -39,17 +93,46 @@ def update_supply_description(c_id: int, description: str):
         return res
 
 
+@traced()
+def allocate_consumables(consumables: list[dict]) -> list[int]:
+    """
+    Claim unused supplies for a surgery.
+
+    :param consumables: list of {c_name: "无菌壁套", description: "默认"}, an empty description means "默认"
+    :return: list of claimed supply ids
+    """
+    consumables = list(map(lambda x: {"c_name": x["c_name"], "description": x["description"] or "默认"},
+                           consumables))
+    res = allocate_supplies(consumables)
+    if res["msg"] == "unsuccessful":
+        if res["missing"]:
+            raise HTTPException(status_code=400, detail=f"Not enough stock for {','.join(res['missing'])}.")
+        raise HTTPException(status_code=500, detail="Something went wrong")
+    return list(map(lambda x: x["c_id"], res["supplies"]))
+
+
+@traced()
 def insert_supplies(c_name: str, num: int):
     """
     Insert supplies based on num
     """
-    for i in range(num):
-        res = insert_supply(c_name=c_name)
-        if res == "unsuccessful":
-            raise HTTPException(status_code=400, detail="Insert failed. Please check the input info.")
+    return insert_supply_manifest([{"c_name": c_name, "num": num}])
+
+
+@traced()
+def insert_supply_manifest(manifest: list[dict]):
+    """
+    Insert a delivery manifest, one {c_name, num} per line.
+    """
+    if any(map(lambda x: x["num"] < 0, manifest)):
+        raise HTTPException(status_code=400, detail="Insert failed. num should not be negative.")
+    res = insert_supplies_bulk(manifest)
+    if res["msg"] == "unsuccessful":
+        raise HTTPException(status_code=400, detail="Insert failed. Please check the input info.")
     return "successful"
 
 
+@traced()
 def delete_supply_by_id(c_id: Union[int, list[int]]):
     """
     Delete supplies by id
@@ -3,22 +3,50 @@ from typing import Union
 import pandas as pd
 from fastapi import HTTPException
 from app.constant import DC_DEPARTMENT_REVERSE, DC_DEPARTMENT
-from app.core.backend.instrument import revise_instrument
-from app.core.backend.supply import update_supply_description
+from app.core.backend.instrument import revise_instrument, use_instruments_by_id
+from app.core.backend.supply import update_supply_description, allocate_consumables
+from app.core.deadline import check_deadline
 from app.core.database import get_surgery, get_user, get_instrument, get_supply, update_surgery, insert_surgery, \
-    update_supply, get_newest_supply
+    get_surgery_frame, return_instruments, return_supplies
+from app.core.workflow.surgery_names import build_display_names, refresh_surgery_names, lookup_display_names
+from app.core.tracing import traced
 
 pd.set_option('display.max_columns', None)
 
+# fields returned by get_surgery_by_tds and the stored fields each of them is built from
+SURGERY_FIELDS = {"s_id": ["s_id"], "p_name": ["p_name"], "admission_number": ["admission_number"],
+                  "department": ["department"], "s_name": ["s_name"], "date": ["date"],
+                  "begin_time": ["begin_time"], "end_time": ["end_time"],
+                  "chief_surgeon": ["chief_surgeon", "names.users"],
+                  "chief_surgeon_id": ["chief_surgeon", "names.users"],
+                  "associate_surgeon": ["associate_surgeon", "names.users"],
+                  "associate_surgeon_id": ["associate_surgeon", "names.users"],
+                  "instrument_nurse": ["instrument_nurse", "names.users"],
+                  "instrument_nurse_detail": ["instrument_nurse", "names.users"],
+                  "circulating_nurse": ["circulating_nurse", "names.users"],
+                  "circulating_nurse_detail": ["circulating_nurse", "names.users"],
+                  "instruments": ["instruments", "names.instruments"],
+                  "instruments_detail": ["instruments", "names.instruments"],
+                  "consumables": ["consumables", "names.consumables"],
+                  "consumables_detail": ["consumables", "names.consumables"]}
+SURGERY_FRAME_FIELDS = {"p_name": object, "admission_number": "int64", "department": object, "s_name": object,
+                        "chief_surgeon": object, "instrument_nurse": object, "circulating_nurse": object,
+                        "date": "datetime64[ns]", "instruments": object, "consumables": object, "names": object}
 
+
+@traced()
 def get_surgery_by_tds(page: int = None,
                        limit_size: int = None,
                        begin_time: datetime = None,
                        end_time: datetime = None,
                        department: Union[str, list[str]] = None,
-                       s_name: Union[str, list[str]] = None):
+                       s_name: Union[str, list[str]] = None,
+                       fields: list[str] = None):
     """
     This get function should support pagination.
+
+    :param fields: fields of SURGERY_FIELDS to return, all by default. Joins only needed by the left out fields,
+        e.g. instrument times for instruments_detail, are skipped.
     """
     if department is not None:
         if isinstance(department, str):
@@ -27,52 +55,149 @@ def get_surgery_by_tds(page: int = None,
             department = list(map(lambda x: DC_DEPARTMENT.get(x), department))
         else:
             raise HTTPException(status_code=400, detail="Invalid department")
+    if fields is not None:
+        unknown = set(fields) - SURGERY_FIELDS.keys()
+        if unknown:
+            raise HTTPException(status_code=400, detail=f"Unknown fields: {','.join(sorted(unknown))}")
+        wanted = set(fields)
+        projection = sorted({y for x in wanted for y in SURGERY_FIELDS[x]})
+    else:
+        wanted = set(SURGERY_FIELDS)
+        projection = None
+
+    def _format_staff(x, names: dict = None):
+        def _get_user(u_id):
+            if names is not None:
+                return {"u_id": u_id, "name": names["users"].get(u_id, u_id)}
+            user = get_user(u_id=u_id)[0]
+            return {"u_id": user["u_id"], "name": user["name"]}
 
-    def _format_surgery(x):
-        surgeon = get_user(u_id=x["chief_surgeon"])[0]
-        x["chief_surgeon"] = surgeon["name"]
-        x["chief_surgeon_id"] = surgeon["u_id"]
-        associate = get_user(u_id=x["associate_surgeon"])[0]
-        x["associate_surgeon"] = associate["name"]
-        x["associate_surgeon_id"] = associate["u_id"]
-        x["instrument_nurse_detail"] = list(map(lambda y: get_user(u_id=y)[0], x["instrument_nurse"]))
-        x["instrument_nurse"] = ','.join(list(map(lambda y: y["name"], x["instrument_nurse_detail"])))
-        x["circulating_nurse_detail"] = list(map(lambda y: get_user(u_id=y)[0], x["circulating_nurse"]))
-        x["circulating_nurse"] = ','.join(list(map(lambda y: y["name"], x["circulating_nurse_detail"])))
+        if "chief_surgeon" in x:
+            surgeon = _get_user(x["chief_surgeon"])
+            x["chief_surgeon"] = surgeon["name"]
+            x["chief_surgeon_id"] = surgeon["u_id"]
+        if "associate_surgeon" in x:
+            associate = _get_user(x["associate_surgeon"])
+            x["associate_surgeon"] = associate["name"]
+            x["associate_surgeon_id"] = associate["u_id"]
+        if "instrument_nurse" in x:
+            x["instrument_nurse_detail"] = list(map(lambda y: _get_user(y), x["instrument_nurse"]))
+            x["instrument_nurse"] = ','.join(list(map(lambda y: y["name"], x["instrument_nurse_detail"])))
+        if "circulating_nurse" in x:
+            x["circulating_nurse_detail"] = list(map(lambda y: _get_user(y), x["circulating_nurse"]))
+            x["circulating_nurse"] = ','.join(list(map(lambda y: y["name"], x["circulating_nurse_detail"])))
+
+    def _format_surgery(x, times: dict):
+        check_deadline()
+        names = x.pop("names", None)
+        _format_staff(x, names)
 
         def _get_instrument_detail(y):
+            if names is not None and str(y["id"]) in names["instruments"]:
+                return {"id": y["id"], "name": names["instruments"][str(y["id"])],
+                        "times": times.get(y["id"]), "description": y["description"]}
             instrument = get_instrument(i_id=y["id"])[0]
             return {"id": instrument["i_id"], "name": instrument["i_name"], "times": instrument["times"],
                     "description": y["description"]}
 
         def _get_consumable_detail(y):
+            if names is not None and str(y) in names["consumables"]:
+                consumable = names["consumables"][str(y)]
+                return {"id": y, "name": consumable["name"], "description": consumable["description"]}
             consumable = get_supply(c_id=y)[0]
             return {"id": consumable["c_id"], "name": consumable["c_name"],
                     "description": consumable["description"]}
 
-        x["instruments_detail"] = list(map(lambda y: _get_instrument_detail(y), x["instruments"]))
-        x["instruments"] = ','.join(list(map(lambda y: y["name"], x["instruments_detail"])))
-        x["consumables_detail"] = list(map(lambda y: _get_consumable_detail(y), x["consumables"]))
-        x["consumables"] = ','.join(list(map(lambda y: y["name"], x["consumables_detail"])))
-        x["department"] = DC_DEPARTMENT_REVERSE.get(x["department"])
-        x["date"] = x["date"].strftime("%Y-%m-%d")
-        x["begin_time"] = x["begin_time"].strftime("%Y-%m-%d %H:%M")
-        x["end_time"] = x["end_time"].strftime("%Y-%m-%d %H:%M")
+        if "instruments" in x:
+            x["instruments_detail"] = list(map(lambda y: _get_instrument_detail(y), x["instruments"]))
+            x["instruments"] = ','.join(list(map(lambda y: y["name"], x["instruments_detail"])))
+        if "consumables" in x:
+            x["consumables_detail"] = list(map(lambda y: _get_consumable_detail(y), x["consumables"]))
+            x["consumables"] = ','.join(list(map(lambda y: y["name"], x["consumables_detail"])))
+        if "department" in x:
+            x["department"] = DC_DEPARTMENT_REVERSE.get(x["department"])
+        if "date" in x:
+            x["date"] = x["date"].strftime("%Y-%m-%d")
+        if "begin_time" in x:
+            x["begin_time"] = x["begin_time"].strftime("%Y-%m-%d %H:%M")
+        if "end_time" in x:
+            x["end_time"] = x["end_time"].strftime("%Y-%m-%d %H:%M")
+        if projection is not None:
+            return {k: v for k, v in x.items() if k in wanted}
         return x
 
     if page is not None and limit_size is not None:
         skip_size = (page - 1) * limit_size
     else:
         skip_size = None
-    surgery = get_surgery(skip_size=skip_size, limit_size=limit_size,
+    surgery = get_surgery(skip_size=skip_size, limit_size=limit_size, fields=projection,
                           begin_time=begin_time, end_time=end_time, department=department, s_name=s_name)
     if len(surgery) == 0:
         return []
     else:
-        surgery = list(map(lambda x: _format_surgery(x), surgery))
+        # instrument times keep changing, so they are the only join left for surgeries with stored names
+        times = {}
+        if "instruments_detail" in wanted:
+            i_ids = list({y["id"] for x in surgery if "names" in x for y in x["instruments"]})
+            times = {y["i_id"]: y["times"] for y in get_instrument(i_id=i_ids)} if i_ids else {}
+        surgery = list(map(lambda x: _format_surgery(x, times), surgery))
         return surgery
 
 
+@traced()
+def get_surgery_frame_by_tds(begin_time: datetime = None, end_time: datetime = None) -> pd.DataFrame:
+    """
+    Get surgeries of a period as a DataFrame formatted like get_surgery_by_tds, for analytics.
+
+    Only the columns the dashboard needs are loaded. Staff, instruments and consumables become comma separated
+    names plus *_detail lists, surgeries stored without names are resolved in one lookup per collection.
+    """
+    df = get_surgery_frame(SURGERY_FRAME_FIELDS, begin_time=begin_time, end_time=end_time)
+    if len(df) == 0:
+        return df.drop(columns="names")
+
+    names = df["names"].tolist()
+    legacy = [i for i, x in enumerate(names) if not isinstance(x, dict)]
+    if legacy:
+        u_ids, i_ids, c_ids = set(), set(), set()
+        for i in legacy:
+            u_ids |= {df["chief_surgeon"].iat[i], *(df["instrument_nurse"].iat[i] or []),
+                      *(df["circulating_nurse"].iat[i] or [])} - {None}
+            i_ids |= {y["id"] for y in df["instruments"].iat[i] or []}
+            c_ids |= set(df["consumables"].iat[i] or [])
+        users, instruments, consumables = lookup_display_names(u_ids, i_ids, c_ids)
+        fallback = {"users": users, "instruments": instruments, "consumables": consumables}
+        for i in legacy:
+            names[i] = fallback
+    check_deadline()
+
+    def _staff(n, u_ids):
+        return ','.join(n["users"].get(u_id, u_id) for u_id in u_ids or [])
+
+    def _instruments(n, instruments):
+        return [{"id": y["id"], "name": n["instruments"].get(str(y["id"]), str(y["id"])),
+                 "description": y["description"]} for y in instruments or []]
+
+    def _consumables(n, consumables):
+        details = []
+        for c_id in consumables or []:
+            consumable = n["consumables"].get(str(c_id), {"name": str(c_id), "description": None})
+            details.append({"id": c_id, "name": consumable["name"], "description": consumable["description"]})
+        return details
+
+    df["chief_surgeon"] = [n["users"].get(u_id, u_id) for n, u_id in zip(names, df["chief_surgeon"])]
+    df["instrument_nurse"] = [_staff(n, x) for n, x in zip(names, df["instrument_nurse"])]
+    df["circulating_nurse"] = [_staff(n, x) for n, x in zip(names, df["circulating_nurse"])]
+    df["instruments_detail"] = [_instruments(n, x) for n, x in zip(names, df["instruments"])]
+    df["instruments"] = [','.join(y["name"] for y in x) for x in df["instruments_detail"]]
+    df["consumables_detail"] = [_consumables(n, x) for n, x in zip(names, df["consumables"])]
+    df["consumables"] = [','.join(y["name"] for y in x) for x in df["consumables_detail"]]
+    df["department"] = df["department"].map(DC_DEPARTMENT_REVERSE)
+    df["date"] = df["date"].dt.strftime("%Y-%m-%d")
+    return df.drop(columns="names")
+
+
+@traced()
 def update_surgery_info(s_id: int,
                         p_name: str = None,
                         begin_time: datetime = None,
@@ -113,10 +238,13 @@ def update_surgery_info(s_id: int,
 
     if res == "unsuccessful":
         raise HTTPException(status_code=400, detail="Update failed. Please check the input info.")
-    else:
-        return res
+    if any(x is not None for x in [chief_surgeon, associate_surgeon, instrument_nurse, circulating_nurse,
+                                   instruments, consumables]):
+        refresh_surgery_names(s_id=s_id)
+    return res
 
 
+@traced()
 def insert_surgery_user(begin_time: datetime,
                         end_time: datetime,
                         p_name: str,
@@ -138,30 +266,38 @@ def insert_surgery_user(begin_time: datetime,
     circulating_nurse = list(filter(lambda x: x["is_selected"], circulating_nurse))
     circulating_nurse = list(map(lambda x: x["value"], circulating_nurse))
 
-    def _revise_consumables(x):
-        c_id = get_newest_supply(n_limit=1, c_name=x["name"])[0]["c_id"]
-        update_supply_description(c_id, x["description"])
-        return c_id
-
-    def _revise_instruments(x):
-        revise_instrument(x["i_id"], x["times"] - 1)
-        return {"id": x["i_id"], "description": x["description"]}
-
-    consumables = list(map(lambda x: _revise_consumables(x), consumables))
-    instruments = list(map(lambda x: _revise_instruments(x), instruments))
-    department = DC_DEPARTMENT.get(department)
-    res = insert_surgery(begin_time=begin_time, date=date, admission_number=admission_number,
-                         end_time=end_time, department=department, s_name=s_name, p_name=p_name,
-                         chief_surgeon=chief_surgeon, associate_surgeon=associate_surgeon,
-                         instrument_nurse=instrument_nurse, circulating_nurse=circulating_nurse,
-                         instruments=instruments, consumables=consumables)
+    # instruments first, an unknown instrument rejects the surgery before any supply is claimed
+    used = use_instruments_by_id(list(map(lambda x: x["i_id"], instruments)))
+    claimed = []
+    try:
+        claimed = allocate_consumables(list(map(lambda x: {"c_name": x["name"], "description": x["description"]},
+                                                consumables)))
+        consumables = claimed
+        instruments = list(map(lambda x: {"id": x["i_id"], "description": x["description"]}, instruments))
+        department = DC_DEPARTMENT.get(department)
+        names = build_display_names(chief_surgeon=chief_surgeon, associate_surgeon=associate_surgeon,
+                                    instrument_nurse=instrument_nurse, circulating_nurse=circulating_nurse,
+                                    instruments=instruments, consumables=consumables)
+        res = insert_surgery(begin_time=begin_time, date=date, admission_number=admission_number,
+                             end_time=end_time, department=department, s_name=s_name, p_name=p_name,
+                             chief_surgeon=chief_surgeon, associate_surgeon=associate_surgeon,
+                             instrument_nurse=instrument_nurse, circulating_nurse=circulating_nurse,
+                             instruments=instruments, consumables=consumables, names=names)
+    except Exception:
+        # a failed allocation releases its own claims, only what was taken before the failure is given back
+        return_instruments(used)
+        return_supplies(claimed)
+        raise
 
     if res == "unsuccessful":
+        return_instruments(used)
+        return_supplies(claimed)
         raise HTTPException(status_code=400, detail="Insert failed. Please check the input info.")
     else:
         return res
 
 
+@traced()
 def insert_surgery_admin(begin_time: datetime,
                          end_time: datetime,
                          p_name: str,
@@ -179,12 +315,10 @@ def insert_surgery_admin(begin_time: datetime,
     if department is not None:
         department = DC_DEPARTMENT.get(department)
 
+    used = []
     if instruments is not None:
-        def _revise_instruments(x):
-            revise_instrument(x["id"], x["times"] - 1)
-            return {"id": x["id"], "description": x["description"]}
-
-        instruments = list(map(lambda x: _revise_instruments(x), instruments))
+        used = use_instruments_by_id(list(map(lambda x: x["id"], instruments)))
+        instruments = list(map(lambda x: {"id": x["id"], "description": x["description"]}, instruments))
 
     if consumables is not None:
         def _revise_consumables(x):
@@ -193,13 +327,17 @@ def insert_surgery_admin(begin_time: datetime,
 
         consumables = list(map(lambda x: _revise_consumables(x), consumables))
 
+    names = build_display_names(chief_surgeon=chief_surgeon, associate_surgeon=associate_surgeon,
+                                instrument_nurse=instrument_nurse, circulating_nurse=circulating_nurse,
+                                instruments=instruments, consumables=consumables)
     res = insert_surgery(begin_time=begin_time, date=date, admission_number=admission_number,
                          end_time=end_time, department=department, s_name=s_name, p_name=p_name,
                          chief_surgeon=chief_surgeon, associate_surgeon=associate_surgeon,
                          instrument_nurse=instrument_nurse, circulating_nurse=circulating_nurse,
-                         instruments=instruments, consumables=consumables)
+                         instruments=instruments, consumables=consumables, names=names)
 
     if res == "unsuccessful":
+        return_instruments(used)
         raise HTTPException(status_code=400, detail="Insert failed. Please check the input info.")
     else:
         return res
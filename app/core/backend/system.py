@@ -0,0 +1,97 @@
+"""
+Service health operations
+"""
+from fastapi import HTTPException
+from fastapi.concurrency import run_in_threadpool
+
+from app.core.database.base import mongo
+from app.core.database.aio.base import warmup
+from app.core.metrics import registry, Gauge
+from app.core.profiler import profile_worker, get_request_profile, ProfilerBusy
+from app.core.slow_queries import slow_queries, SORT_KEYS
+from app.core.tracing import tracer
+
+
+async def get_readiness():
+    """
+    Check both database clients and report their pools.
+    """
+    sync_ready = await run_in_threadpool(mongo.warmup)
+    async_ready = await warmup()
+    if not sync_ready or not async_ready:
+        raise HTTPException(status_code=503, detail="Database is unreachable.")
+    return {"status": "ready", "pool": mongo.stats()}
+
+
+@registry.collector
+def _pool_metrics():
+    connections = Gauge("davinci_mongo_pool_connections", "Connections of the Mongo pools by server.",
+                        ("server", "state"))
+    for server, stats in mongo.pool_stats.stats().items():
+        connections.set(stats["open"], server=server, state="open")
+        connections.set(stats["in_use"], server=server, state="in_use")
+    return [connections]
+
+
+def get_metrics() -> str:
+    """Render every metric in the Prometheus text format."""
+    return registry.render()
+
+
+def get_slow_query_report(top: int = 20, sort_by: str = "total", collection: str = None, reset: bool = False):
+    """
+    Top filter shapes of the commands slower than the slow query threshold.
+
+    :param top: number of shapes returned
+    :param sort_by: one of SORT_KEYS
+    :param collection: only this collection if given
+    :param reset: start a new report after this one
+    """
+    if sort_by not in SORT_KEYS:
+        raise HTTPException(status_code=400, detail=f"sort_by must be one of {', '.join(SORT_KEYS)}.")
+    report = slow_queries.report(top=top, sort_by=sort_by, collection=collection)
+    if reset:
+        slow_queries.reset()
+    return report
+
+
+def get_traces(limit: int = 20, trace_id: str = None, min_duration_ms: float = 0):
+    """
+    Waterfalls of the last traces kept in memory.
+
+    :param limit: number of traces returned
+    :param trace_id: only this trace, as returned in the X-Trace-Id header
+    :param min_duration_ms: skip faster traces
+    """
+    if tracer.memory is None:
+        raise HTTPException(status_code=400, detail="The memory trace exporter is disabled.")
+    return tracer.memory.traces(limit=limit, trace_id=trace_id, min_duration_ms=min_duration_ms)
+
+
+async def run_profile(seconds: float, interval_ms: int = 10, idle: bool = False, memory: bool = False, top: int = 20):
+    """
+    Sample every thread of this worker for some seconds.
+
+    :param seconds: duration of the profile
+    :param interval_ms: milliseconds between two samples
+    :param idle: keep the stacks of waiting threads
+    :param memory: also return the top allocations of tracemalloc
+    :param top: number of allocations returned
+    :return: {"seconds", "samples", "collapsed": flamegraph input, "allocations"}
+    """
+    try:
+        return await profile_worker(seconds, interval_ms / 1000, idle=idle, memory=memory, top=top)
+    except ProfilerBusy:
+        raise HTTPException(status_code=409, detail="A profile is already running on this worker.")
+
+
+def get_profile(profile_id: str):
+    """
+    Profile of a request sent with the X-Profile header.
+
+    :param profile_id: id returned in the X-Profile-Id header
+    """
+    profile = get_request_profile(profile_id)
+    if profile is None:
+        raise HTTPException(status_code=400, detail="No such profile on this worker, please check profile_id.")
+    return profile
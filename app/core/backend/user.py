@@ -3,15 +3,19 @@ Generic functions for all users
 """
 from typing import Optional
 
-from fastapi import HTTPException
+from fastapi import HTTPException, Depends
+from fastapi.concurrency import run_in_threadpool
 
 from app.constant import USER_DICT
 from app.core.database import update_user, get_user, insert_user
+from app.core.database import aio
 from app.core.backend.auth import AuthHandler
+from app.core.tracing import traced
 
 auth = AuthHandler()
 
 
+@traced()
 def revise_user_info(u_id: str,
                      pwd: str = None,
                      name: str = None,
@@ -28,6 +32,7 @@ def revise_user_info(u_id: str,
         return res
 
 
+@traced()
 def get_user_type(u_id: str):
     """
     Get specific user's type.
@@ -42,6 +47,7 @@ def get_user_type(u_id: str):
     return user["user_type"]
 
 
+@traced()
 def register(u_id: str, name: str, user_type: str, pwd: str):
     """Register one user."""
     if len(get_user(u_id=u_id)) != 0:
@@ -51,14 +57,41 @@ def register(u_id: str, name: str, user_type: str, pwd: str):
     return insert_user(u_id=u_id, name=name, user_type=user_type, code=hashed_pwd)
 
 
-def login(u_id: str, pwd: str):
+@traced()
+async def login(u_id: str, pwd: str):
     """User login."""
     try:
-        user = get_user(u_id=u_id)[0]
+        user = (await aio.get_user(u_id=u_id))[0]
     except IndexError:
         raise HTTPException(status_code=400, detail="Invalid userid")
-    if auth.verify_pwd(pwd, user["code"]) is False:
+    # bcrypt is cpu bound, keep it off the event loop
+    if await run_in_threadpool(auth.verify_pwd, pwd, user["code"]) is False:
         raise HTTPException(status_code=400, detail="Invalid password")
     else:
         token = auth.encode_token(user_id=u_id)
         return {"token": token, "user_type": user["user_type"], "name": user["name"], "u_id": user["u_id"]}
+
+
+@traced()
+async def is_admin(u_id: str) -> bool:
+    """Whether a user is an administrator."""
+    user = await aio.get_user(u_id=u_id)
+    return len(user) != 0 and user[0]["user_type"] == USER_DICT["管理员"]
+
+
+async def require_admin(u_id: str = Depends(auth.decode_token)):
+    """Dependency letting administrators only through."""
+    if not await is_admin(u_id):
+        raise HTTPException(status_code=403, detail="Administrators only.")
+    return u_id
+
+
+async def authorize_admin_scope(scope) -> bool:
+    """Whether the token header of a raw ASGI request belongs to an administrator, for middlewares."""
+    for k, v in scope.get("headers", []):
+        if k == b"token":
+            try:
+                return await is_admin(auth.decode_token(v.decode("latin-1")))
+            except HTTPException:
+                return False
+    return False
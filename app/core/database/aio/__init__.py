@@ -0,0 +1,5 @@
+from app.core.database.aio.apparatus import *
+from app.core.database.aio.supply import *
+from app.core.database.aio.surgery import *
+from app.core.database.aio.user import *
+from app.core.database.aio.message import *
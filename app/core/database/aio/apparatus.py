@@ -0,0 +1,136 @@
+"""
+Async CURD functions for apparatus document
+"""
+import logging
+from typing import Union
+from datetime import datetime
+
+from pymongo import UpdateOne
+
+from app.core.database.aio.base import apparatus
+from app.core.database.apparatus import get_filter, _used, _after_use
+from app.core.deadline import bounded
+
+log = logging.getLogger(__name__)
+
+
+async def get_instrument(begin_time: datetime = None,
+                         end_time: datetime = None,
+                         i_id: Union[int, list[int]] = None,
+                         i_name: Union[str, list[str]] = None,
+                         times: Union[int, list[int]] = None,
+                         validity: bool = None,
+                         qr_code: bool = False):
+    """
+    Get specific instrument.
+
+    :param begin_time: insert_time should >= begin_time
+    :param end_time: insert_time should < begin_time
+    :param i_id: instrument id, must be not overlay int
+    :param i_name: instrument's name
+    :param times: times the instrument used
+    :param validity: instruments' validity, if times=0, invalid
+    :param qr_code: also return the qr_code picture, it is by far the largest field
+    :return: list of instruments
+    """
+    projection = {"_id": 0} if qr_code else {"_id": 0, "qr_code": 0}
+    f = get_filter(begin_time=begin_time, end_time=end_time, i_id=i_id, i_name=i_name, times=times, validity=validity)
+    return await bounded(apparatus.find(f, projection)).to_list(length=None)
+
+
+async def delete_instrument(begin_time: datetime = None,
+                            end_time: datetime = None,
+                            i_id: Union[int, list[int]] = None,
+                            i_name: Union[str, list[str]] = None,
+                            times: Union[int, list[int]] = None,
+                            validity: bool = None):
+    """
+    Delete specific instrument.
+
+    :param begin_time: insert_time should >= begin_time
+    :param end_time: insert_time should < begin_time
+    :param i_id: instrument id, must be not overlay int
+    :param i_name: instrument's name
+    :param times: times the instrument used
+    :param validity: instruments' validity, if times=0, invalid
+    :return: message of whether successfully deleted
+    """
+    f = get_filter(begin_time=begin_time, end_time=end_time, i_id=i_id, i_name=i_name, times=times, validity=validity)
+    try:
+        await apparatus.delete_many(f)
+        return "successful"
+    except Exception as e:
+        log.error(f"mongodb delete operation in apparatus collection failed and raise the following exception: {e}")
+        return "unsuccessful"
+
+
+async def update_instrument(v_times: int,
+                            begin_time: datetime = None,
+                            end_time: datetime = None,
+                            i_id: Union[int, list[int]] = None,
+                            i_name: Union[str, list[str]] = None,
+                            times: Union[int, list[int]] = None,
+                            validity: bool = None):
+    """
+    Update specific instrument's times.
+
+    :param begin_time: insert_time should >= begin_time
+    :param end_time: insert_time should < begin_time
+    :param v_times: times need to be updated
+    :param i_id: instrument id, must not be overlaid
+    :param i_name: instrument's name
+    :param times: times the instrument used
+    :param validity: instruments' validity, if times=0, invalid
+    :return: message of whether successfully updated
+    """
+    if v_times > 12 or v_times < -1:
+        log.error("Value error, using times of a certain instrument should be in [-1, 12]")
+        return "unsuccessful"
+    f = get_filter(begin_time=begin_time, end_time=end_time, i_id=i_id, i_name=i_name, times=times,
+                   validity=validity)
+    try:
+        await apparatus.update_many(f, {"$set": {"times": v_times}})
+        return "successful"
+    except Exception as e:
+        log.error(f"mongodb update operation in apparatus collection failed and raise the following exception: {e}")
+        return "unsuccessful"
+
+
+async def use_instruments(i_id: list[int]):
+    """
+    Atomically take one use off every instrument of a surgery, in one bulk write, see apparatus.use_instruments.
+
+    :param i_id: ids of the instruments used, an id listed twice is used twice
+    :return: message of whether successfully updated, each instrument's new times and exhaustion flag, the ids
+             that do not exist, and the uses taken off
+    """
+    if len(i_id) == 0:
+        return {"msg": "successful", "instruments": [], "missing": [], "used": []}
+    requests = [UpdateOne({"i_id": x, "times": {"$gt": 0}}, {"$inc": {"times": -1}}) for x in i_id]
+    try:
+        before = await apparatus.find({"i_id": {"$in": i_id}},
+                                      {"_id": 0, "i_id": 1, "i_name": 1, "times": 1}).to_list(length=None)
+        found = {x["i_id"]: x["times"] for x in before}
+        missing = sorted(set(i_id) - set(found))
+        if missing:
+            return {"msg": "unsuccessful", "instruments": [], "missing": missing, "used": []}
+        res = await apparatus.bulk_write(requests, ordered=False)
+    except Exception as e:
+        log.error(f"mongodb update operation in apparatus collection failed and raise the following exception: {e}")
+        return {"msg": "unsuccessful", "instruments": [], "missing": [], "used": []}
+    if res.matched_count != len(requests):
+        log.warning(f"{len(requests) - res.matched_count} of instruments {i_id} were already exhausted")
+    used = _used(i_id, found)
+    return {"msg": "successful", "instruments": _after_use(before, used), "missing": [], "used": used}
+
+
+async def return_instruments(i_id: list[int]):
+    """Give back the uses taken by use_instruments, see apparatus.return_instruments."""
+    if len(i_id) == 0:
+        return "successful"
+    try:
+        await apparatus.bulk_write([UpdateOne({"i_id": x}, {"$inc": {"times": 1}}) for x in i_id], ordered=False)
+        return "successful"
+    except Exception as e:
+        log.error(f"mongodb update operation in apparatus collection failed and raise the following exception: {e}")
+        return "unsuccessful"
@@ -0,0 +1,36 @@
+"""
+asyncio version of base.py, connect Davinci database with motor using the same settings
+"""
+import logging
+
+from motor.motor_asyncio import AsyncIOMotorClient
+
+from app.core.database.base import mongo
+
+log = logging.getLogger(__name__)
+
+client = AsyncIOMotorClient(mongo.settings.uri, event_listeners=[mongo.command_events],
+                            **mongo.settings.client_kwargs())
+davinci_db = client[mongo.settings.db]
+surgery = davinci_db.surgery
+user = davinci_db.user
+apparatus = davinci_db.apparatus
+supplies = davinci_db.supplies
+supply_stock = davinci_db.supply_stock
+message = davinci_db.message
+message_count = davinci_db.message_count
+counters = davinci_db.counters
+
+
+async def warmup() -> bool:
+    """
+    Open the motor pool and check the server, waits at most serverSelectionTimeoutMS.
+
+    :return: whether the database is reachable
+    """
+    try:
+        await client.admin.command("ping")
+        return True
+    except Exception as e:
+        log.error(f"mongodb warmup failed and raise the following exception: {e}")
+        return False
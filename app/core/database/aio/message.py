@@ -0,0 +1,197 @@
+"""
+Async CURD functions for message document
+"""
+import logging
+from datetime import datetime
+from typing import Union
+
+from pymongo import DeleteOne, ReturnDocument
+from pymongo.errors import BulkWriteError
+
+from app.core.database.aio.base import message, message_count
+from app.core.database.aio.utils import get_page
+from app.core.database.message import get_filter, count_key, count_deltas, count_requests, UNHANDLED
+from app.core.database.utils import page_sort
+from app.core.deadline import bounded
+from app.core.inbox import broker
+
+log = logging.getLogger(__name__)
+
+
+async def get_message(m_id: int = None,
+                      status: Union[list[int], int] = None,
+                      priority: Union[list[int], int] = None,
+                      u_id: str = None,
+                      u_name: str = None,
+                      time: datetime = None,
+                      begin_time: datetime = None,
+                      end_time: datetime = None):
+    """
+    Get message.
+
+    :param m_id: message id
+    :param status: status of the message, {0: unreviewed, 1: pending, 2: done}
+    :param priority: priority of the message, {0: unimportant, 1: normal, 2: important}
+    :param u_id: user's id who send the message.
+    :param u_name: user's name who send the message.
+    :param time: sending time
+    :param begin_time: begin time
+    :param end_time: end time
+    :return: message
+    """
+    f = get_filter(m_id=m_id, status=status, priority=priority,
+                   u_id=u_id, u_name=u_name, time=time, begin_time=begin_time, end_time=end_time)
+    return await bounded(message.find(f, {"_id": 0})).to_list(length=None)
+
+
+async def get_message_page(page: int,
+                           limit_size: int,
+                           sort_by: str = "insert_time",
+                           descending: bool = True,
+                           status: Union[list[int], int] = None,
+                           priority: Union[list[int], int] = None,
+                           u_id: str = None,
+                           begin_time: datetime = None,
+                           end_time: datetime = None):
+    """
+    Get one page of messages.
+
+    :param page: page number, starts from 1
+    :param limit_size: page size
+    :param sort_by: one of MESSAGE_SORT_FIELDS
+    :param descending: sort order, newest first by default
+    :param status: status of the message, {0: unreviewed, 1: pending, 2: done}
+    :param priority: priority of the message, {0: unimportant, 1: normal, 2: important}
+    :param u_id: user's id who send the message.
+    :param begin_time: begin time
+    :param end_time: end time
+    :return: {"total": number of matching messages, "data": messages of the page}
+    """
+    f = get_filter(status=status, priority=priority, u_id=u_id, begin_time=begin_time, end_time=end_time)
+    return await get_page(message, f, {"_id": 0}, page_sort(sort_by, descending, "m_id"), page, limit_size)
+
+
+async def _inc_counts(changes: list[tuple]):
+    requests = count_requests(count_deltas(changes))
+    if len(requests) != 0:
+        await message_count.bulk_write(requests, ordered=False)
+
+
+async def get_message_counts(u_id: str = None) -> dict:
+    """
+    Get inbox counters.
+
+    :param u_id: user's id, all messages if None
+    :return: {"unhandled": messages waiting for an administrator, "unread": changes the user has not seen yet}
+    """
+    doc = await message_count.find_one({"_id": count_key(u_id)}) or {}
+    return {"unhandled": doc.get("unhandled", 0), "unread": doc.get("unread", 0)}
+
+
+async def mark_messages_read(u_id: str):
+    """Reset the unread counter of a user."""
+    await message_count.update_one({"_id": count_key(u_id)}, {"$set": {"unread": 0}}, upsert=True)
+
+
+async def insert_message(u_id: str, u_name: str, content: str):
+    """
+    Insert message.
+    """
+    last_m_id = await message.find().sort([('m_id', -1)]).limit(1).to_list(length=1)
+    # get last message id
+    if len(last_m_id) == 0:
+        m_id = 0
+    else:
+        m_id = last_m_id[0]["m_id"] + 1
+
+    insert_doc = dict(m_id=m_id, status=UNHANDLED, priority=1, feedback="NULL",
+                      u_id=u_id, u_name=u_name, insert_time=datetime.utcnow(), content=content)
+    try:
+        await message.insert_one(insert_doc)
+        await _inc_counts([(u_id, None, UNHANDLED, False)])
+        broker.publish({"type": "created", "m_id": m_id, "u_id": u_id, "status": UNHANDLED, "priority": 1})
+        return "successful"
+    except Exception as e:
+        log.error(f"mongodb insert operation in message collection failed and raise the following exception: {e}")
+        return "unsuccessful"
+
+
+async def delete_message(m_id: Union[int, list] = None,
+                         status: Union[list[int], int] = None,
+                         priority: Union[list[int], int] = None,
+                         u_id: str = None,
+                         u_name: str = None,
+                         time: datetime = None,
+                         begin_time: datetime = None,
+                         end_time: datetime = None):
+    """
+    Delete message.
+
+    :param m_id: message id
+    :param status: status of the message, {0: unreviewed, 1: pending, 2: done}
+    :param priority: priority of the message, {0: unimportant, 1: normal, 2: important}
+    :param u_id: user's id who send the message.
+    :param u_name: user's name who send the message.
+    :param time: sending time
+    :param begin_time: begin time
+    :param end_time: end time
+    :return: delete operation message, unsuccessful if a message changed status while being deleted and was kept.
+    """
+    f = get_filter(m_id=m_id, status=status, priority=priority,
+                   u_id=u_id, u_name=u_name, time=time, begin_time=begin_time, end_time=end_time)
+    try:
+        targets = await message.find(f, {"_id": 0, "m_id": 1, "u_id": 1, "status": 1}).to_list(length=None)
+        if len(targets) == 0:
+            return "successful"
+        # each message is deleted on the status read, so the counters move by exactly what was deleted
+        try:
+            res = await message.bulk_write([DeleteOne({"m_id": x["m_id"], "status": x["status"]}) for x in targets],
+                                           ordered=False)
+            removed = res.deleted_count
+        except BulkWriteError as e:
+            removed = e.details["nRemoved"]
+        deleted = targets
+        if removed < len(targets):
+            # some messages changed between the read and the delete, or failed, they are kept
+            kept = set(await message.distinct("m_id", {"m_id": {"$in": [x["m_id"] for x in targets]}}))
+            deleted = [x for x in targets if x["m_id"] not in kept]
+            log.error(f"messages {sorted(kept)} changed while being deleted and were kept")
+        await _inc_counts([(x["u_id"], x["status"], None, False) for x in deleted])
+        for x in deleted:
+            broker.publish({"type": "deleted", "m_id": x["m_id"], "u_id": x["u_id"]})
+        return "successful" if len(deleted) == len(targets) else "unsuccessful"
+    except Exception as e:
+        log.error(f"mongodb delete operation in message collection failed and raise the following exception: {e}")
+        return "unsuccessful"
+
+
+async def update_message(m_id: int, status: int = None, priority: int = None, feedback: str = None):
+    """
+    Update message.
+
+    :param m_id: message id
+    :param status: status of the message, {0: unreviewed, 1: pending, 2: done}
+    :param priority: priority of the message, {0: unimportant, 1: normal, 2: important}
+    :param feedback: feedback from administrator
+    :return: update message
+    """
+    f = get_filter(m_id=m_id)
+    new_value = {}
+    if status:
+        new_value["status"] = status
+    if priority:
+        new_value["priority"] = priority
+    if feedback:
+        new_value["feedback"] = feedback
+    if not new_value:
+        return "successful"
+    try:
+        before = await message.find_one_and_update(f, {"$set": new_value}, {"_id": 0, "u_id": 1, "status": 1},
+                                                   return_document=ReturnDocument.BEFORE)
+        if before is not None:
+            await _inc_counts([(before["u_id"], before["status"], new_value.get("status", before["status"]), True)])
+            broker.publish({"type": "updated", "m_id": m_id, "u_id": before["u_id"], **new_value})
+        return "successful"
+    except Exception as e:
+        log.error(f"mongodb update operation in message collection failed and raise the following exception: {e}")
+        return "unsuccessful"
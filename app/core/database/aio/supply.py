@@ -0,0 +1,216 @@
+"""
+Async CURD functions for supplies document
+"""
+import logging
+from datetime import datetime
+from typing import Union
+from uuid import uuid4
+
+from pymongo import UpdateOne
+
+from app.core.database.aio.base import supplies, supply_stock
+from app.core.database.aio.utils import reserve_ids
+from app.core.database.supply import get_filter
+from app.core.deadline import bounded
+
+log = logging.getLogger(__name__)
+
+
+async def get_supply(begin_time: datetime = None,
+                     end_time: datetime = None,
+                     c_id: Union[int, list[int]] = None,
+                     c_name: Union[str, list[str]] = None,
+                     description: Union[str, list[str]] = None,
+                     validity: bool = None):
+    """
+    Get specific supply.
+
+    :param begin_time: insert_time should >= begin_time
+    :param end_time: insert_time should < begin_time
+    :param c_id: supply id, must be not overlay int
+    :param c_name: supply's name
+    :param description: supply's description
+    :param validity: true or false
+    :return: list of supplies
+    """
+    f = get_filter(begin_time=begin_time, end_time=end_time, c_id=c_id, c_name=c_name, description=description,
+                   validity=validity)
+    return await bounded(supplies.find(f, {"_id": 0, "allocation": 0})).to_list(length=None)
+
+
+async def get_supply_stock(c_name: Union[str, list[str]] = None, available: bool = None):
+    """
+    Get available stock counters.
+
+    :param c_name: supply's name
+    :param available: only names in stock if true, only names out of stock if false
+    :return: list of {c_name, available}
+    """
+    f = get_filter(c_name=c_name)
+    if available is True:
+        f["available"] = {"$gt": 0}
+    elif available is False:
+        f["available"] = {"$lte": 0}
+    return await bounded(supply_stock.find(f, {"_id": 0})).to_list(length=None)
+
+
+async def insert_supply(c_name: str,
+                        description: str = ""):
+    """
+    Insert a specific supply.
+
+    :param c_name: supply's name
+    :param description: supply's description
+    :return: message of whether successfully inserted
+    """
+    try:
+        c_id = await reserve_ids(supplies, "c_id")
+        insert_doc = dict(c_id=c_id, c_name=c_name, insert_time=datetime.now(), description=description)
+        await supplies.insert_one(insert_doc)
+        if description == "":
+            await _inc_stock({c_name: 1})
+        return "successful"
+    except Exception as e:
+        log.error(f"mongodb insert operation in supplies collection failed and raise the following exception: {e}")
+        return "unsuccessful"
+
+
+async def delete_supply(begin_time: datetime = None,
+                        end_time: datetime = None,
+                        c_id: Union[int, list[int]] = None,
+                        c_name: Union[str, list[str]] = None,
+                        description: Union[str, list[str]] = None):
+    """
+    Delete specific supply.
+
+    :param begin_time: insert_time should >= begin_time
+    :param end_time: insert_time should < begin_time
+    :param c_id: supply id, must be not overlay int
+    :param c_name: supply's name
+    :param description: supply's description
+    :return: message of whether successfully deleted
+    """
+    f = get_filter(c_id=c_id, c_name=c_name, begin_time=begin_time, end_time=end_time, description=description)
+
+    async def _delete(x):
+        return (await supplies.delete_many(x)).deleted_count
+
+    try:
+        unused = await _write_by_name(f, "", _delete)
+        await supplies.delete_many({"$and": [f, {"description": {"$ne": ""}}]})
+        await _inc_stock({k: -v for k, v in unused.items()})
+        return "successful"
+    except Exception as e:
+        log.error(f"mongodb delete operation in supplies collection failed and raise the following exception: {e}")
+        return "unsuccessful"
+
+
+async def update_supply(begin_time: datetime = None,
+                        end_time: datetime = None,
+                        c_id: Union[int, list[int]] = None,
+                        c_name: Union[str, list[str]] = None,
+                        description: Union[str, list[str]] = None):
+    """
+    Update specific supply's description.
+
+    :param begin_time: insert_time should >= begin_time
+    :param end_time: insert_time should < begin_time
+    :param c_id: supply id, must be not overlay int
+    :param c_name: supply's name
+    :param description: supply's description
+    :return: message of whether successfully updated
+    """
+    f = get_filter(begin_time=begin_time, end_time=end_time, c_id=c_id, c_name=c_name)
+    new_value = {"$set": {"description": description}}
+
+    async def _update(x):
+        return (await supplies.update_many(x, new_value)).modified_count
+
+    try:
+        if description == "":
+            await _inc_stock(await _write_by_name(f, {"$ne": ""}, _update))
+        else:
+            claimed = await _write_by_name(f, "", _update)
+            await supplies.update_many({"$and": [f, {"description": {"$ne": ""}}]}, new_value)
+            await _inc_stock({k: -v for k, v in claimed.items()})
+        return "successful"
+    except Exception as e:
+        log.error(f"mongodb update operation in supplies collection failed and raise the following exception: {e}")
+        return "unsuccessful"
+
+
+async def allocate_supplies(consumables: list[dict]):
+    """
+    Claim unused supplies in one bulk write, see supply.allocate_supplies.
+
+    :param consumables: one {c_name: "无菌壁套", description: "默认"} per supply needed, description can't be empty
+    :return: message of whether successfully allocated, claimed supplies in request order and missing names
+    """
+    if len(consumables) == 0:
+        return {"msg": "successful", "supplies": [], "missing": []}
+    allocation = uuid4().hex
+    requests = [UpdateOne({"c_name": x["c_name"], "description": ""},
+                          {"$set": {"description": x["description"], "allocation": allocation}})
+                for x in consumables]
+    try:
+        await supplies.bulk_write(requests, ordered=False)
+        claimed = await supplies.find({"allocation": allocation},
+                                      {"_id": 0, "allocation": 0}).sort([('c_id', 1)]).to_list(length=None)
+    except Exception as e:
+        log.error(f"mongodb update operation in supplies collection failed and raise the following exception: {e}")
+        return {"msg": "unsuccessful", "supplies": [], "missing": []}
+
+    res, missing = [], []
+    for x in consumables:
+        supply = next((y for y in claimed if y["c_name"] == x["c_name"] and y["description"] == x["description"]),
+                      None)
+        if supply is None:
+            missing.append(x["c_name"])
+        else:
+            claimed.remove(supply)
+            res.append(supply)
+    if missing:
+        await release_supplies(allocation)
+        return {"msg": "unsuccessful", "supplies": [], "missing": missing}
+    allocated = {}
+    for x in res:
+        allocated[x["c_name"]] = allocated.get(x["c_name"], 0) - 1
+    await _inc_stock(allocated)
+    return {"msg": "successful", "supplies": res, "missing": []}
+
+
+async def release_supplies(allocation: str):
+    """
+    Put the supplies of an allocation back into stock.
+
+    :param allocation: allocation id
+    :return: message of whether successfully released
+    """
+    try:
+        await supplies.update_many({"allocation": allocation},
+                                   {"$set": {"description": ""}, "$unset": {"allocation": ""}})
+        return "successful"
+    except Exception as e:
+        log.error(f"mongodb update operation in supplies collection failed and raise the following exception: {e}")
+        return "unsuccessful"
+
+
+async def _write_by_name(f: dict, description, write) -> dict:
+    """
+    Run write on the supplies matching the filter and description one name at a time, one distinct plus one write
+    per name, see supply._write_by_name for why it is not a single bulk_write.
+
+    :param write: async function of a filter returning the number of supplies it deleted or modified
+    :return: {c_name: number of supplies written}
+    """
+    counts = {}
+    for name in await supplies.distinct("c_name", {"$and": [f, {"description": description}]}):
+        counts[name] = await write({"$and": [f, {"c_name": name, "description": description}]})
+    return counts
+
+
+async def _inc_stock(delta: dict):
+    """Apply {c_name: delta} to the available stock counters."""
+    requests = [UpdateOne({"c_name": k}, {"$inc": {"available": v}}, upsert=True) for k, v in delta.items() if v]
+    if len(requests) != 0:
+        await supply_stock.bulk_write(requests, ordered=False)
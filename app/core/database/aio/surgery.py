@@ -0,0 +1,193 @@
+"""
+Async CURD functions for surgery document
+"""
+from datetime import datetime
+import logging
+from typing import Union
+
+from app.core.database.aio.base import surgery
+from app.core.database.surgery import get_filter
+from app.core.deadline import bounded
+
+log = logging.getLogger(__name__)
+
+
+async def get_surgery(skip_size: int = None,
+                      limit_size: int = None,
+                      s_id: int = None,
+                      begin_time: datetime = None,
+                      end_time: datetime = None,
+                      date: datetime = None,
+                      p_name: Union[str, list[str]] = None,
+                      admission_number: Union[int, list[int]] = None,
+                      department: Union[str, list[str]] = None,
+                      s_name: Union[str, list[str]] = None,
+                      chief_surgeon: Union[str, list[str]] = None,
+                      associate_surgeon: Union[str, list[str]] = None,
+                      instrument_nurse: Union[str, list[str]] = None,
+                      circulating_nurse: Union[str, list[str]] = None):
+    """
+    Get specific surgery.
+
+    :param skip_size: skip size
+    :param limit_size: pagintion parameter, limit page size
+    :param s_id: surgery id
+    :param begin_time: begin time
+    :param end_time: end time
+    :param date: surgery date
+    :param p_name: patient's name
+    :param admission_number: admission number
+    :param department: department of chief surgeon
+    :param s_name: surgery name
+    :param chief_surgeon: chief surgeon
+    :param associate_surgeon: associate surgeon
+    :param instrument_nurse: instrument nurse
+    :param circulating_nurse: circulating nurse
+    :return: list of surgeries
+    """
+    f = get_filter(s_id=s_id, p_name=p_name, admission_number=admission_number, department=department,
+                   s_name=s_name, chief_surgeon=chief_surgeon, associate_surgeon=associate_surgeon,
+                   instrument_nurse=instrument_nurse, circulating_nurse=circulating_nurse,
+                   begin_time=begin_time, end_time=end_time, date=date)
+    cursor = bounded(surgery.find(f, {"_id": 0}))
+    if skip_size is not None:
+        cursor = cursor.skip(skip_size)
+    if limit_size is not None:
+        cursor = cursor.limit(limit_size)
+    return await cursor.to_list(length=None)
+
+
+async def insert_surgery(p_name: str,
+                         admission_number: int,
+                         department: str,
+                         s_name: str,
+                         chief_surgeon: str,
+                         associate_surgeon: str,
+                         instrument_nurse: list[str],
+                         circulating_nurse: list[str],
+                         date: datetime,
+                         begin_time: datetime,
+                         end_time: datetime,
+                         instruments: list[dict],
+                         consumables: list[int],
+                         names: dict = None):
+    """
+    Add one doc in surgery document.
+
+    :param p_name: patient's name
+    :param admission_number: admission number
+    :param department: department of chief surgeon
+    :param s_name: surgery name
+    :param chief_surgeon: chief surgeon
+    :param associate_surgeon: associate surgeon
+    :param instrument_nurse: instrument nurse
+    :param circulating_nurse: circulating nurse
+    :param date: date of the surgery
+    :param begin_time: surgery's begin time
+    :param end_time: surgery's end time
+    :param instruments: instruments, format in {id: 1, description: "默认"}
+    :param consumables: consumables, format in [1 ,2]
+    :param names: display names of the referenced users, instruments and consumables
+    :return: message of whether successfully inserted
+    """
+    s_id = await surgery.find().sort([('s_id', -1)]).limit(1).to_list(length=1)
+    if len(s_id) == 0:
+        s_id = 0
+    else:
+        s_id = s_id[0]["s_id"] + 1
+
+    try:
+        insert_doc = dict(s_id=s_id, p_name=p_name, date=date, admission_number=admission_number,
+                          department=department, s_name=s_name, chief_surgeon=chief_surgeon,
+                          associate_surgeon=associate_surgeon,
+                          instrument_nurse=instrument_nurse, circulating_nurse=circulating_nurse, begin_time=begin_time,
+                          end_time=end_time, instruments=instruments, consumables=consumables)
+        if names is not None:
+            insert_doc["names"] = names
+        await surgery.insert_one(insert_doc)
+        return "successful"
+    except Exception as e:
+        log.error(f"mongodb insert operation in surgery collection failed and raise the following exception: {e}")
+        return "unsuccessful"
+
+
+async def delete_surgery(s_id: int = None,
+                         begin_time: datetime = None,
+                         end_time: datetime = None,
+                         department: Union[str, list[str]] = None,
+                         s_name: Union[str, list[str]] = None,
+                         chief_surgeon: Union[str, list[str]] = None,
+                         associate_surgeon: Union[str, list[str]] = None,
+                         instrument_nurse: Union[str, list[str]] = None,
+                         circulating_nurse: Union[str, list[str]] = None):
+    """
+    Delete one doc in surgery document.
+
+    :param s_id: surgery id
+    :param department: department of chief surgeon
+    :param s_name: surgery name
+    :param chief_surgeon: chief surgeon
+    :param associate_surgeon: associate surgeon
+    :param instrument_nurse: instrument nurse
+    :param circulating_nurse: circulating nurse
+    :param begin_time: surgery's begin time
+    :param end_time: surgery's end time
+    :return: message of whether successfully deleted
+    """
+    f = get_filter(s_id=s_id, department=department, s_name=s_name, chief_surgeon=chief_surgeon,
+                   associate_surgeon=associate_surgeon, instrument_nurse=instrument_nurse,
+                   circulating_nurse=circulating_nurse, begin_time=begin_time, end_time=end_time)
+    try:
+        await surgery.delete_many(f)
+        return "successful"
+    except Exception as e:
+        log.error(f"mongodb delete operation in surgery collection failed and raise the following exception: {e}")
+        return "unsuccessful"
+
+
+async def update_surgery(s_id: int,
+                         p_name: str,
+                         begin_time: datetime = None,
+                         end_time: datetime = None,
+                         date: datetime = None,
+                         admission_number: int = None,
+                         department: str = None,
+                         s_name: str = None,
+                         chief_surgeon: str = None,
+                         associate_surgeon: str = None,
+                         instrument_nurse: list = None,
+                         circulating_nurse: list = None,
+                         instruments: list = None,
+                         consumables: list = None,
+                         names: dict = None):
+    """
+    Update one surgery info based on surgery id.
+
+    :param admission_number: admission number
+    :param date: date of the surgery
+    :param s_id: surgery id
+    :param p_name: patient's name
+    :param department: department of chief surgeon
+    :param s_name: surgery name
+    :param chief_surgeon: chief surgeon
+    :param associate_surgeon: associate surgeon
+    :param instrument_nurse: instrument nurse
+    :param circulating_nurse: circulating nurse
+    :param begin_time: surgery's begin time
+    :param end_time: surgery's end time
+    :param instruments: instruments info
+    :param consumables: consumables info
+    :param names: display names of the referenced users, instruments and consumables
+    :return: update message
+    """
+    dc_set = dict(begin_time=begin_time, date=date, admission_number=admission_number, end_time=end_time,
+                  department=department, s_name=s_name, p_name=p_name, associate_surgeon=associate_surgeon,
+                  chief_surgeon=chief_surgeon, instrument_nurse=instrument_nurse,
+                  circulating_nurse=circulating_nurse, consumables=consumables, instruments=instruments, names=names)
+    dc_set = {k: v for k, v in dc_set.items() if v is not None}
+    try:
+        await surgery.update_many(get_filter(s_id=s_id), {"$set": dc_set})
+        return "successful"
+    except Exception as e:
+        log.error(f"mongodb update operation in surgery collection failed and raise the following exception: {e}")
+        return "unsuccessful"
@@ -0,0 +1,145 @@
+"""
+Async CURD functions for user document
+"""
+import logging
+from typing import Union
+from datetime import datetime
+
+from app.constant import USER_DICT
+from app.core.database.aio.base import user
+from app.core.database.aio.utils import get_page
+from app.core.database.user import get_filter
+from app.core.database.utils import page_sort
+from app.core.deadline import bounded
+
+log = logging.getLogger(__name__)
+
+
+async def get_user(u_id: Union[str, list[str]] = None,
+                   name: Union[str, list[str]] = None,
+                   user_type: Union[str, list[str]] = None):
+    """
+    Get specific user.
+
+    :param u_id: user's id
+    :param name: user's name
+    :param user_type: user type
+    :return: specific user's info
+    """
+    f = get_filter(u_id=u_id, name=name, user_type=user_type)
+    return await bounded(user.find(f, {"_id": 0})).to_list(length=None)
+
+
+async def get_user_page(page: int,
+                        limit_size: int,
+                        sort_by: str = "u_id",
+                        descending: bool = False,
+                        u_id: Union[str, list[str]] = None,
+                        name: Union[str, list[str]] = None,
+                        user_type: Union[str, list[str]] = None):
+    """
+    Get one page of users, the password hash is never returned.
+
+    :param page: page number, starts from 1
+    :param limit_size: page size
+    :param sort_by: one of USER_SORT_FIELDS
+    :param descending: sort order
+    :param u_id: user's id
+    :param name: user's name
+    :param user_type: user type
+    :return: {"total": number of matching users, "data": users of the page}
+    """
+    f = get_filter(u_id=u_id, name=name, user_type=user_type)
+    return await get_page(user, f, {"_id": 0, "code": 0}, page_sort(sort_by, descending, "u_id"), page, limit_size)
+
+
+async def insert_user(u_id: str, name: str, user_type: str, code: str):
+    """
+    Insert a specific user, user's code should be encrypted.
+
+    :param u_id: user's id
+    :param name: user's name
+    :param user_type: user type
+    :param code: user's code
+    :return: message of whether successfully inserted
+    """
+    insert_doc = dict(u_id=u_id, name=name, user_type=USER_DICT.get(user_type), code=code,
+                      insert_datetime=datetime.utcnow())
+    try:
+        await user.insert_one(insert_doc)
+        return "successful"
+    except Exception as e:
+        log.error(f"mongodb insert operation in user collection failed and raise the following exception: {e}")
+        return "unsuccessful"
+
+
+async def insert_users(users: list):
+    """
+    Insert a specific user, user's code should be encrypted.
+
+    :param users: dict of users, should be {"u_id": "18851438132", "name": "子淇", "user_type": 0, "code": "16s54vhd"}
+    :return: message of whether successfully inserted
+    """
+    try:
+        await user.insert_many(users)
+        return "successful"
+    except Exception as e:
+        log.error(f"mongodb insert operation in user collection failed and raise the following exception: {e}")
+        return "unsuccessful"
+
+
+async def delete_user(u_id: Union[str, list[str]] = None,
+                      name: Union[str, list[str]] = None,
+                      user_type: Union[str, list[str]] = None):
+    """
+    Delete specific user.
+
+    :param u_id: user's id
+    :param name: user's name
+    :param user_type: user type
+    :return: message of whether successfully deleted
+    """
+    f = get_filter(u_id=u_id, name=name, user_type=user_type)
+    try:
+        await user.delete_many(f)
+        return "successful"
+    except Exception as e:
+        log.error(f"mongodb delete operation in user collection failed and raise the following exception: {e}")
+        return "unsuccessful"
+
+
+async def update_user(u_id: Union[str, list[str]] = None,
+                      name: str = None,
+                      user_type: str = None,
+                      pwd: str = None,
+                      new_id: str = None):
+    """
+    Update specific user. Only support update one user's info.
+
+    :param u_id: user's id
+    :param name: user's name
+    :param user_type: user type
+    :param pwd: user's password
+    :param new_id: new user's id, in case for changing phone number
+    :return: message of whether successfully updated
+    """
+    dc_set = {}
+    if name is not None:
+        dc_set["name"] = name
+    if user_type is not None:
+        dc_set["user_type"] = USER_DICT.get(user_type)
+    if pwd is not None:
+        dc_set["code"] = pwd
+    if new_id is not None:
+        if isinstance(u_id, list):
+            log.error(f"User's id should be unique")
+            return "unsuccessful"
+        else:
+            dc_set["u_id"] = new_id
+    f = get_filter(u_id=u_id)
+    try:
+        await user.update_many(f, {"$set": dc_set})
+        return "successful"
+    except Exception as e:
+        log.error(f"mongodb update operation in user collection failed and raise the following exception: {e}")
+        return "unsuccessful"
@@ -0,0 +1,42 @@
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from app.core.database.aio.base import counters
+from app.core.deadline import bounded, max_time_kwargs
+
+
+async def reserve_ids(collection, key: str, n: int = 1) -> int:
+    """
+    Reserve a block of n consecutive ids for a collection, shares the sequence of utils.reserve_ids.
+
+    :param collection: motor collection the ids belong to
+    :param key: id field, e.g. c_id
+    :param n: size of the block
+    :return: first id of the block
+    """
+    seq = f"{collection.name}.{key}"
+    doc = await counters.find_one_and_update({"_id": seq}, {"$inc": {"next": n}},
+                                             return_document=ReturnDocument.AFTER)
+    if doc is None:
+        last = await collection.find({}, {key: 1}).sort([(key, -1)]).limit(1).to_list(length=1)
+        try:
+            await counters.update_one({"_id": seq}, {"$max": {"next": last[0][key] + 1 if last else 0}}, upsert=True)
+        except DuplicateKeyError:
+            pass
+        doc = await counters.find_one_and_update({"_id": seq}, {"$inc": {"next": n}},
+                                                 return_document=ReturnDocument.AFTER)
+    return doc["next"] - n
+
+
+async def get_page(collection, f: dict, projection: dict, sort: list, page: int, limit_size: int) -> dict:
+    """
+    Get one page of a query together with the number of matching documents, see utils.get_page.
+
+    :return: {"total": number of matching documents, "data": documents of the page}
+    """
+    if f:
+        total = await collection.count_documents(f, **max_time_kwargs())
+    else:
+        total = await collection.estimated_document_count(**max_time_kwargs())
+    cursor = bounded(collection.find(f, projection)).sort(sort).skip((page - 1) * limit_size).limit(limit_size)
+    return {"total": total, "data": await cursor.to_list(length=limit_size)}
@@ -2,13 +2,21 @@
 CURD functions for apparatus document
 """
 import logging
+from collections import Counter
 from typing import Union
 from datetime import datetime
-from app.core.database.base import apparatus
+
+from pymongo import UpdateOne
+
+from app.core.database.base import apparatus, for_read
+from app.core.database.utils import get_page, page_sort
+from app.core.deadline import bounded
 from app.core.utils import generate_qrcode_pic
 
 log = logging.getLogger(__name__)
 
+INSTRUMENT_SORT_FIELDS = ("i_id", "i_name", "times", "insert_time")
+
 
 def get_filter(begin_time: datetime = None,
                end_time: datetime = None,
@@ -68,7 +76,8 @@ def get_instrument(begin_time: datetime = None,
                    i_id: Union[int, list[int]] = None,
                    i_name: Union[str, list[str]] = None,
                    times: Union[int, list[int]] = None,
-                   validity: bool = None):
+                   validity: bool = None,
+                   qr_code: bool = False):
     """
     Get specific instrument.
 
@@ -78,10 +87,49 @@ def get_instrument(begin_time: datetime = None,
     :param i_name: instrument's name
     :param times: times the instrument used
     :param validity: instruments' validity, if times=0, invalid
+    :param qr_code: also return the qr_code picture, it is by far the largest field
     :return: list of instruments
     """
+    projection = {"_id": 0} if qr_code else {"_id": 0, "qr_code": 0}
+    f = get_filter(begin_time=begin_time, end_time=end_time, i_id=i_id, i_name=i_name, times=times, validity=validity)
+    return list(bounded(for_read(apparatus).find(f, projection)))
+
+
+def get_instrument_page(page: int,
+                        limit_size: int,
+                        sort_by: str = "i_id",
+                        descending: bool = False,
+                        begin_time: datetime = None,
+                        end_time: datetime = None,
+                        i_id: Union[int, list[int]] = None,
+                        i_name: Union[str, list[str]] = None,
+                        times: Union[int, list[int]] = None,
+                        validity: bool = None):
+    """
+    Get one page of instruments without their qr_code pictures.
+
+    :param page: page number, starts from 1
+    :param limit_size: page size
+    :param sort_by: one of INSTRUMENT_SORT_FIELDS
+    :param descending: sort order
+    :param begin_time: insert_time should >= begin_time
+    :param end_time: insert_time should < begin_time
+    :param i_id: instrument id, must be not overlay int
+    :param i_name: instrument's name
+    :param times: times the instrument used
+    :param validity: instruments' validity, if times=0, invalid
+    :return: {"total": number of matching instruments, "data": instruments of the page}
+    """
     f = get_filter(begin_time=begin_time, end_time=end_time, i_id=i_id, i_name=i_name, times=times, validity=validity)
-    return list(apparatus.find(f, {"_id": 0}))
+    return get_page(apparatus, f, {"_id": 0, "qr_code": 0}, page_sort(sort_by, descending, "i_id"), page, limit_size)
+
+
+def ensure_instrument_indexes():
+    """Create the indexes used by instrument lookups and the sorted instrument list."""
+    apparatus.create_index("i_id")
+    apparatus.create_index([("i_name", 1), ("i_id", 1)])
+    apparatus.create_index([("times", 1), ("i_id", 1)])
+    apparatus.create_index([("insert_time", 1), ("i_id", 1)])
 
 
 def insert_instrument(i_name: Union[list[str], str],
@@ -198,3 +246,68 @@ def update_instrument(v_times: int,
         except Exception as e:
             log.error(f"mongodb delete operation in apparatus collection failed and raise the following exception: {e}")
             return "unsuccessful"
+
+
+def _used(i_id: list[int], times: dict) -> list[int]:
+    """Ids the uses of i_id take a use off, given the instruments' times before, listed once per use."""
+    times = dict(times)
+    used = []
+    for x in i_id:
+        if times.get(x, 0) > 0:
+            times[x] -= 1
+            used.append(x)
+    return used
+
+
+def _after_use(instruments: list[dict], used: list[int]) -> list[dict]:
+    """The instruments read before a use with the uses taken off their times, and whether they are exhausted."""
+    uses = Counter(used)
+    return [{**x, "times": x["times"] - uses[x["i_id"]], "exhausted": x["times"] - uses[x["i_id"]] <= 0}
+            for x in instruments]
+
+
+def use_instruments(i_id: list[int]):
+    """
+    Atomically take one use off every instrument of a surgery, in one bulk write.
+
+    Instruments whose times already reached 0 are left untouched. Nothing is written if an id does not exist.
+    Two round trips: the instruments are read once, before the write, and their new times derived from it.
+
+    :param i_id: ids of the instruments used, an id listed twice is used twice
+    :return: message of whether successfully updated, each instrument's new times and exhaustion flag, the ids
+             that do not exist, and the uses taken off, to give back with return_instruments if the surgery fails
+    """
+    if len(i_id) == 0:
+        return {"msg": "successful", "instruments": [], "missing": [], "used": []}
+    requests = [UpdateOne({"i_id": x, "times": {"$gt": 0}}, {"$inc": {"times": -1}}) for x in i_id]
+    try:
+        before = list(apparatus.find({"i_id": {"$in": i_id}}, {"_id": 0, "i_id": 1, "i_name": 1, "times": 1}))
+        found = {x["i_id"]: x["times"] for x in before}
+        missing = sorted(set(i_id) - set(found))
+        if missing:
+            return {"msg": "unsuccessful", "instruments": [], "missing": missing, "used": []}
+        res = apparatus.bulk_write(requests, ordered=False)
+    except Exception as e:
+        log.error(f"mongodb update operation in apparatus collection failed and raise the following exception: {e}")
+        return {"msg": "unsuccessful", "instruments": [], "missing": [], "used": []}
+    if res.matched_count != len(requests):
+        log.warning(f"{len(requests) - res.matched_count} of instruments {i_id} were already exhausted")
+    used = _used(i_id, found)
+    return {"msg": "successful", "instruments": _after_use(before, used), "missing": [], "used": used}
+
+
+def return_instruments(i_id: list[int]):
+    """
+    Give back the uses taken by use_instruments, when the surgery they were taken for is not recorded.
+
+    :param i_id: the "used" ids returned by use_instruments
+    :return: message of whether successfully updated
+    """
+    if len(i_id) == 0:
+        return "successful"
+    try:
+        apparatus.bulk_write([UpdateOne({"i_id": x}, {"$inc": {"times": 1}}) for x in i_id], ordered=False)
+        return "successful"
+    except Exception as e:
+        log.error(f"mongodb update operation in apparatus collection failed and raise the following exception: {e}")
+        return "unsuccessful"
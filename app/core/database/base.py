@@ -1,12 +1,230 @@
 """
 base function connect Davinci database
+
+The connection is configured from the environment and opened lazily, on the first operation:
+
+    DAVINCI_MONGO_URI                           mongodb://47.242.250.68:27017
+    DAVINCI_MONGO_DB                            DaVinchi
+    DAVINCI_MONGO_MAX_POOL_SIZE                 100
+    DAVINCI_MONGO_MIN_POOL_SIZE                 0
+    DAVINCI_MONGO_SERVER_SELECTION_TIMEOUT_MS   5000
+    DAVINCI_MONGO_COMPRESSORS                   e.g. "zstd,zlib", empty for none
+    DAVINCI_MONGO_READ_PREFERENCE               primary, primaryPreferred, secondary, secondaryPreferred or nearest
+
+Reads made under the analytical read intent (dashboard, statistics, exports) tolerate a few seconds of staleness.
+They go to a dedicated analytics client when DAVINCI_MONGO_ANALYTICS_URI is set, otherwise to the main client with
+DAVINCI_MONGO_ANALYTICS_READ_PREFERENCE (secondaryPreferred). DAVINCI_MONGO_ANALYTICS_MAX_POOL_SIZE sizes the
+analytics pool.
 """
-from pymongo import MongoClient
+import logging
+import threading
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from pydantic import BaseSettings
+from pymongo import MongoClient, ReadPreference
+from pymongo.collection import Collection
+from pymongo.monitoring import ConnectionPoolListener, CommandListener
+
+log = logging.getLogger(__name__)
+
+TRANSACTIONAL = "transactional"
+ANALYTICAL = "analytical"
+READ_PREFERENCES = {"primary": ReadPreference.PRIMARY, "primaryPreferred": ReadPreference.PRIMARY_PREFERRED,
+                    "secondary": ReadPreference.SECONDARY, "secondaryPreferred": ReadPreference.SECONDARY_PREFERRED,
+                    "nearest": ReadPreference.NEAREST}
+_read_intent: ContextVar = ContextVar("read_intent", default=TRANSACTIONAL)
+
+
+class MongoSettings(BaseSettings):
+    uri: str = "mongodb://47.242.250.68:27017"
+    db: str = "DaVinchi"
+    max_pool_size: int = 100
+    min_pool_size: int = 0
+    server_selection_timeout_ms: int = 5000
+    compressors: str = ""
+    read_preference: str = "primary"
+    analytics_uri: str = ""
+    analytics_read_preference: str = "secondaryPreferred"
+    analytics_max_pool_size: int = 20
+
+    class Config:
+        env_prefix = "DAVINCI_MONGO_"
+
+    def client_kwargs(self) -> dict:
+        """Keyword arguments shared by the pymongo and motor clients."""
+        kwargs = dict(maxPoolSize=self.max_pool_size, minPoolSize=self.min_pool_size,
+                      serverSelectionTimeoutMS=self.server_selection_timeout_ms,
+                      readPreference=self.read_preference)
+        if self.compressors:
+            kwargs["compressors"] = self.compressors
+        return kwargs
+
+
+class PoolStats(ConnectionPoolListener):
+    """Count connections per server from pool events."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._servers = {}
+
+    def _inc(self, address, key: str, value: int = 1):
+        with self._lock:
+            server = self._servers.setdefault(f"{address[0]}:{address[1]}",
+                                              {"open": 0, "in_use": 0, "check_out_failed": 0, "cleared": 0})
+            server[key] += value
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {k: dict(v) for k, v in self._servers.items()}
+
+    def pool_created(self, event):
+        self._inc(event.address, "open", 0)
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        self._inc(event.address, "cleared")
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        self._inc(event.address, "open")
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self._inc(event.address, "open", -1)
+
+    def connection_check_out_started(self, event):
+        pass
+
+    def connection_check_out_failed(self, event):
+        self._inc(event.address, "check_out_failed")
+
+    def connection_checked_out(self, event):
+        self._inc(event.address, "in_use")
+
+    def connection_checked_in(self, event):
+        self._inc(event.address, "in_use", -1)
+
+
+class CommandEvents(CommandListener):
+    """
+    Fan command events out to listeners subscribed after the clients were created.
+
+    pymongo only takes listeners when a client is built, metrics, request accounting and tracing subscribe here.
+    """
+
+    def __init__(self):
+        self._listeners = ()
+
+    def subscribe(self, listener: CommandListener):
+        # copy on write, events are dispatched without a lock
+        self._listeners = self._listeners + (listener,)
+
+    def unsubscribe(self, listener: CommandListener):
+        self._listeners = tuple(x for x in self._listeners if x is not listener)
+
+    def started(self, event):
+        for listener in self._listeners:
+            listener.started(event)
+
+    def succeeded(self, event):
+        for listener in self._listeners:
+            listener.succeeded(event)
+
+    def failed(self, event):
+        for listener in self._listeners:
+            listener.failed(event)
+
+
+class MongoManager:
+    """Own the client of the Davinci database, no network I/O happens before the first operation or warmup."""
+
+    def __init__(self, settings: MongoSettings = None):
+        self.settings = settings or MongoSettings()
+        self.pool_stats = PoolStats()
+        self.command_events = CommandEvents()
+        self.client = MongoClient(self.settings.uri, connect=False,
+                                  event_listeners=[self.pool_stats, self.command_events],
+                                  **self.settings.client_kwargs())
+        self.db = self.client[self.settings.db]
+        self.analytics_client = None
+        if self.settings.analytics_uri:
+            kwargs = self.settings.client_kwargs()
+            kwargs.update(maxPoolSize=self.settings.analytics_max_pool_size,
+                          readPreference=self.settings.analytics_read_preference)
+            self.analytics_client = MongoClient(self.settings.analytics_uri, connect=False,
+                                                event_listeners=[self.pool_stats, self.command_events], **kwargs)
+        self._analytical = {}
+
+    def for_read(self, collection: Collection) -> Collection:
+        """
+        Collection to read from under the current read intent.
+
+        :param collection: collection of the main client
+        :return: the same collection for transactional reads, its analytical counterpart otherwise
+        """
+        if _read_intent.get() != ANALYTICAL:
+            return collection
+        analytical = self._analytical.get(collection.name)
+        if analytical is None:
+            if self.analytics_client is not None:
+                analytical = self.analytics_client[self.settings.db][collection.name]
+            else:
+                analytical = collection.with_options(
+                    read_preference=READ_PREFERENCES[self.settings.analytics_read_preference])
+            self._analytical[collection.name] = analytical
+        return analytical
+
+    def warmup(self) -> bool:
+        """
+        Connect and check the server, waits at most serverSelectionTimeoutMS.
+
+        :return: whether the database is reachable
+        """
+        try:
+            self.client.admin.command("ping")
+            return True
+        except Exception as e:
+            log.error(f"mongodb warmup failed and raise the following exception: {e}")
+            return False
+
+    def stats(self) -> dict:
+        """Pool settings and per-server connection counts."""
+        return {"max_pool_size": self.settings.max_pool_size, "min_pool_size": self.settings.min_pool_size,
+                "read_preference": self.settings.read_preference,
+                "analytics_pool": self.analytics_client is not None, "servers": self.pool_stats.stats()}
+
+
+@contextmanager
+def read_intent(intent: str):
+    """Run the reads of the block with the given read intent, TRANSACTIONAL or ANALYTICAL."""
+    token = _read_intent.set(intent)
+    try:
+        yield
+    finally:
+        _read_intent.reset(token)
+
+
+async def analytical_reads():
+    """FastAPI dependency marking every read of the request as analytical."""
+    _read_intent.set(ANALYTICAL)
+
 
-client = MongoClient(host='47.242.250.68', port=27017)
-davinci_db = client.DaVinchi
+mongo = MongoManager()
+for_read = mongo.for_read
+client = mongo.client
+davinci_db = mongo.db
 surgery = davinci_db.surgery
 user = davinci_db.user
 apparatus = davinci_db.apparatus
 supplies = davinci_db.supplies
+supply_stock = davinci_db.supply_stock
 message = davinci_db.message
+message_count = davinci_db.message_count
+counters = davinci_db.counters
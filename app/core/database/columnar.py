@@ -0,0 +1,98 @@
+"""
+Load query results straight into typed columns for analytics.
+
+Documents are consumed batch by batch and only the requested fields are kept, so a large query never holds more
+than one batch of Python objects next to the NumPy columns being built.
+"""
+import numpy as np
+import pandas as pd
+from bson.codec_options import CodecOptions
+from bson.raw_bson import RawBSONDocument
+from pymongo.collection import Collection
+
+from app.core.database.base import for_read
+from app.core.deadline import bounded, check_deadline
+from app.core.tracing import traced
+
+
+def _get(doc, path: str):
+    """Get a possibly dotted field of a document, None if absent."""
+    value = doc
+    for key in path.split("."):
+        try:
+            value = value[key]
+        except (KeyError, TypeError):
+            return None
+    return value
+
+
+def _to_array(values: list, dtype) -> np.ndarray:
+    """Turn one batch of a field into a typed array, nested values and gaps fall back to looser dtypes."""
+    if dtype is object:
+        arr = np.empty(len(values), dtype=object)
+        for i, value in enumerate(values):
+            arr[i] = value
+        return arr
+    try:
+        return np.array(values, dtype=dtype)
+    except (TypeError, ValueError):
+        # e.g. a missing int, keep it as NaN the way pandas would
+        if np.issubdtype(np.dtype(dtype), np.integer):
+            return np.array([np.nan if x is None else x for x in values], dtype="float64")
+        return _to_array(values, object)
+
+
+@traced("pandas.load_frame")
+def load_frame(collection: Collection,
+               f: dict,
+               fields: dict,
+               batch_size: int = 5000,
+               raw: bool = False) -> pd.DataFrame:
+    """
+    Stream a query into a DataFrame with one typed column per requested field.
+
+    :param collection: collection to read, the read intent and the request budget apply
+    :param f: filter
+    :param fields: {field: dtype}, e.g. {"date": "datetime64[ns]", "s_id": "int64", "instruments": object}
+    :param batch_size: documents per cursor batch and per conversion
+    :param raw: keep documents as raw BSON, nested documents of unrequested fields are then never decoded
+    :return: DataFrame with the requested columns in order
+    """
+    coll = for_read(collection)
+    if raw:
+        coll = coll.with_options(codec_options=CodecOptions(document_class=RawBSONDocument))
+    projection = {k: 1 for k in fields}
+    projection["_id"] = 0
+    cursor = bounded(coll.find(f, projection)).batch_size(batch_size)
+
+    chunks = {k: [] for k in fields}
+    buffer = {k: [] for k in fields}
+
+    def _flush():
+        for k, dtype in fields.items():
+            if buffer[k]:
+                chunks[k].append(_to_array(buffer[k], dtype))
+                buffer[k] = []
+
+    n = 0
+    for doc in cursor:
+        for k in fields:
+            value = _get(doc, k)
+            if raw and isinstance(value, RawBSONDocument):
+                value = dict(value)
+            buffer[k].append(value)
+        n += 1
+        if n % batch_size == 0:
+            _flush()
+            check_deadline()
+    _flush()
+
+    columns = {}
+    for k, dtype in fields.items():
+        if len(chunks[k]) == 0:
+            columns[k] = _to_array([], dtype)
+        elif len(chunks[k]) == 1:
+            columns[k] = chunks[k][0]
+        else:
+            columns[k] = np.concatenate(chunks[k])
+    return pd.DataFrame(columns, columns=list(fields))
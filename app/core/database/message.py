@@ -5,10 +5,20 @@ import logging
 from datetime import datetime
 from typing import Union
 
-from app.core.database.base import message
+from pymongo import UpdateOne, DeleteOne, ReturnDocument
+from pymongo.errors import BulkWriteError, OperationFailure
+
+from app.core.database.base import message, message_count, for_read
+from app.core.deadline import bounded
+from app.core.inbox import broker
 
 log = logging.getLogger(__name__)
 
+MESSAGE_SORT_FIELDS = ("m_id", "insert_time", "status", "priority")
+# status of a message nobody has handled yet
+UNHANDLED = 1
+ALL_MESSAGES = "all"
+
 
 def get_filter(m_id: Union[int, list] = None,
                status: Union[list[int], int] = None,
@@ -57,7 +67,7 @@ def get_filter(m_id: Union[int, list] = None,
         f["insert_time"] = {"$gte": begin_time}
     if end_time and not begin_time:
         f["insert_time"] = {"$lt": end_time}
-    if begin_time and not end_time:
+    if begin_time and end_time:
         f["insert_time"] = {"$lt": end_time, "$gte": begin_time}
     if u_id is not None:
         f["u_id"] = u_id
@@ -91,7 +101,112 @@ def get_message(m_id: int = None,
     """
     f = get_filter(m_id=m_id, status=status, priority=priority,
                    u_id=u_id, u_name=u_name, time=time, begin_time=begin_time, end_time=end_time)
-    return list(message.find(f, {"_id": 0}))
+    return list(bounded(for_read(message).find(f, {"_id": 0})))
+
+
+def ensure_message_indexes():
+    """Create the indexes used by inboxes and the sorted message list."""
+    # ids are the last id + 1, two messages sent at once fail one insert instead of sharing an id
+    _ensure_unique_m_id()
+    message.create_index([("insert_time", 1), ("m_id", 1)])
+    message.create_index([("status", 1), ("m_id", 1)])
+    message.create_index([("priority", 1), ("m_id", 1)])
+    # a user's inbox and the administrators' triage queue, newest first
+    message.create_index([("u_id", 1), ("insert_time", -1), ("m_id", -1)])
+    message.create_index([("status", 1), ("priority", 1), ("insert_time", -1), ("m_id", -1)])
+
+
+def _ensure_unique_m_id():
+    index = message.index_information().get("m_id_1")
+    if index is not None and not index.get("unique"):
+        # databases created before it was unique have a plain index on the same key
+        message.drop_index("m_id_1")
+    try:
+        message.create_index("m_id", unique=True)
+    except OperationFailure as e:
+        if e.code != 11000:
+            raise
+        log.error(f"messages have duplicate m_id, the unique index can't be built until they are fixed: {e}")
+        message.create_index("m_id")
+
+
+def count_key(u_id: str = None) -> str:
+    """_id of the counters of a user, or of all messages if u_id is None."""
+    return ALL_MESSAGES if u_id is None else f"user:{u_id}"
+
+
+def count_deltas(changes: list[tuple]) -> dict:
+    """
+    Turn message changes into counter increments.
+
+    :param changes: list of (u_id, status before or None if created, status after or None if deleted, whether the
+        sender has something new to read)
+    :return: {counter _id: {field: delta}}
+    """
+    deltas = {}
+
+    def _add(key, field, value):
+        if value:
+            deltas.setdefault(key, {})
+            deltas[key][field] = deltas[key].get(field, 0) + value
+
+    for u_id, before, after, unread in changes:
+        unhandled = (after == UNHANDLED) - (before == UNHANDLED)
+        _add(count_key(u_id), "unhandled", unhandled)
+        _add(count_key(), "unhandled", unhandled)
+        _add(count_key(u_id), "unread", int(unread))
+    return deltas
+
+
+def count_requests(deltas: dict) -> list:
+    return [UpdateOne({"_id": k}, {"$inc": v}, upsert=True) for k, v in deltas.items()]
+
+
+def _inc_counts(changes: list[tuple]):
+    requests = count_requests(count_deltas(changes))
+    if len(requests) != 0:
+        message_count.bulk_write(requests, ordered=False)
+
+
+def get_message_counts(u_id: str = None) -> dict:
+    """
+    Get inbox counters.
+
+    :param u_id: user's id, all messages if None
+    :return: {"unhandled": messages waiting for an administrator, "unread": changes the user has not seen yet}
+    """
+    doc = for_read(message_count).find_one({"_id": count_key(u_id)}) or {}
+    return {"unhandled": doc.get("unhandled", 0), "unread": doc.get("unread", 0)}
+
+
+def mark_messages_read(u_id: str):
+    """Reset the unread counter of a user."""
+    message_count.update_one({"_id": count_key(u_id)}, {"$set": {"unread": 0}}, upsert=True)
+
+
+def rebuild_message_counts():
+    """
+    Recount the unhandled counters from the message collection, unread counters are kept.
+
+    :return: message of whether successfully rebuilt
+    """
+    pipeline = [{"$group": {"_id": "$u_id", "unhandled": {"$sum": {"$cond": [{"$eq": ["$status", UNHANDLED]}, 1, 0]}}}}]
+    try:
+        counts = {count_key(x["_id"]): x["unhandled"] for x in message.aggregate(pipeline)}
+        counts[count_key()] = sum(counts.values())
+        requests = [UpdateOne({"_id": k}, {"$set": {"unhandled": v}}, upsert=True) for k, v in counts.items()]
+        message_count.bulk_write(requests, ordered=False)
+        message_count.update_many({"_id": {"$nin": list(counts.keys())}}, {"$set": {"unhandled": 0}})
+        return "successful"
+    except Exception as e:
+        log.error(f"mongodb update operation in message_count collection failed and raise the following exception: {e}")
+        return "unsuccessful"
+
+
+def ensure_message_counts():
+    """Build the inbox counters if they have never been built."""
+    if message_count.estimated_document_count() == 0:
+        rebuild_message_counts()
 
 
 def insert_message(u_id: str, u_name: str, content: str):
@@ -105,10 +220,12 @@ def insert_message(u_id: str, u_name: str, content: str):
     else:
         m_id = last_m_id[0]["m_id"] + 1
 
-    insert_doc = dict(m_id=m_id, status=1, priority=1, feedback="NULL",
+    insert_doc = dict(m_id=m_id, status=UNHANDLED, priority=1, feedback="NULL",
                       u_id=u_id, u_name=u_name, insert_time=datetime.utcnow(), content=content)
     try:
         message.insert_one(insert_doc)
+        _inc_counts([(u_id, None, UNHANDLED, False)])
+        broker.publish({"type": "created", "m_id": m_id, "u_id": u_id, "status": UNHANDLED, "priority": 1})
         return "successful"
     except Exception as e:
         log.error(f"mongodb insert operation in user collection failed and raise the following exception: {e}")
@@ -134,16 +251,17 @@ def delete_message(m_id: Union[int, list] = None,
     :param time: sending time
     :param begin_time: begin time
     :param end_time: end time
-    :return: delete operation message.
+    :return: delete operation message, unsuccessful if a message changed status while being deleted and was kept.
     """
     f = get_filter(m_id=m_id, status=status, priority=priority,
                    u_id=u_id, u_name=u_name, time=time, begin_time=begin_time, end_time=end_time)
-    try:
-        message.delete_many(f)
-        return "successful"
-    except Exception as e:
-        log.error(f"mongodb delete operation in user collection failed and raise the following exception: {e}")
+    # each message is deleted on the status read, so the counters move by exactly what was deleted
+    res = triage_messages(f)
+    kept = [k for k, v in res["results"].items() if v != "deleted"]
+    if len(kept) != 0:
+        log.error(f"messages {kept} changed while being deleted and were kept")
         return "unsuccessful"
+    return res["msg"]
 
 
 def update_message(m_id: int, status: int = None, priority: int = None, feedback: str = None):
@@ -164,9 +282,75 @@ def update_message(m_id: int, status: int = None, priority: int = None, feedback
         new_value["priority"] = priority
     if feedback:
         new_value["feedback"] = feedback
+    if not new_value:
+        return "successful"
     try:
-        message.update_many(f, {"$set": new_value})
+        before = message.find_one_and_update(f, {"$set": new_value}, {"_id": 0, "u_id": 1, "status": 1},
+                                             return_document=ReturnDocument.BEFORE)
+        if before is not None:
+            _inc_counts([(before["u_id"], before["status"], new_value.get("status", before["status"]), True)])
+            broker.publish({"type": "updated", "m_id": m_id, "u_id": before["u_id"], **new_value})
         return "successful"
     except Exception as e:
         log.error(f"mongodb update operation in apparatus collection failed and raise the following exception: {e}")
         return "unsuccessful"
+
+
+def triage_messages(f: dict, new_value: dict = None):
+    """
+    Update or delete every message matching a filter in one bulk write.
+
+    Each write is conditioned on the status read beforehand, so the counters move by exactly what was written.
+    A message changed by someone else in between is reported as a conflict and left alone.
+
+    :param f: filter, e.g. {"m_id": {"$in": [1, 2]}}
+    :param new_value: fields to set, delete the messages if None
+    :return: message of whether the bulk write ran and {m_id: "updated" | "deleted" | "conflict" | error message}
+    """
+    done = "deleted" if new_value is None else "updated"
+    try:
+        targets = list(message.find(f, {"_id": 0, "m_id": 1, "u_id": 1, "status": 1}))
+    except Exception as e:
+        log.error(f"mongodb find operation in message collection failed and raise the following exception: {e}")
+        return {"msg": "unsuccessful", "results": {}}
+    if len(targets) == 0:
+        return {"msg": "successful", "results": {}}
+
+    if new_value is None:
+        requests = [DeleteOne({"m_id": x["m_id"], "status": x["status"]}) for x in targets]
+    else:
+        requests = [UpdateOne({"m_id": x["m_id"], "status": x["status"]}, {"$set": new_value}) for x in targets]
+    results = {}
+    try:
+        res = message.bulk_write(requests, ordered=False)
+        applied = res.deleted_count if new_value is None else res.matched_count
+    except BulkWriteError as e:
+        for error in e.details["writeErrors"]:
+            results[targets[error["index"]]["m_id"]] = error["errmsg"]
+        applied = e.details["nRemoved"] if new_value is None else e.details["nMatched"]
+    except Exception as e:
+        log.error(f"mongodb bulk operation in message collection failed and raise the following exception: {e}")
+        return {"msg": "unsuccessful", "results": {}}
+
+    written = [x for x in targets if x["m_id"] not in results]
+    if applied < len(written):
+        # some messages changed between the read and the write, find out which
+        current = {x["m_id"]: x for x in message.find({"m_id": {"$in": [y["m_id"] for y in written]}},
+                                                      {"_id": 0, "m_id": 1, "status": 1})}
+        expected = {x["m_id"]: new_value.get("status", x["status"]) for x in written} if new_value else {}
+        for x in written:
+            doc = current.get(x["m_id"])
+            if (new_value is None and doc is not None) or \
+                    (new_value is not None and (doc is None or doc["status"] != expected[x["m_id"]])):
+                results[x["m_id"]] = "conflict"
+        written = [x for x in written if x["m_id"] not in results]
+    for x in written:
+        results[x["m_id"]] = done
+
+    if new_value is None:
+        _inc_counts([(x["u_id"], x["status"], None, False) for x in written])
+    else:
+        _inc_counts([(x["u_id"], x["status"], new_value.get("status", x["status"]), True) for x in written])
+    for x in written:
+        broker.publish({"type": done, "m_id": x["m_id"], "u_id": x["u_id"], **(new_value or {})})
+    return {"msg": "successful", "results": results}
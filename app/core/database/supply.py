@@ -4,11 +4,19 @@ CURD functions for supplies document
 import logging
 from datetime import datetime
 from typing import Union
+from uuid import uuid4
 
-from app.core.database.base import supplies
+from pymongo import UpdateOne
+from pymongo.errors import OperationFailure
+
+from app.core.database.base import supplies, supply_stock, for_read
+from app.core.database.utils import reserve_ids, get_page, page_sort
+from app.core.deadline import bounded, max_time_kwargs
 
 log = logging.getLogger(__name__)
 
+SUPPLY_SORT_FIELDS = ("c_id", "c_name", "insert_time")
+
 
 def get_filter(begin_time: datetime = None,
                end_time: datetime = None,
@@ -82,12 +90,58 @@ def get_supply(begin_time: datetime = None,
     """
     f = get_filter(begin_time=begin_time, end_time=end_time, c_id=c_id, c_name=c_name, description=description,
                    validity=validity)
-    return list(supplies.find(f, {"_id": 0}))
+    return list(bounded(for_read(supplies).find(f, {"_id": 0, "allocation": 0})))
 
 
-def get_newest_supply(n_limit: int, c_name: str):
-    res = list(supplies.find({"description": "", "c_name": c_name}, {"_id": 0}).sort([('c_id', -1)]).limit(n_limit))
-    return res
+def get_supply_page(page: int,
+                    limit_size: int,
+                    sort_by: str = "c_id",
+                    descending: bool = False,
+                    begin_time: datetime = None,
+                    end_time: datetime = None,
+                    c_id: Union[int, list[int]] = None,
+                    c_name: Union[str, list[str]] = None,
+                    description: Union[str, list[str]] = None,
+                    validity: bool = None):
+    """
+    Get one page of supplies.
+
+    :param page: page number, starts from 1
+    :param limit_size: page size
+    :param sort_by: one of SUPPLY_SORT_FIELDS
+    :param descending: sort order
+    :param begin_time: insert_time should >= begin_time
+    :param end_time: insert_time should < begin_time
+    :param c_id: supply id, must be not overlay int
+    :param c_name: supply's name
+    :param description: supply's description
+    :param validity: true or false
+    :return: {"total": number of matching supplies, "data": supplies of the page}
+    """
+    f = get_filter(begin_time=begin_time, end_time=end_time, c_id=c_id, c_name=c_name, description=description,
+                   validity=validity)
+    return get_page(supplies, f, {"_id": 0, "allocation": 0}, page_sort(sort_by, descending, "c_id"), page,
+                    limit_size)
+
+
+def get_supply_inventory(c_name: Union[str, list[str]] = None):
+    """
+    Summarize supplies by name in one aggregation.
+
+    :param c_name: supply's name, all names by default
+    :return: list of {c_name, available, used, flagged, last_insert_time}, flagged counts used supplies whose
+        description is neither empty nor "默认"
+    """
+    pipeline = [{"$match": get_filter(c_name=c_name)},
+                {"$group": {"_id": "$c_name",
+                            "available": {"$sum": {"$cond": [{"$eq": ["$description", ""]}, 1, 0]}},
+                            "used": {"$sum": {"$cond": [{"$ne": ["$description", ""]}, 1, 0]}},
+                            "flagged": {"$sum": {"$cond": [{"$in": ["$description", ["", "默认"]]}, 0, 1]}},
+                            "last_insert_time": {"$max": "$insert_time"}}},
+                {"$sort": {"_id": 1}},
+                {"$project": {"_id": 0, "c_name": "$_id", "available": 1, "used": 1, "flagged": 1,
+                              "last_insert_time": 1}}]
+    return list(for_read(supplies).aggregate(pipeline, **max_time_kwargs()))
 
 
 def insert_supply(c_name: str,
@@ -99,20 +153,44 @@ def insert_supply(c_name: str,
     :param description: supply's description
     :return: message of whether successfully inserted
     """
-    c_id = list(supplies.find().sort([('c_id', -1)]).limit(1))
-    if len(c_id) == 0:
-        c_id = 0
-    else:
-        c_id = c_id[0]["c_id"] + 1
-    insert_doc = dict(c_id=c_id, c_name=c_name, insert_time=datetime.now(), description=description)
     try:
+        c_id = reserve_ids(supplies, "c_id")
+        insert_doc = dict(c_id=c_id, c_name=c_name, insert_time=datetime.now(), description=description)
         supplies.insert_one(insert_doc)
+        if description == "":
+            _inc_stock({c_name: 1})
         return "successful"
     except Exception as e:
         log.error(f"mongodb insert operation in supplies collection failed and raise the following exception: {e}")
         return "unsuccessful"
 
 
+def insert_supplies_bulk(manifest: list[dict]):
+    """
+    Insert every line of a delivery manifest with one id reservation and one insert_many.
+
+    :param manifest: list of {c_name: "无菌壁套", num: 200}
+    :return: message of whether successfully inserted and the inserted id range
+    """
+    total = sum(map(lambda x: x["num"], manifest))
+    if total == 0:
+        return {"msg": "successful", "c_id": []}
+    try:
+        c_id = reserve_ids(supplies, "c_id", total)
+        insert_time = datetime.now()
+        insert_doc = [dict(c_id=c_id + i, c_name=c_name, insert_time=insert_time, description="")
+                      for i, c_name in enumerate(x["c_name"] for x in manifest for _ in range(x["num"]))]
+        supplies.insert_many(insert_doc, ordered=False)
+        stock = {}
+        for x in manifest:
+            stock[x["c_name"]] = stock.get(x["c_name"], 0) + x["num"]
+        _inc_stock(stock)
+        return {"msg": "successful", "c_id": [c_id, c_id + total - 1]}
+    except Exception as e:
+        log.error(f"mongodb insert operation in supplies collection failed and raise the following exception: {e}")
+        return {"msg": "unsuccessful", "c_id": []}
+
+
 def delete_supply(begin_time: datetime = None,
                   end_time: datetime = None,
                   c_id: Union[int, list[int]] = None,
@@ -130,7 +208,10 @@ def delete_supply(begin_time: datetime = None,
     """
     f = get_filter(c_id=c_id, c_name=c_name, begin_time=begin_time, end_time=end_time, description=description)
     try:
-        supplies.delete_many(f)
+        # names matched + 3 round trips, see _write_by_name
+        unused = _write_by_name(f, "", lambda x: supplies.delete_many(x).deleted_count)
+        supplies.delete_many({"$and": [f, {"description": {"$ne": ""}}]})
+        _inc_stock({k: -v for k, v in unused.items()})
         return "successful"
     except Exception as e:
         log.error(f"mongodb delete operation in apparatus collection failed and raise the following exception: {e}")
@@ -155,9 +236,196 @@ def update_supply(begin_time: datetime = None,
     new_value = {"$set": {"description": description}}
     f = get_filter(begin_time=begin_time, end_time=end_time, c_id=c_id, c_name=c_name)
     try:
-        supplies.update_many(f, new_value)
+        # names matched + 2 or 3 round trips, see _write_by_name
+        if description == "":
+            released = _write_by_name(f, {"$ne": ""}, lambda x: supplies.update_many(x, new_value).modified_count)
+            _inc_stock(released)
+        else:
+            claimed = _write_by_name(f, "", lambda x: supplies.update_many(x, new_value).modified_count)
+            supplies.update_many({"$and": [f, {"description": {"$ne": ""}}]}, new_value)
+            _inc_stock({k: -v for k, v in claimed.items()})
         return "successful"
     except Exception as e:
         log.error(f"mongodb delete operation in supplies collection failed and raise the following exception: {e}")
         return "unsuccessful"
 
+
+def ensure_supply_indexes():
+    """Create the indexes used by supply allocation and the sorted supply list."""
+    supplies.create_index([("c_name", 1), ("description", 1), ("c_id", 1)])
+    supplies.create_index("allocation", sparse=True)
+    # sorted supply list, and the guard against duplicate ids from a writer that bypasses reserve_ids
+    _ensure_unique_c_id()
+    supplies.create_index([("c_name", 1), ("c_id", 1)])
+    supplies.create_index([("insert_time", 1), ("c_id", 1)])
+    supply_stock.create_index("c_name", unique=True)
+
+
+def _ensure_unique_c_id():
+    index = supplies.index_information().get("c_id_1")
+    if index is not None and not index.get("unique"):
+        # databases created before it was unique have a plain index on the same key
+        supplies.drop_index("c_id_1")
+    try:
+        supplies.create_index("c_id", unique=True)
+    except OperationFailure as e:
+        if e.code != 11000:
+            raise
+        log.error(f"supplies have duplicate c_id, the unique index can't be built until they are fixed: {e}")
+        supplies.create_index("c_id")
+
+
+def allocate_supplies(consumables: list[dict]):
+    """
+    Claim unused supplies in one bulk write, each claim is atomic so concurrent surgeries never share a supply.
+
+    Any unused supply of the name may be claimed. If the stock can't cover every request, the claimed supplies are
+    released again. Claimed supplies keep their allocation tag, it is cleared when they are released. Three round
+    trips whatever the number of supplies: the claim, the read back and the stock counters.
+
+    :param consumables: one {c_name: "无菌壁套", description: "默认"} per supply needed, description can't be empty
+    :return: message of whether successfully allocated, claimed supplies in request order and missing names
+    """
+    if len(consumables) == 0:
+        return {"msg": "successful", "supplies": [], "missing": []}
+    allocation = uuid4().hex
+    requests = [UpdateOne({"c_name": x["c_name"], "description": ""},
+                          {"$set": {"description": x["description"], "allocation": allocation}})
+                for x in consumables]
+    try:
+        supplies.bulk_write(requests, ordered=False)
+        claimed = list(supplies.find({"allocation": allocation}, {"_id": 0, "allocation": 0}).sort([('c_id', 1)]))
+    except Exception as e:
+        log.error(f"mongodb update operation in supplies collection failed and raise the following exception: {e}")
+        return {"msg": "unsuccessful", "supplies": [], "missing": []}
+
+    res, missing = [], []
+    for x in consumables:
+        supply = next((y for y in claimed if y["c_name"] == x["c_name"] and y["description"] == x["description"]),
+                      None)
+        if supply is None:
+            missing.append(x["c_name"])
+        else:
+            claimed.remove(supply)
+            res.append(supply)
+    if missing:
+        release_supplies(allocation)
+        return {"msg": "unsuccessful", "supplies": [], "missing": missing}
+    allocated = {}
+    for x in res:
+        allocated[x["c_name"]] = allocated.get(x["c_name"], 0) - 1
+    _inc_stock(allocated)
+    return {"msg": "successful", "supplies": res, "missing": []}
+
+
+def release_supplies(allocation: str):
+    """
+    Put the supplies of an allocation back into stock.
+
+    :param allocation: allocation id
+    :return: message of whether successfully released
+    """
+    try:
+        supplies.update_many({"allocation": allocation}, {"$set": {"description": ""}, "$unset": {"allocation": ""}})
+        return "successful"
+    except Exception as e:
+        log.error(f"mongodb update operation in supplies collection failed and raise the following exception: {e}")
+        return "unsuccessful"
+
+
+def return_supplies(c_id: list[int]):
+    """
+    Put supplies claimed by allocate_supplies back into stock, when the surgery they were claimed for is not recorded.
+
+    :param c_id: ids of the claimed supplies
+    :return: message of whether successfully released
+    """
+    if len(c_id) == 0:
+        return "successful"
+    f = {"c_id": {"$in": c_id}, "description": {"$ne": ""}}
+    try:
+        claimed = {}
+        for x in supplies.find(f, {"_id": 0, "c_name": 1}):
+            claimed[x["c_name"]] = claimed.get(x["c_name"], 0) + 1
+        supplies.update_many(f, {"$set": {"description": ""}, "$unset": {"allocation": ""}})
+        _inc_stock(claimed)
+        return "successful"
+    except Exception as e:
+        log.error(f"mongodb update operation in supplies collection failed and raise the following exception: {e}")
+        return "unsuccessful"
+
+
+def _count_by_name(f: dict) -> dict:
+    """Count total and unused supplies matching the filter, by name."""
+    pipeline = [{"$match": f},
+                {"$group": {"_id": "$c_name", "total": {"$sum": 1},
+                            "unused": {"$sum": {"$cond": [{"$eq": ["$description", ""]}, 1, 0]}}}}]
+    return {x["_id"]: {"total": x["total"], "unused": x["unused"]} for x in supplies.aggregate(pipeline)}
+
+
+def _write_by_name(f: dict, description, write) -> dict:
+    """
+    Run write on the supplies matching the filter and description one name at a time, and count what it changed.
+
+    The stock counters move by the counts of the writes themselves, so a supply allocated or inserted between
+    listing the names and writing can't make them drift. That costs one distinct plus one write per name, a
+    bulk_write only reports totals, so the per-name counts need a write each. Names come from the consumable
+    catalog, a handful, and deleting or revising supplies is an administrator action, not a surgery path.
+
+    :param f: supply filter
+    :param description: description condition, "" for the unused supplies
+    :param write: function of a filter returning the number of supplies it deleted or modified
+    :return: {c_name: number of supplies written}
+    """
+    counts = {}
+    for name in supplies.distinct("c_name", {"$and": [f, {"description": description}]}):
+        counts[name] = write({"$and": [f, {"c_name": name, "description": description}]})
+    return counts
+
+
+def _inc_stock(delta: dict):
+    """Apply {c_name: delta} to the available stock counters."""
+    requests = [UpdateOne({"c_name": k}, {"$inc": {"available": v}}, upsert=True) for k, v in delta.items() if v]
+    if len(requests) != 0:
+        supply_stock.bulk_write(requests, ordered=False)
+
+
+def get_supply_stock(c_name: Union[str, list[str]] = None, available: bool = None):
+    """
+    Get available stock counters.
+
+    :param c_name: supply's name
+    :param available: only names in stock if true, only names out of stock if false
+    :return: list of {c_name, available}
+    """
+    f = get_filter(c_name=c_name)
+    if available is True:
+        f["available"] = {"$gt": 0}
+    elif available is False:
+        f["available"] = {"$lte": 0}
+    return list(bounded(for_read(supply_stock).find(f, {"_id": 0})))
+
+
+def rebuild_supply_stock():
+    """
+    Recount the available stock counters from the supplies collection.
+
+    :return: message of whether successfully rebuilt
+    """
+    counts = _count_by_name({})
+    requests = [UpdateOne({"c_name": k}, {"$set": {"available": v["unused"]}}, upsert=True)
+                for k, v in counts.items()]
+    try:
+        if len(requests) != 0:
+            supply_stock.bulk_write(requests, ordered=False)
+        supply_stock.delete_many({"c_name": {"$nin": list(counts.keys())}})
+        return "successful"
+    except Exception as e:
+        log.error(f"mongodb update operation in supply_stock collection failed and raise the following exception: {e}")
+        return "unsuccessful"
+
+
+def ensure_supply_stock():
+    """Build the stock counters if they have never been built."""
+    if supply_stock.estimated_document_count() == 0:
+        rebuild_supply_stock()
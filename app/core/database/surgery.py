@@ -5,7 +5,12 @@ from datetime import datetime
 import logging
 from typing import Union
 
-from app.core.database.base import surgery
+import pandas as pd
+from pymongo import UpdateOne
+
+from app.core.database.base import surgery, for_read
+from app.core.database.columnar import load_frame
+from app.core.deadline import bounded
 
 log = logging.getLogger(__name__)
 
@@ -119,7 +124,8 @@ def get_surgery(skip_size: int = None,
                 chief_surgeon: Union[str, list[str]] = None,
                 associate_surgeon: Union[str, list[str]] = None,
                 instrument_nurse: Union[str, list[str]] = None,
-                circulating_nurse: Union[str, list[str]] = None):
+                circulating_nurse: Union[str, list[str]] = None,
+                fields: list[str] = None):
     """
     Get specific surgery filter.
 
@@ -137,20 +143,45 @@ def get_surgery(skip_size: int = None,
     :param associate_surgeon: associate surgeon
     :param instrument_nurse: instrument nurse
     :param circulating_nurse: circulating nurse
+    :param fields: stored fields to return, dotted paths allowed, all by default
     :return: message of whether successfully inserted
     """
     f = get_filter(s_id=s_id, p_name=p_name, admission_number=admission_number, department=department,
                    s_name=s_name, chief_surgeon=chief_surgeon, associate_surgeon=associate_surgeon,
                    instrument_nurse=instrument_nurse, circulating_nurse=circulating_nurse,
                    begin_time=begin_time, end_time=end_time, date=date)
+    projection = {"_id": 0} if fields is None else {**{k: 1 for k in fields}, "_id": 0}
+    cursor = bounded(for_read(surgery).find(f, projection))
     if skip_size is not None and limit_size is not None:
-        return list(surgery.find(f, {"_id": 0}).skip(skip_size).limit(limit_size))
+        return list(cursor.skip(skip_size).limit(limit_size))
     elif skip_size is None and limit_size is not None:
-        return list(surgery.find(f, {"_id": 0}).limit(limit_size))
+        return list(cursor.limit(limit_size))
     elif limit_size is None and skip_size is not None:
-        return list(surgery.find(f, {"_id": 0}).skip(skip_size))
+        return list(cursor.skip(skip_size))
     else:
-        return list(surgery.find(f, {"_id": 0}))
+        return list(cursor)
+
+
+def get_surgery_frame(fields: dict,
+                      begin_time: datetime = None,
+                      end_time: datetime = None,
+                      date: datetime = None,
+                      department: Union[str, list[str]] = None,
+                      chief_surgeon: Union[str, list[str]] = None) -> pd.DataFrame:
+    """
+    Get surgeries as a DataFrame holding only the given fields, for analytics.
+
+    :param fields: {field: dtype} of the columns to load
+    :param begin_time: begin time
+    :param end_time: end time
+    :param date: surgery date
+    :param department: department of chief surgeon
+    :param chief_surgeon: chief surgeon
+    :return: DataFrame with one column per field, empty with the same columns if nothing matches
+    """
+    f = get_filter(begin_time=begin_time, end_time=end_time, date=date, department=department,
+                   chief_surgeon=chief_surgeon)
+    return load_frame(surgery, f, fields)
 
 
 def insert_surgery(p_name: str,
@@ -165,7 +196,8 @@ def insert_surgery(p_name: str,
                    begin_time: datetime,
                    end_time: datetime,
                    instruments: list[dict],
-                   consumables: list[int]):
+                   consumables: list[int],
+                   names: dict = None):
     """
     Add one doc in surgery document.
 
@@ -182,6 +214,7 @@ def insert_surgery(p_name: str,
     :param end_time: surgery's end time
     :param instruments: instruments, format in {id: 1, description: "默认"}
     :param consumables: consumables, format in [1 ,2]
+    :param names: display names of the referenced users, instruments and consumables
     :return: message of whether successfully inserted
     """
     s_id = list(surgery.find().sort([('s_id', -1)]).limit(1))
@@ -196,6 +229,8 @@ def insert_surgery(p_name: str,
                           associate_surgeon=associate_surgeon,
                           instrument_nurse=instrument_nurse, circulating_nurse=circulating_nurse, begin_time=begin_time,
                           end_time=end_time, instruments=instruments, consumables=consumables)
+        if names is not None:
+            insert_doc["names"] = names
         surgery.insert_one(insert_doc)
         return "successful"
     except Exception as e:
@@ -250,7 +285,8 @@ def update_surgery(s_id: int,
                    instrument_nurse: list = None,
                    circulating_nurse: list = None,
                    instruments: list = None,
-                   consumables: list = None):
+                   consumables: list = None,
+                   names: dict = None):
     """
     Update one surgery info based on surgery id.
 
@@ -268,6 +304,7 @@ def update_surgery(s_id: int,
     :param end_time: surgery's end time
     :param instruments: instruments info
     :param consumables: consumables info
+    :param names: display names of the referenced users, instruments and consumables
     :return: update message
     """
     dc_set = {}
@@ -297,6 +334,8 @@ def update_surgery(s_id: int,
         dc_set["consumables"] = consumables
     if instruments is not None:
         dc_set["instruments"] = instruments
+    if names is not None:
+        dc_set["names"] = names
     new_value = {"$set": dc_set}
     f = get_filter(s_id=s_id)
     try:
@@ -305,3 +344,66 @@ def update_surgery(s_id: int,
     except Exception as e:
         log.error(f"mongodb update operation in user collection failed and raise the following exception: {e}")
         return "unsuccessful"
+
+
+def set_user_display_name(u_id: str, name: str):
+    """
+    Re-sync a user's display name on every surgery that references the user.
+
+    Ids with a "." or a leading "$" can't be an update path, the names.users of their surgeries are rewritten whole.
+
+    :param u_id: user's id
+    :param name: user's current name
+    :return: update message
+    """
+    f = {"$or": [{"chief_surgeon": u_id}, {"associate_surgeon": u_id},
+                 {"instrument_nurse": u_id}, {"circulating_nurse": u_id}],
+         "names": {"$exists": True}}
+    try:
+        if "." not in u_id and not u_id.startswith("$"):
+            surgery.update_many(f, {"$set": {f"names.users.{u_id}": name}})
+            return "successful"
+        docs = surgery.find(f, {"_id": 0, "s_id": 1, "names.users": 1})
+        requests = [UpdateOne({"s_id": x["s_id"]},
+                              {"$set": {"names.users": {**x["names"].get("users", {}), u_id: name}}}) for x in docs]
+        if requests:
+            surgery.bulk_write(requests, ordered=False)
+        return "successful"
+    except Exception as e:
+        log.error(f"mongodb update operation in surgery collection failed and raise the following exception: {e}")
+        return "unsuccessful"
+
+
+def set_instrument_display_name(i_id: int, i_name: str):
+    """
+    Re-sync an instrument's display name on every surgery that used the instrument.
+
+    :param i_id: instrument id
+    :param i_name: instrument's current name
+    :return: update message
+    """
+    f = {"instruments.id": i_id, "names": {"$exists": True}}
+    try:
+        surgery.update_many(f, {"$set": {f"names.instruments.{i_id}": i_name}})
+        return "successful"
+    except Exception as e:
+        log.error(f"mongodb update operation in surgery collection failed and raise the following exception: {e}")
+        return "unsuccessful"
+
+
+def set_consumable_display_name(c_id: int, c_name: str, description: str):
+    """
+    Re-sync a consumable's name and description on the surgery that used the consumable.
+
+    :param c_id: supply id
+    :param c_name: supply's current name
+    :param description: supply's current description
+    :return: update message
+    """
+    f = {"consumables": c_id, "names": {"$exists": True}}
+    try:
+        surgery.update_many(f, {"$set": {f"names.consumables.{c_id}": {"name": c_name, "description": description}}})
+        return "successful"
+    except Exception as e:
+        log.error(f"mongodb update operation in surgery collection failed and raise the following exception: {e}")
+        return "unsuccessful"
@@ -6,10 +6,13 @@ from typing import Union
 from datetime import datetime
 
 from app.constant import USER_DICT
-from app.core.database.base import user
+from app.core.database.base import user, for_read
+from app.core.deadline import bounded
 
 log = logging.getLogger(__name__)
 
+USER_SORT_FIELDS = ("u_id", "name", "user_type", "insert_datetime")
+
 
 def get_filter(u_id: Union[str, list[str]] = None,
                name: Union[str, list[str]] = None,
@@ -59,7 +62,16 @@ def get_user(u_id: Union[str, list[str]] = None,
     :return: specific user's info
     """
     f = get_filter(u_id=u_id, name=name, user_type=user_type)
-    return list(user.find(f, {"_id": 0}))
+    return list(bounded(for_read(user).find(f, {"_id": 0})))
+
+
+def ensure_user_indexes():
+    """Create the indexes used by user lookups and the sorted user list."""
+    user.create_index("u_id")
+    # name lookups and the user list sorted by name, ties broken by id
+    user.create_index([("name", 1), ("u_id", 1)])
+    user.create_index([("user_type", 1), ("u_id", 1)])
+    user.create_index([("insert_datetime", 1), ("u_id", 1)])
 
 
 def insert_user(u_id: str, name: str, user_type: str, code: str):
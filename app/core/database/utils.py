@@ -1,4 +1,9 @@
-from app.core.database.base import davinci_db
+from pymongo import ReturnDocument, ASCENDING, DESCENDING
+from pymongo.collection import Collection
+from pymongo.errors import DuplicateKeyError
+
+from app.core.database.base import davinci_db, counters, for_read
+from app.core.deadline import bounded, max_time_kwargs
 
 
 def get_collection_cols(collection: str):
@@ -8,3 +13,59 @@ def get_collection_cols(collection: str):
                     "$jsonSchema"]["properties"].keys())
     return cols
 
+
+def reserve_ids(collection: Collection, key: str, n: int = 1) -> int:
+    """
+    Reserve a block of n consecutive ids for a collection in one round trip.
+
+    :param collection: collection the ids belong to
+    :param key: id field, e.g. c_id
+    :param n: size of the block
+    :return: first id of the block
+    """
+    seq = f"{collection.name}.{key}"
+    doc = counters.find_one_and_update({"_id": seq}, {"$inc": {"next": n}}, return_document=ReturnDocument.AFTER)
+    if doc is None:
+        # seed the sequence from the largest id in use, $max keeps concurrent seeds from moving it backwards
+        last = list(collection.find({}, {key: 1}).sort([(key, -1)]).limit(1))
+        try:
+            counters.update_one({"_id": seq}, {"$max": {"next": last[0][key] + 1 if last else 0}}, upsert=True)
+        except DuplicateKeyError:
+            pass
+        doc = counters.find_one_and_update({"_id": seq}, {"$inc": {"next": n}}, return_document=ReturnDocument.AFTER)
+    return doc["next"] - n
+
+
+def page_sort(sort_by: str, descending: bool, key: str) -> list:
+    """Sort specification of a page, ties are broken by the id field so pages never overlap."""
+    direction = DESCENDING if descending else ASCENDING
+    if sort_by == key:
+        return [(key, direction)]
+    return [(sort_by, direction), (key, direction)]
+
+
+def get_page(collection: Collection,
+             f: dict,
+             projection: dict,
+             sort: list,
+             page: int,
+             limit_size: int) -> dict:
+    """
+    Get one page of a query together with the number of matching documents.
+
+    :param collection: collection to read
+    :param f: filter
+    :param projection: projection
+    :param sort: sort specification, should be backed by an index
+    :param page: page number, starts from 1
+    :param limit_size: page size
+    :return: {"total": number of matching documents, "data": documents of the page}
+    """
+    coll = for_read(collection)
+    if f:
+        total = coll.count_documents(f, **max_time_kwargs())
+    else:
+        # metadata count, no collection scan
+        total = coll.estimated_document_count(**max_time_kwargs())
+    cursor = bounded(coll.find(f, projection)).sort(sort).skip((page - 1) * limit_size).limit(limit_size)
+    return {"total": total, "data": list(cursor)}
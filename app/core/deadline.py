@@ -0,0 +1,67 @@
+"""
+Request time budgets.
+
+A route declares its budget with ``Depends(time_budget(seconds))``. The database layer turns the time left into
+maxTimeMS of its queries and analytics code calls check_deadline between steps, so an overrun ends as a 503.
+"""
+import threading
+import time
+from contextvars import ContextVar
+
+_deadline: ContextVar = ContextVar("deadline", default=None)
+_lock = threading.Lock()
+overruns = {}
+
+
+class DeadlineExceeded(Exception):
+    """The request ran out of its time budget."""
+
+
+def time_budget(seconds: float):
+    """
+    FastAPI dependency giving the request a time budget.
+
+    :param seconds: budget of the whole request
+    """
+    async def _set_deadline():
+        # every request runs in its own context, sync routes get a copy of it in the threadpool
+        _deadline.set(time.monotonic() + seconds)
+
+    return _set_deadline
+
+
+def remaining_ms():
+    """
+    Milliseconds left of the request budget, None if the request has no budget.
+
+    :raise DeadlineExceeded: if the budget is used up
+    """
+    deadline = _deadline.get()
+    if deadline is None:
+        return None
+    remaining = int((deadline - time.monotonic()) * 1000)
+    if remaining <= 0:
+        raise DeadlineExceeded()
+    return remaining
+
+
+def check_deadline():
+    """Cancellation point for long computations."""
+    remaining_ms()
+
+
+def bounded(cursor):
+    """Limit a pymongo or motor cursor to the time left of the request budget."""
+    ms = remaining_ms()
+    return cursor if ms is None else cursor.max_time_ms(ms)
+
+
+def max_time_kwargs() -> dict:
+    """maxTimeMS keyword for count_documents and aggregate, empty if the request has no budget."""
+    ms = remaining_ms()
+    return {} if ms is None else {"maxTimeMS": ms}
+
+
+def record_overrun(route: str):
+    with _lock:
+        overruns[route] = overruns.get(route, 0) + 1
@@ -0,0 +1,92 @@
+"""
+In-process broker pushing message changes to Server-Sent Events streams.
+
+The database layer publishes one event per created, updated or deleted message. A doctor's stream receives the
+events of their own messages, an administrator's stream receives all of them. Events are only delivered to clients
+connected to this process.
+"""
+import asyncio
+import json
+import logging
+import threading
+
+log = logging.getLogger(__name__)
+
+HEARTBEAT_SECONDS = 15
+
+
+class _Subscription:
+    def __init__(self, u_id: str = None, max_queue: int = 100):
+        self.u_id = u_id
+        self.loop = asyncio.get_running_loop()
+        self.queue = asyncio.Queue(maxsize=max_queue)
+
+    def offer(self, event: dict):
+        """Runs in the event loop, a slow client loses its oldest events rather than blocking publishers."""
+        if self.queue.full():
+            self.queue.get_nowait()
+        self.queue.put_nowait(event)
+
+
+class InboxBroker:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._subscriptions = set()
+
+    def subscribe(self, u_id: str = None) -> _Subscription:
+        """
+        Subscribe to message events, must be called from the event loop.
+
+        :param u_id: only events of this user's messages, all events if None
+        """
+        sub = _Subscription(u_id)
+        with self._lock:
+            self._subscriptions.add(sub)
+        return sub
+
+    def unsubscribe(self, sub: _Subscription):
+        with self._lock:
+            self._subscriptions.discard(sub)
+
+    def publish(self, event: dict):
+        """
+        Publish an event, safe to call from the event loop and from worker threads.
+
+        :param event: {"type": "created" | "updated" | "deleted", "m_id", "u_id", ...}
+        """
+        with self._lock:
+            subscriptions = list(self._subscriptions)
+        for sub in subscriptions:
+            if sub.u_id is None or sub.u_id == event.get("u_id"):
+                try:
+                    sub.loop.call_soon_threadsafe(sub.offer, event)
+                except RuntimeError:
+                    # the loop of the subscriber is closed
+                    self.unsubscribe(sub)
+
+    def subscribers(self) -> int:
+        with self._lock:
+            return len(self._subscriptions)
+
+    async def stream(self, u_id: str = None):
+        """
+        Server-Sent Events of one client, ends when the client disconnects.
+
+        :param u_id: only events of this user's messages, all events if None
+        """
+        sub = self.subscribe(u_id)
+        try:
+            yield "retry: 5000\n\n"
+            while True:
+                try:
+                    event = await asyncio.wait_for(sub.queue.get(), HEARTBEAT_SECONDS)
+                except asyncio.TimeoutError:
+                    # keeps proxies from closing an idle connection
+                    yield ": keep-alive\n\n"
+                    continue
+                yield f"event: {event['type']}\ndata: {json.dumps(event, ensure_ascii=False, default=str)}\n\n"
+        finally:
+            self.unsubscribe(sub)
+
+
+broker = InboxBroker()
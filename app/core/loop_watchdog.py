@@ -0,0 +1,93 @@
+"""
+Event loop blocking detector.
+
+A heartbeat task wakes up every ``interval`` and records how late it was, the event loop lag. A watcher thread
+checks the heartbeat: when it is older than ``DAVINCI_LOOP_BLOCK_MS`` the loop is stuck in a callback, and the stack
+of the event loop thread is logged while it is still blocking, which points at the sync call made from an
+``async def`` route.
+"""
+import asyncio
+import logging
+import os
+import sys
+import threading
+import time
+import traceback
+
+from app.core.metrics import registry, Counter, Gauge, Histogram
+
+log = logging.getLogger(__name__)
+
+LOOP_BLOCK_MS = float(os.environ.get("DAVINCI_LOOP_BLOCK_MS", 100))
+LAG_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5)
+
+loop_lag = registry.register(Histogram("davinci_event_loop_lag_seconds", "Delay of the event loop heartbeat.",
+                                       buckets=LAG_BUCKETS))
+loop_blocks = registry.register(Counter("davinci_event_loop_blocks_total",
+                                        "Event loop stalls longer than the blocking threshold."))
+
+
+class LoopWatchdog:
+    def __init__(self, interval: float = 0.05, threshold_ms: float = LOOP_BLOCK_MS):
+        """
+        :param interval: seconds between two heartbeats
+        :param threshold_ms: a stall longer than this is logged with the stack of the loop
+        """
+        self.interval = interval
+        self.threshold = threshold_ms / 1000
+        self._beat = time.monotonic()
+        self._loop_thread = None
+        self._task = None
+        self._stop = threading.Event()
+        self._watcher = None
+
+    async def _heartbeat(self):
+        while True:
+            start = time.monotonic()
+            await asyncio.sleep(self.interval)
+            self._beat = time.monotonic()
+            lag = max(self._beat - start - self.interval, 0)
+            loop_lag.observe(lag)
+
+    def _watch(self):
+        reported = None
+        while not self._stop.wait(self.interval):
+            beat = self._beat
+            stalled = time.monotonic() - beat
+            if stalled < self.threshold or reported == beat:
+                continue
+            # one report per stall, taken while the loop is still blocked
+            reported = beat
+            loop_blocks.inc()
+            frame = sys._current_frames().get(self._loop_thread)
+            stack = "".join(traceback.format_stack(frame)) if frame is not None else "unavailable\n"
+            log.warning(f"event loop blocked for more than {stalled * 1000:.0f}ms in:\n{stack}")
+
+    def start(self):
+        """Start the watchdog, from the event loop it watches."""
+        self._loop_thread = threading.get_ident()
+        self._beat = time.monotonic()
+        self._stop.clear()
+        self._task = asyncio.get_running_loop().create_task(self._heartbeat())
+        self._watcher = threading.Thread(target=self._watch, name="loop-watchdog", daemon=True)
+        self._watcher.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._task is not None:
+            self._task.cancel()
+
+    def stall(self) -> float:
+        """Seconds since the last heartbeat, the current stall."""
+        return max(time.monotonic() - self._beat - self.interval, 0)
+
+
+watchdog = LoopWatchdog()
+
+
+@registry.collector
+def _current_lag():
+    # lags are only observed once the loop wakes up, a loop stuck right now shows here
+    current = Gauge("davinci_event_loop_stall_seconds", "Time the event loop has been stalled for right now.")
+    current.set(watchdog.stall())
+    return [current]
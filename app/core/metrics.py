@@ -0,0 +1,248 @@
+"""
+Prometheus metrics of the HTTP routes and of the Mongo commands.
+
+Metrics are kept in process and rendered in the Prometheus text format by ``/metrics``. Recording is a dict lookup
+and a few additions under a lock, cheap enough for every request and every command.
+"""
+import threading
+import time
+from bisect import bisect_left
+
+from pymongo.monitoring import CommandListener
+
+from app.core import deadline
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20)
+SIZE_BUCKETS = (100, 1000, 10000, 100000, 1000000, 10000000)
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    pairs = [f'{k}="{_escape(v)}"' for k, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labels: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(labels.get(x, "") for x in self.labels)
+
+    def samples(self) -> list:
+        raise NotImplementedError
+
+    def render(self) -> list:
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}", *self.samples()]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def inc(self, value: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + value
+
+    def samples(self) -> list:
+        with self._lock:
+            values = dict(self._values)
+        return [f"{self.name}{_format_labels(self.labels, k)} {v}" for k, v in values.items()]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def dec(self, value: float = 1, **labels):
+        self.inc(-value, **labels)
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: tuple = (), buckets: tuple = LATENCY_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        i = bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # one count per bucket plus +Inf, then sum
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][i] += 1
+            state[1] += value
+
+    def samples(self) -> list:
+        with self._lock:
+            values = {k: (list(v[0]), v[1]) for k, v in self._values.items()}
+        lines = []
+        for key, (counts, total) in values.items():
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), counts):
+                cumulative += count
+                le = f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {cumulative}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+        self._collectors = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def collector(self, fn):
+        """Register a function returning metrics computed at scrape time."""
+        self._collectors.append(fn)
+        return fn
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines += metric.render()
+        for fn in self._collectors:
+            for metric in fn():
+                lines += metric.render()
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+http_duration = registry.register(Histogram("davinci_http_request_duration_seconds", "HTTP request latency.",
+                                            ("method", "route", "status")))
+http_in_flight = registry.register(Gauge("davinci_http_requests_in_flight", "HTTP requests being served."))
+http_response_size = registry.register(Histogram("davinci_http_response_size_bytes", "HTTP response body size.",
+                                                 ("method", "route"), SIZE_BUCKETS))
+mongo_duration = registry.register(Histogram("davinci_mongo_command_duration_seconds", "Mongo command latency.",
+                                             ("collection", "command")))
+mongo_documents = registry.register(Counter("davinci_mongo_command_documents_total",
+                                            "Documents returned by cursors, or written by write commands.",
+                                            ("collection", "command")))
+mongo_failures = registry.register(Counter("davinci_mongo_command_failures_total", "Failed Mongo commands.",
+                                           ("collection", "command")))
+
+
+@registry.collector
+def _deadline_overruns():
+    overruns = Counter("davinci_deadline_overruns_total", "Requests that ran out of their time budget.", ("route",))
+    with deadline._lock:
+        for route, count in deadline.overruns.items():
+            overruns.inc(count, route=route)
+    return [overruns]
+
+
+def command_collection(event) -> str:
+    """Collection a command runs on, the database name for database commands."""
+    target = event.command.get(event.command_name)
+    if event.command_name == "getMore":
+        target = event.command.get("collection")
+    return target if isinstance(target, str) else event.database_name
+
+
+def documents_returned(reply) -> int:
+    cursor = reply.get("cursor")
+    if cursor is not None:
+        return len(cursor.get("firstBatch", cursor.get("nextBatch", ())))
+    n = reply.get("n")
+    return n if isinstance(n, int) else 0
+
+
+class CommandMetrics(CommandListener):
+    """Record latency and documents of every Mongo command by collection and command."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = {}
+
+    def started(self, event):
+        with self._lock:
+            self._pending[(event.connection_id, event.request_id)] = command_collection(event)
+
+    def _pop(self, event) -> str:
+        with self._lock:
+            return self._pending.pop((event.connection_id, event.request_id), "unknown")
+
+    def succeeded(self, event):
+        collection = self._pop(event)
+        mongo_duration.observe(event.duration_micros / 1e6, collection=collection, command=event.command_name)
+        n = documents_returned(event.reply)
+        if n:
+            mongo_documents.inc(n, collection=collection, command=event.command_name)
+
+    def failed(self, event):
+        collection = self._pop(event)
+        mongo_duration.observe(event.duration_micros / 1e6, collection=collection, command=event.command_name)
+        mongo_failures.inc(collection=collection, command=event.command_name)
+
+
+command_metrics = CommandMetrics()
+
+
+_routes = {}
+
+
+def route_of(scope) -> str:
+    """Path template of the route that served a request, so metrics are not labelled by ids in the url."""
+    endpoint = scope.get("endpoint")
+    app = scope.get("app")
+    if endpoint is None or app is None:
+        return "unmatched"
+    route = _routes.get(endpoint)
+    if route is None:
+        route = next((x.path for x in app.routes if getattr(x, "endpoint", None) is endpoint), "unmatched")
+        _routes[endpoint] = route
+    return route
+
+
+class MetricsMiddleware:
+    """Pure ASGI middleware recording latency, in-flight requests and response sizes per route."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        start = time.perf_counter()
+        response = {"status": 500, "size": 0}
+
+        async def _send(message):
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+            elif message["type"] == "http.response.body":
+                response["size"] += len(message.get("body", b""))
+            await send(message)
+
+        http_in_flight.inc()
+        try:
+            await self.app(scope, receive, _send)
+        finally:
+            http_in_flight.dec()
+            route = route_of(scope)
+            http_duration.observe(time.perf_counter() - start, method=scope["method"], route=route,
+                                  status=str(response["status"]))
+            http_response_size.observe(response["size"], method=scope["method"], route=route)
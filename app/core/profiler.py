@@ -0,0 +1,216 @@
+"""
+On-demand sampling profiler.
+
+A sampler thread reads the stack of every thread from ``sys._current_frames`` at a fixed interval and counts them in
+the collapsed format of flamegraph.pl and speedscope, one ``thread;outer;...;inner count`` line per stack. Nothing
+is installed in the interpreter, so the overhead is that of the sampler thread alone and stops with it. A whole
+worker is profiled for some seconds by ``/admin/profile``; a single request sent with an ``X-Profile`` header is
+profiled by ``ProfilerMiddleware`` and its result kept for ``/admin/get_profile``. Memory is profiled with
+tracemalloc, as the top allocations made during the profile.
+"""
+import asyncio
+import os
+import sys
+import threading
+import time
+import tracemalloc
+import uuid
+from collections import Counter, OrderedDict
+
+MAX_PROFILE_SECONDS = 60
+# profiles of single requests kept for /admin/get_profile
+MAX_REQUEST_PROFILES = 20
+# a thread whose innermost frame is in these modules is waiting, not working
+_IDLE_MODULES = ("threading.py", "selectors.py", "queue.py")
+
+_lock = threading.Lock()
+_profiles_lock = threading.Lock()
+_request_profiles = OrderedDict()
+
+
+class ProfilerBusy(Exception):
+    """Another profile is running on this worker."""
+
+
+def _location(code) -> str:
+    parts = code.co_filename.replace("\\", "/").rsplit("/", 2)
+    return f"{'/'.join(parts[-2:])}:{getattr(code, 'co_qualname', code.co_name)}"
+
+
+class SamplingProfiler:
+    def __init__(self, interval: float = 0.01, idle: bool = False):
+        """
+        :param interval: seconds between two samples
+        :param idle: keep the stacks of waiting threads
+        """
+        self.interval = interval
+        self.idle = idle
+        self.stacks = Counter()
+        self.samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="sampling-profiler", daemon=True)
+        self._locations = {}
+
+    def _collapse(self, frame) -> list:
+        stack = []
+        while frame is not None:
+            code = frame.f_code
+            location = self._locations.get(code)
+            if location is None:
+                location = self._locations[code] = _location(code)
+            stack.append(location)
+            frame = frame.f_back
+        return stack
+
+    def _run(self):
+        me = threading.get_ident()
+        names = {}
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            for ident, frame in frames.items():
+                if ident == me:
+                    continue
+                if not self.idle and os.path.basename(frame.f_code.co_filename) in _IDLE_MODULES:
+                    continue
+                name = names.get(ident)
+                if name is None:
+                    names = {x.ident: x.name for x in threading.enumerate()}
+                    name = names.get(ident, str(ident))
+                stack = self._collapse(frame)
+                stack.append(name)
+                self.stacks[";".join(reversed(stack))] += 1
+            self.samples += 1
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def collapsed(self) -> str:
+        return "\n".join(f"{stack} {n}" for stack, n in self.stacks.most_common())
+
+
+class _Profile:
+    """One profile at a time per worker, with tracemalloc when memory is asked."""
+
+    def __init__(self, interval: float, idle: bool, memory: bool, top: int):
+        self.profiler = SamplingProfiler(interval, idle)
+        self.memory = memory
+        self.top = top
+        self._snapshot = None
+        self._started_tracemalloc = False
+        self._start = 0.0
+
+    def start(self):
+        if not _lock.acquire(blocking=False):
+            raise ProfilerBusy()
+        try:
+            if self.memory:
+                if not tracemalloc.is_tracing():
+                    tracemalloc.start(25)
+                    self._started_tracemalloc = True
+                self._snapshot = tracemalloc.take_snapshot()
+            self._start = time.perf_counter()
+            self.profiler.start()
+        except Exception:
+            _lock.release()
+            raise
+
+    def stop(self) -> dict:
+        try:
+            self.profiler.stop()
+            result = {"seconds": round(time.perf_counter() - self._start, 3), "samples": self.profiler.samples,
+                      "collapsed": self.profiler.collapsed()}
+            if self.memory:
+                result["allocations"] = top_allocations(self._snapshot, self.top)
+                if self._started_tracemalloc:
+                    tracemalloc.stop()
+            return result
+        finally:
+            _lock.release()
+
+
+def top_allocations(before, top: int = 20) -> list:
+    """Lines that allocated the most memory since the snapshot before, still alive."""
+    after = tracemalloc.take_snapshot().filter_traces((tracemalloc.Filter(False, tracemalloc.__file__),
+                                                       tracemalloc.Filter(False, __file__)))
+    return [{"location": f"{x.traceback[0].filename}:{x.traceback[0].lineno}", "size_kb": round(x.size / 1024, 1),
+             "size_diff_kb": round(x.size_diff / 1024, 1), "count": x.count, "count_diff": x.count_diff}
+            for x in after.compare_to(before, "lineno")[:top]]
+
+
+async def profile_worker(seconds: float, interval: float = 0.01, idle: bool = False, memory: bool = False,
+                         top: int = 20) -> dict:
+    """
+    Profile every thread of the worker while the event loop keeps serving requests.
+
+    :param seconds: duration, at most MAX_PROFILE_SECONDS
+    :param interval: seconds between two samples
+    :param idle: keep the stacks of waiting threads
+    :param memory: also return the top allocations
+    :param top: number of allocations returned
+    :return: {"seconds", "samples", "collapsed", "allocations"}
+    :raise ProfilerBusy: if another profile is running
+    """
+    profile = _Profile(interval, idle, memory, top)
+    profile.start()
+    try:
+        await asyncio.sleep(min(seconds, MAX_PROFILE_SECONDS))
+    finally:
+        result = profile.stop()
+    return result
+
+
+def get_request_profile(profile_id: str) -> dict:
+    with _profiles_lock:
+        return _request_profiles.get(profile_id)
+
+
+class ProfilerMiddleware:
+    """
+    Pure ASGI middleware profiling a request sent with an ``X-Profile`` header.
+
+    Every thread is sampled while the request runs, so other requests served at the same time show up as well.
+    ``X-Profile: memory`` adds the top allocations. The profile id is returned in ``X-Profile-Id``.
+    """
+
+    def __init__(self, app, authorize):
+        """
+        :param authorize: async function of the request scope, True if the caller may profile
+        """
+        self.app = app
+        self.authorize = authorize
+
+    async def __call__(self, scope, receive, send):
+        mode = None
+        if scope["type"] == "http":
+            for k, v in scope.get("headers", []):
+                if k == b"x-profile":
+                    mode = v.decode("latin-1").strip().lower()
+        if mode is None or not await self.authorize(scope):
+            await self.app(scope, receive, send)
+            return
+        profile = _Profile(0.005, False, mode == "memory", 20)
+        try:
+            profile.start()
+        except ProfilerBusy:
+            await self.app(scope, receive, send)
+            return
+        profile_id = uuid.uuid4().hex
+
+        async def _send(message):
+            if message["type"] == "http.response.start":
+                message = {**message, "headers": [*message.get("headers", []), (b"x-profile-id", profile_id.encode())]}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, _send)
+        finally:
+            result = profile.stop()
+            result["path"] = scope["path"]
+            with _profiles_lock:
+                _request_profiles[profile_id] = result
+                while len(_request_profiles) > MAX_REQUEST_PROFILES:
+                    _request_profiles.popitem(last=False)
@@ -0,0 +1,200 @@
+"""
+Database round trips of a request.
+
+Every Mongo command is counted into the stats of the request that issued it, kept in a context variable so sync
+routes in the threadpool and Motor calls in its executor count into the same request. In debug mode
+(``DAVINCI_DEBUG=1``) the totals are returned as ``Server-Timing`` and ``X-DB-*`` headers and commands repeated
+with the same filter shape are logged as N+1 patterns. Tests declare the budget of an endpoint with
+``query_budget``.
+"""
+import logging
+import os
+import threading
+from collections import Counter
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+import bson
+from pymongo.monitoring import CommandListener
+
+from app.core.metrics import command_collection, documents_returned
+
+log = logging.getLogger(__name__)
+
+DEBUG = os.environ.get("DAVINCI_DEBUG", "").lower() in ("1", "true", "yes")
+# the same command with the same filter shape this many times in one request is reported as N+1
+N_PLUS_ONE_THRESHOLD = int(os.environ.get("DAVINCI_N_PLUS_ONE_THRESHOLD", 10))
+
+_stats: ContextVar = ContextVar("query_stats", default=None)
+_lock = threading.Lock()
+_captures = ()
+
+
+def filter_shape(value) -> str:
+    """
+    Shape of a filter, field names and operators with the values stripped.
+
+    {"status": {"$in": [0, 1]}, "u_id": "x"} and {"u_id": "y", "status": {"$in": [2]}} have the same shape
+    "{status: {$in: ?}, u_id: ?}".
+    """
+    if isinstance(value, dict):
+        return "{" + ", ".join(f"{k}: {filter_shape(v)}" for k, v in sorted(value.items())) + "}"
+    if isinstance(value, (list, tuple)) and len(value) != 0 and all(isinstance(x, dict) for x in value):
+        # $and, $or and $nor clauses, order does not change the query
+        return "[" + ", ".join(sorted({filter_shape(x) for x in value})) + "]"
+    return "?"
+
+
+def command_filter(command_name: str, command) -> dict:
+    """Filter of a Mongo command, None for commands without one."""
+    if command_name == "find":
+        return command.get("filter", {})
+    if command_name in ("count", "distinct", "findAndModify"):
+        return command.get("query", {})
+    if command_name == "aggregate":
+        pipeline = command.get("pipeline", [])
+        return pipeline[0].get("$match", {}) if len(pipeline) != 0 else {}
+    if command_name == "update":
+        return command.get("updates", [{}])[0].get("q", {})
+    if command_name == "delete":
+        return command.get("deletes", [{}])[0].get("q", {})
+    return None
+
+
+class RequestStats:
+    """Totals of the commands of one request."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.calls = 0
+        self.documents = 0
+        self.bytes = 0
+        self.duration = 0.0
+        self.shapes = Counter()
+
+    def started(self, key: tuple):
+        with self._lock:
+            self.calls += 1
+            if key is not None:
+                self.shapes[key] += 1
+
+    def finished(self, documents: int, size: int, duration: float):
+        with self._lock:
+            self.documents += documents
+            self.bytes += size
+            self.duration += duration
+
+    def repeated(self, threshold: int = N_PLUS_ONE_THRESHOLD) -> list:
+        """(collection, command, filter shape, times) of the commands issued at least threshold times."""
+        with self._lock:
+            return [(*k, n) for k, n in self.shapes.most_common() if n >= threshold]
+
+    def report(self) -> str:
+        lines = [f"{self.calls} calls, {self.documents} documents, {self.bytes} bytes in {self.duration * 1000:.1f}ms"]
+        with self._lock:
+            lines += [f"{n} x {command} {collection} {shape}" for (collection, command, shape), n in
+                      self.shapes.most_common()]
+        return "\n".join(lines)
+
+
+class QueryStats(CommandListener):
+    """Count every Mongo command into the stats of its request and of the active query budgets."""
+
+    @staticmethod
+    def _targets() -> tuple:
+        stats = _stats.get()
+        return _captures if stats is None else (stats, *_captures)
+
+    def started(self, event):
+        targets = self._targets()
+        if len(targets) == 0:
+            return
+        f = command_filter(event.command_name, event.command)
+        key = None if f is None else (command_collection(event), event.command_name, filter_shape(f))
+        for stats in targets:
+            stats.started(key)
+
+    def succeeded(self, event):
+        targets = self._targets()
+        if len(targets) == 0:
+            return
+        documents = documents_returned(event.reply)
+        size = len(bson.encode(event.reply))
+        for stats in targets:
+            stats.finished(documents, size, event.duration_micros / 1e6)
+
+    def failed(self, event):
+        for stats in self._targets():
+            stats.finished(0, 0, event.duration_micros / 1e6)
+
+
+query_stats = QueryStats()
+
+
+def current_stats() -> RequestStats:
+    """Stats of the current request, None outside of debug mode."""
+    return _stats.get()
+
+
+@contextmanager
+def query_budget(calls: int, documents: int = None):
+    """
+    Fail when the database calls made inside the block exceed a budget.
+
+    Commands are captured from every thread, so requests sent with a TestClient count as well::
+
+        with query_budget(3):
+            client.post("/admin/get_surgery", json=...)
+
+    :param calls: maximum number of Mongo commands
+    :param documents: maximum number of documents returned, unlimited if None
+    :raise AssertionError: if the budget is exceeded or an N+1 pattern is detected
+    """
+    global _captures
+    stats = RequestStats()
+    with _lock:
+        _captures = _captures + (stats,)
+    try:
+        yield stats
+    finally:
+        with _lock:
+            _captures = tuple(x for x in _captures if x is not stats)
+    if stats.calls > calls:
+        raise AssertionError(f"{stats.calls} database calls exceed the budget of {calls}:\n{stats.report()}")
+    if documents is not None and stats.documents > documents:
+        raise AssertionError(f"{stats.documents} documents exceed the budget of {documents}:\n{stats.report()}")
+    if len(stats.repeated()) != 0:
+        raise AssertionError(f"N+1 pattern detected:\n{stats.report()}")
+
+
+class QueryStatsMiddleware:
+    """Pure ASGI middleware returning the database totals of each request as headers, enabled in debug mode."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        stats = RequestStats()
+        token = _stats.set(stats)
+
+        async def _send(message):
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                headers += [
+                    (b"server-timing", f'db;dur={stats.duration * 1000:.1f};desc="{stats.calls} calls"'.encode()),
+                    (b"x-db-calls", str(stats.calls).encode()),
+                    (b"x-db-documents", str(stats.documents).encode()),
+                    (b"x-db-bytes", str(stats.bytes).encode()),
+                ]
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, _send)
+        finally:
+            _stats.reset(token)
+            for collection, command, shape, n in stats.repeated():
+                log.warning(f"possible N+1 in {scope['path']}: {n} x {command} on {collection} with filter {shape}")
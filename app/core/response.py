@@ -0,0 +1,34 @@
+"""
+Fast JSON responses for large lists.
+
+FastAPI runs whatever a route returns through jsonable_encoder before rendering it. A route returning
+``FastJSONResponse(data)`` skips that pass and the data is serialized once, by orjson.
+"""
+import base64
+from datetime import datetime
+
+import orjson
+import pandas as pd
+from bson import ObjectId
+from fastapi.responses import JSONResponse
+
+
+def _default(obj):
+    """Serialize the types orjson does not know, raise TypeError for the rest like orjson does."""
+    if isinstance(obj, ObjectId):
+        return str(obj)
+    if obj is pd.NaT:
+        return None
+    if isinstance(obj, datetime):
+        # orjson only handles exact datetimes, pandas Timestamp is a subclass
+        return obj.isoformat()
+    if isinstance(obj, bytes):
+        return base64.b64encode(obj).decode()
+    raise TypeError(f"Type is not JSON serializable: {type(obj).__name__}")
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse rendered with orjson, accepts datetime, ObjectId, pandas Timestamp, bytes and numpy values."""
+
+    def render(self, content) -> bytes:
+        return orjson.dumps(content, default=_default, option=orjson.OPT_NON_STR_KEYS | orjson.OPT_SERIALIZE_NUMPY)
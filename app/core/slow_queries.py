@@ -0,0 +1,157 @@
+"""
+Slow query log.
+
+Commands slower than ``DAVINCI_SLOW_QUERY_MS`` are aggregated by collection, command and filter shape, the filter
+with its values stripped, so every get_filter combination is one entry whatever the ids and dates it was called
+with. getMore batches are charged to the find or aggregate that opened the cursor. The report lists the fields of
+each shape, the candidates for an index.
+"""
+import os
+import re
+import threading
+import time
+from collections import OrderedDict
+
+from pymongo.monitoring import CommandListener
+
+from app.core.metrics import command_collection, documents_returned
+from app.core.query_stats import command_filter, filter_shape
+
+SLOW_QUERY_MS = float(os.environ.get("DAVINCI_SLOW_QUERY_MS", 100))
+# distinct shapes kept, more are counted as dropped
+MAX_SHAPES = 1000
+# open cursors remembered for their getMore, the least recently used are forgotten first
+MAX_CURSORS = 10000
+SORT_KEYS = ("total", "count", "max", "mean", "documents")
+
+_FIELD = re.compile(r"([^\s{},\[\]]+): ")
+
+
+def shape_fields(shape: str) -> list:
+    """Field names of a filter shape, operators excluded."""
+    return sorted({x for x in _FIELD.findall(shape) if not x.startswith("$")})
+
+
+class SlowQueries(CommandListener):
+    """Aggregate the Mongo commands slower than a threshold by filter shape."""
+
+    def __init__(self, threshold_ms: float = SLOW_QUERY_MS):
+        self.threshold = threshold_ms / 1000
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._cursors = OrderedDict()
+        self._entries = {}
+        self.dropped = 0
+        self.since = time.time()
+
+    def started(self, event):
+        # shapes are only computed for slow commands and open cursors, keep the command until it finishes
+        with self._lock:
+            self._pending[(event.connection_id, event.request_id)] = (event.command_name, event.command,
+                                                                      command_collection(event))
+
+    def _pop(self, event):
+        with self._lock:
+            return self._pending.pop((event.connection_id, event.request_id), None)
+
+    @staticmethod
+    def _key(command_name: str, command, collection: str):
+        f = command_filter(command_name, command)
+        return None if f is None else (collection, command_name, filter_shape(f))
+
+    def _record(self, key, duration: float, documents: int):
+        entry = self._entries.get(key)
+        if entry is None:
+            if len(self._entries) >= MAX_SHAPES:
+                self.dropped += 1
+                return
+            entry = self._entries[key] = {"count": 0, "total": 0.0, "max": 0.0, "documents": 0, "last": 0.0}
+        entry["count"] += 1
+        entry["total"] += duration
+        entry["max"] = max(entry["max"], duration)
+        entry["documents"] += documents
+        entry["last"] = time.time()
+
+    def succeeded(self, event):
+        pending = self._pop(event)
+        if pending is None:
+            return
+        command_name, command, collection = pending
+        duration = event.duration_micros / 1e6
+        cursor_id = (event.reply.get("cursor") or {}).get("id", 0)
+        if command_name in ("getMore", "killCursors"):
+            with self._lock:
+                if command_name == "killCursors":
+                    for x in command.get("cursors", []):
+                        self._cursors.pop(x, None)
+                    return
+                if cursor_id == 0:
+                    key = self._cursors.pop(command["getMore"], None)
+                else:
+                    key = self._cursors.get(command["getMore"])
+                    if key is not None:
+                        self._cursors.move_to_end(command["getMore"])
+                if duration >= self.threshold and key is not None:
+                    self._record(key, duration, documents_returned(event.reply))
+            return
+        # fast commands are skipped, unless their cursor has batches left to charge
+        if duration < self.threshold and cursor_id == 0:
+            return
+        key = self._key(command_name, command, collection)
+        if key is None:
+            return
+        with self._lock:
+            if cursor_id != 0:
+                self._cursors[cursor_id] = key
+                if len(self._cursors) > MAX_CURSORS:
+                    self._cursors.popitem(last=False)
+            if duration >= self.threshold:
+                self._record(key, duration, documents_returned(event.reply))
+
+    def failed(self, event):
+        pending = self._pop(event)
+        if pending is None:
+            return
+        command_name, command, collection = pending
+        duration = event.duration_micros / 1e6
+        if command_name == "getMore":
+            with self._lock:
+                key = self._cursors.pop(command["getMore"], None)
+        elif duration >= self.threshold:
+            key = self._key(command_name, command, collection)
+        else:
+            return
+        if duration >= self.threshold and key is not None:
+            with self._lock:
+                self._record(key, duration, 0)
+
+    def report(self, top: int = 20, sort_by: str = "total", collection: str = None) -> dict:
+        """
+        Top slow filter shapes.
+
+        :param top: number of shapes returned
+        :param sort_by: one of SORT_KEYS, descending
+        :param collection: only this collection if given
+        :return: {"threshold_ms", "since", "dropped", "data": [{collection, command, shape, fields, count, total_ms,
+                 max_ms, mean_ms, documents}]}
+        """
+        with self._lock:
+            entries = [(k, dict(v)) for k, v in self._entries.items() if collection is None or k[0] == collection]
+            dropped = self.dropped
+        data = [{"collection": k[0], "command": k[1], "shape": k[2], "fields": shape_fields(k[2]),
+                 "count": v["count"], "total_ms": round(v["total"] * 1000, 1), "max_ms": round(v["max"] * 1000, 1),
+                 "mean_ms": round(v["total"] / v["count"] * 1000, 1), "documents": v["documents"],
+                 "last_seen": time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(v["last"]))} for k, v in entries]
+        key = {"total": "total_ms", "max": "max_ms", "mean": "mean_ms"}.get(sort_by, sort_by)
+        data.sort(key=lambda x: x[key], reverse=True)
+        since = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(self.since))
+        return {"threshold_ms": self.threshold * 1000, "since": since, "dropped": dropped, "data": data[:top]}
+
+    def reset(self):
+        with self._lock:
+            self._entries = {}
+            self.dropped = 0
+            self.since = time.time()
+
+
+slow_queries = SlowQueries()
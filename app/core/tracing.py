@@ -0,0 +1,327 @@
+"""
+Request tracing.
+
+A request is a trace of spans: the route (``TracingMiddleware``), the backend functions it calls (``traced``), their
+Mongo commands (``CommandSpans``) and the pandas sections in between (``span``). The current span is kept in a
+context variable, so sync routes in the threadpool and Motor calls in its executor attach their spans to the right
+parent. Finished spans go to the exporters chosen by ``DAVINCI_TRACE_EXPORTERS``: ``memory``, a ring buffer dumped
+by ``/admin/get_traces``, and ``otlp_file``, one OTLP/JSON export request per line in ``DAVINCI_TRACE_FILE``.
+An incoming W3C ``traceparent`` header continues the trace of the caller when its sampled flag is set, still subject
+to ``DAVINCI_TRACE_SAMPLE_RATE``; a caller that did not sample the request is not traced.
+"""
+import functools
+import inspect
+import json
+import logging
+import os
+import random
+import re
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from pymongo.monitoring import CommandListener
+
+from app.core.metrics import command_collection, documents_returned, route_of
+from app.core.query_stats import command_filter, filter_shape
+
+log = logging.getLogger(__name__)
+
+SERVICE_NAME = "DavinciService"
+TRACE_SAMPLE_RATE = float(os.environ.get("DAVINCI_TRACE_SAMPLE_RATE", 1))
+TRACE_EXPORTERS = os.environ.get("DAVINCI_TRACE_EXPORTERS", "memory")
+TRACE_FILE = os.environ.get("DAVINCI_TRACE_FILE", "traces.jsonl")
+TRACE_BUFFER_SIZE = int(os.environ.get("DAVINCI_TRACE_BUFFER_SIZE", 5000))
+
+# OTLP span kinds
+INTERNAL, SERVER, CLIENT = 1, 2, 3
+_KIND_NAMES = {INTERNAL: "internal", SERVER: "server", CLIENT: "client"}
+_TRACEPARENT = re.compile(r"^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$")
+
+_current: ContextVar = ContextVar("current_span", default=None)
+
+
+class Span:
+    __slots__ = ("trace_id", "span_id", "parent_id", "name", "kind", "start", "end", "attributes", "error")
+
+    def __init__(self, name: str, trace_id: str, parent_id: str = None, kind: int = INTERNAL, attributes=None):
+        self.trace_id = trace_id
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.start = time.time_ns()
+        self.end = None
+        self.attributes = attributes or {}
+        self.error = None
+
+    def child(self, name: str, kind: int = INTERNAL, attributes=None):
+        return Span(name, self.trace_id, self.span_id, kind, attributes)
+
+    def finish(self, error: BaseException = None):
+        self.end = time.time_ns()
+        if error is not None:
+            self.error = f"{type(error).__name__}: {error}"
+        tracer.export(self)
+
+    def to_dict(self) -> dict:
+        return {"trace_id": self.trace_id, "span_id": self.span_id, "parent_id": self.parent_id, "name": self.name,
+                "kind": _KIND_NAMES[self.kind], "start": self.start, "end": self.end,
+                "duration_ms": round((self.end - self.start) / 1e6, 3), "attributes": self.attributes,
+                "error": self.error}
+
+
+class RingBufferExporter:
+    """Keep the last spans in memory and group them by trace."""
+
+    def __init__(self, size: int = TRACE_BUFFER_SIZE):
+        self._spans = deque(maxlen=size)
+
+    def export(self, span: Span):
+        # deque appends are atomic
+        self._spans.append(span)
+
+    def traces(self, limit: int = 20, trace_id: str = None, min_duration_ms: float = 0) -> list:
+        """
+        Waterfalls of the last traces, newest first.
+
+        :param limit: number of traces returned
+        :param trace_id: only this trace if given
+        :param min_duration_ms: skip traces faster than this
+        :return: [{"trace_id", "name", "start", "duration_ms", "spans": [{..., "offset_ms", "depth"}]}]
+        """
+        grouped = {}
+        for span in list(self._spans):
+            if trace_id is None or span.trace_id == trace_id:
+                grouped.setdefault(span.trace_id, []).append(span)
+        result = []
+        for t_id, spans in reversed(grouped.items()):
+            spans.sort(key=lambda x: x.start)
+            ids = {x.span_id for x in spans}
+            roots = [x for x in spans if x.parent_id not in ids]
+            start, end = spans[0].start, max(x.end for x in spans)
+            if (end - start) / 1e6 < min_duration_ms:
+                continue
+            depth = {}
+            waterfall = []
+            for span in spans:
+                depth[span.span_id] = depth.get(span.parent_id, -1) + 1
+                waterfall.append({**span.to_dict(), "offset_ms": round((span.start - start) / 1e6, 3),
+                                  "depth": depth[span.span_id]})
+            result.append({"trace_id": t_id, "name": roots[0].name, "start": start,
+                           "duration_ms": round((end - start) / 1e6, 3), "spans": waterfall})
+            if len(result) >= limit:
+                break
+        return result
+
+
+def _otlp_value(value) -> dict:
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+class OTLPFileExporter:
+    """Append every span as an OTLP/JSON ExportTraceServiceRequest line, for an OpenTelemetry collector to read."""
+
+    def __init__(self, path: str = TRACE_FILE):
+        self.path = path
+        self._lock = threading.Lock()
+        self._file = open(path, "a", encoding="utf-8")
+
+    @staticmethod
+    def to_otlp(span: Span) -> dict:
+        doc = {"traceId": span.trace_id, "spanId": span.span_id, "name": span.name, "kind": span.kind,
+               "startTimeUnixNano": str(span.start), "endTimeUnixNano": str(span.end),
+               "attributes": [{"key": k, "value": _otlp_value(v)} for k, v in span.attributes.items()],
+               "status": {"code": 2, "message": span.error} if span.error else {"code": 1}}
+        if span.parent_id:
+            doc["parentSpanId"] = span.parent_id
+        return {"resourceSpans": [{
+            "resource": {"attributes": [{"key": "service.name", "value": {"stringValue": SERVICE_NAME}}]},
+            "scopeSpans": [{"scope": {"name": __name__}, "spans": [doc]}]}]}
+
+    def export(self, span: Span):
+        line = json.dumps(self.to_otlp(span), ensure_ascii=False) + "\n"
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+
+
+class Tracer:
+    def __init__(self, sample_rate: float = TRACE_SAMPLE_RATE):
+        self.sample_rate = sample_rate
+        self.exporters = []
+        self.memory = None
+
+    def add_exporter(self, exporter):
+        self.exporters = self.exporters + [exporter]
+        if isinstance(exporter, RingBufferExporter):
+            self.memory = exporter
+
+    def export(self, span: Span):
+        for exporter in self.exporters:
+            try:
+                exporter.export(span)
+            except Exception as e:
+                log.error(f"span export to {type(exporter).__name__} failed and raise the following exception: {e}")
+
+    def start_trace(self, name: str, traceparent: str = None, attributes=None):
+        """Root span of a request, None if the request is not sampled."""
+        if len(self.exporters) == 0:
+            return None
+        match = _TRACEPARENT.match(traceparent or "")
+        if match is not None and not int(match.group(3), 16) & 1:
+            # the caller did not sample the request
+            return None
+        if random.random() >= self.sample_rate:
+            return None
+        if match is not None:
+            return Span(name, match.group(1), match.group(2), SERVER, attributes)
+        return Span(name, f"{random.getrandbits(128):032x}", None, SERVER, attributes)
+
+
+tracer = Tracer()
+for _name in filter(None, (x.strip() for x in TRACE_EXPORTERS.split(","))):
+    if _name == "memory":
+        tracer.add_exporter(RingBufferExporter())
+    elif _name == "otlp_file":
+        tracer.add_exporter(OTLPFileExporter())
+    else:
+        log.error(f"unknown trace exporter {_name}, expected memory or otlp_file")
+
+
+def current_span() -> Span:
+    return _current.get()
+
+
+@contextmanager
+def span(name: str, **attributes):
+    """Time a block as a child of the current span, does nothing outside of a sampled request."""
+    parent = _current.get()
+    if parent is None:
+        yield None
+        return
+    child = parent.child(name, attributes=attributes)
+    token = _current.set(child)
+    try:
+        yield child
+    except BaseException as e:
+        _current.reset(token)
+        child.finish(e)
+        raise
+    _current.reset(token)
+    child.finish()
+
+
+def traced(name: str = None):
+    """Decorator timing every call of a sync or async function as a span named after its module and function."""
+
+    def decorator(fn):
+        span_name = name or f"{fn.__module__.rsplit('.', 1)[-1]}.{fn.__name__}"
+
+        if inspect.iscoroutinefunction(fn):
+            @functools.wraps(fn)
+            async def _async_wrapper(*args, **kwargs):
+                with span(span_name):
+                    return await fn(*args, **kwargs)
+
+            return _async_wrapper
+
+        @functools.wraps(fn)
+        def _wrapper(*args, **kwargs):
+            with span(span_name):
+                return fn(*args, **kwargs)
+
+        return _wrapper
+
+    return decorator
+
+
+class CommandSpans(CommandListener):
+    """Client span of every Mongo command issued inside a sampled request."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._pending = {}
+
+    def started(self, event):
+        parent = _current.get()
+        if parent is None:
+            return
+        collection = command_collection(event)
+        attributes = {"db.system": "mongodb", "db.name": event.database_name, "db.operation": event.command_name,
+                      "db.mongodb.collection": collection}
+        f = command_filter(event.command_name, event.command)
+        if f is not None:
+            attributes["db.statement"] = filter_shape(f)
+        child = parent.child(f"mongo.{event.command_name} {collection}", CLIENT, attributes)
+        with self._lock:
+            self._pending[(event.connection_id, event.request_id)] = child
+
+    def _pop(self, event):
+        with self._lock:
+            return self._pending.pop((event.connection_id, event.request_id), None)
+
+    def succeeded(self, event):
+        child = self._pop(event)
+        if child is not None:
+            child.attributes["db.documents"] = documents_returned(event.reply)
+            child.finish()
+
+    def failed(self, event):
+        child = self._pop(event)
+        if child is not None:
+            child.error = str(event.failure.get("errmsg", event.failure))
+            child.finish()
+
+
+command_spans = CommandSpans()
+
+
+class TracingMiddleware:
+    """Pure ASGI middleware opening the root span of each request and returning its id as X-Trace-Id."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        traceparent = None
+        for k, v in scope.get("headers", []):
+            if k == b"traceparent":
+                traceparent = v.decode("latin-1")
+        root = tracer.start_trace(f"{scope['method']} {scope['path']}", traceparent,
+                                  {"http.method": scope["method"], "http.target": scope["path"]})
+        if root is None:
+            await self.app(scope, receive, send)
+            return
+
+        async def _send(message):
+            if message["type"] == "http.response.start":
+                root.attributes["http.status_code"] = message["status"]
+                message = {**message, "headers": [*message.get("headers", []),
+                                                  (b"x-trace-id", root.trace_id.encode())]}
+            await send(message)
+
+        token = _current.set(root)
+        error = None
+        try:
+            await self.app(scope, receive, _send)
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            _current.reset(token)
+            route = route_of(scope)
+            root.name = f"{scope['method']} {route}"
+            root.attributes["http.route"] = route
+            root.finish(error)
@@ -1,6 +1,7 @@
 """
 General tool methods.
 """
+import io
 import logging
 import os
 import re
@@ -29,11 +30,24 @@ def pack_files(file_names: list):
     return os.path.join(BASE_DIR, zip_name)
 
 
+def _make_qrcode(i_id: str):
+    return qrcode.make(i_id, version=4, border=4, box_size=12)
+
+
 def generate_qrcode_pic(i_id: str):
     """
     Helper function, generate a qr_code picture.
     """
-    img = qrcode.make(i_id, version=4, border=4, box_size=12)
+    img = _make_qrcode(i_id)
     file_path = os.path.join(BASE_DATA_TEMP_DIR, f'{i_id}.png')
     img.save(file_path)
     return file_path
+
+
+def generate_qrcode_bytes(i_id: str) -> bytes:
+    """
+    Helper function, generate a qr_code picture in memory, as stored in the qr_code field of an instrument.
+    """
+    buffer = io.BytesIO()
+    _make_qrcode(i_id).save(buffer)
+    return buffer.getvalue()
@@ -0,0 +1,18 @@
+"""
+Rebuild the available stock counters of consumables from scratch.
+
+Run ``python -m app.core.workflow.supply_stock`` after editing the supplies collection by hand.
+"""
+import logging
+
+from app.core.database import rebuild_supply_stock, get_supply_stock
+
+log = logging.getLogger(__name__)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    if rebuild_supply_stock() == "unsuccessful":
+        raise SystemExit(1)
+    for stock in get_supply_stock():
+        log.info(f"{stock['c_name']}: {stock['available']}")
@@ -0,0 +1,152 @@
+"""
+Keep the display names stored on surgery documents in sync with users, instruments and supplies.
+
+Run ``python -m app.core.workflow.surgery_names`` to backfill surgeries written before names were stored.
+"""
+import logging
+
+from pymongo import UpdateOne
+
+from app.core.database.base import surgery
+from app.core.database import get_user, get_instrument, get_supply, get_surgery, update_surgery, \
+    set_user_display_name, set_instrument_display_name, set_consumable_display_name
+
+log = logging.getLogger(__name__)
+
+
+def lookup_display_names(u_ids: set, i_ids: set, c_ids: set):
+    """
+    Fetch names of users, instruments and supplies in one query per collection.
+
+    :return: ({u_id: name}, {str(i_id): i_name}, {str(c_id): {name, description}})
+    """
+    users, instruments, consumables = {}, {}, {}
+    if u_ids:
+        users = {x["u_id"]: x["name"] for x in get_user(u_id=list(u_ids))}
+    if i_ids:
+        instruments = {str(x["i_id"]): x["i_name"] for x in get_instrument(i_id=list(i_ids))}
+    if c_ids:
+        consumables = {str(x["c_id"]): {"name": x["c_name"], "description": x["description"]}
+                       for x in get_supply(c_id=list(c_ids))}
+    return users, instruments, consumables
+
+
+def _referenced_ids(doc: dict):
+    """Get user, instrument and supply ids referenced by a surgery."""
+    u_ids = {doc["chief_surgeon"], doc["associate_surgeon"],
+             *(doc["instrument_nurse"] or []), *(doc["circulating_nurse"] or [])} - {None}
+    i_ids = {x["id"] for x in doc["instruments"] or []}
+    c_ids = set(doc["consumables"] or [])
+    return u_ids, i_ids, c_ids
+
+
+def _select_names(doc: dict, users: dict, instruments: dict, consumables: dict) -> dict:
+    u_ids, i_ids, c_ids = _referenced_ids(doc)
+    return {"users": {k: users[k] for k in u_ids if k in users},
+            "instruments": {str(k): instruments[str(k)] for k in i_ids if str(k) in instruments},
+            "consumables": {str(k): consumables[str(k)] for k in c_ids if str(k) in consumables}}
+
+
+def build_display_names(chief_surgeon: str,
+                        associate_surgeon: str,
+                        instrument_nurse: list[str],
+                        circulating_nurse: list[str],
+                        instruments: list[dict],
+                        consumables: list[int]) -> dict:
+    """
+    Build the names sub-document stored on a surgery.
+
+    :param chief_surgeon: chief surgeon's id
+    :param associate_surgeon: associate surgeon's id
+    :param instrument_nurse: instrument nurses' ids
+    :param circulating_nurse: circulating nurses' ids
+    :param instruments: instruments, format in {id: 1, description: "默认"}
+    :param consumables: consumables, format in [1 ,2]
+    :return: {"users": {u_id: name}, "instruments": {i_id: i_name}, "consumables": {c_id: {name, description}}}
+    """
+    doc = dict(chief_surgeon=chief_surgeon, associate_surgeon=associate_surgeon, instrument_nurse=instrument_nurse,
+               circulating_nurse=circulating_nurse, instruments=instruments, consumables=consumables)
+    return _select_names(doc, *lookup_display_names(*_referenced_ids(doc)))
+
+
+def refresh_surgery_names(s_id: int):
+    """Rebuild the stored names of one surgery after its staff, instruments or consumables changed."""
+    docs = get_surgery(s_id=s_id)
+    if len(docs) == 0:
+        return "unsuccessful"
+    doc = docs[0]
+    names = build_display_names(chief_surgeon=doc["chief_surgeon"], associate_surgeon=doc["associate_surgeon"],
+                                instrument_nurse=doc["instrument_nurse"], circulating_nurse=doc["circulating_nurse"],
+                                instruments=doc["instruments"], consumables=doc["consumables"])
+    return update_surgery(s_id=s_id, p_name=None, names=names)
+
+
+def sync_user(u_id: str, new_id: str = None):
+    """
+    Re-sync a renamed user on the surgeries that reference it.
+
+    :param u_id: id the surgeries reference, the old id when it was changed
+    :param new_id: id the user has now, if it was changed
+    """
+    users = get_user(u_id=new_id or u_id)
+    if len(users) == 0:
+        log.warning(f"user {new_id or u_id} not found, skip syncing surgery names")
+        return "unsuccessful"
+    return set_user_display_name(u_id=u_id, name=users[0]["name"])
+
+
+def sync_instrument(i_id: int | list[int]):
+    """Re-sync edited instruments on the surgeries that used them."""
+    for instrument in get_instrument(i_id=i_id):
+        if set_instrument_display_name(i_id=instrument["i_id"], i_name=instrument["i_name"]) == "unsuccessful":
+            return "unsuccessful"
+    return "successful"
+
+
+def sync_consumable(c_id: int | list[int]):
+    """Re-sync edited supplies on the surgeries that used them."""
+    for supply in get_supply(c_id=c_id):
+        if set_consumable_display_name(c_id=supply["c_id"], c_name=supply["c_name"],
+                                       description=supply["description"]) == "unsuccessful":
+            return "unsuccessful"
+    return "successful"
+
+
+def backfill_surgery_names(batch_size: int = 500):
+    """
+    Store names on every surgery that has none yet.
+
+    :param batch_size: surgeries handled per lookup round
+    :return: number of updated surgeries
+    """
+    cursor = surgery.find({"names": {"$exists": False}}, {"_id": 0}).batch_size(batch_size)
+    updated = 0
+    batch = []
+    for doc in cursor:
+        batch.append(doc)
+        if len(batch) == batch_size:
+            updated += _backfill_batch(batch)
+            batch = []
+    if batch:
+        updated += _backfill_batch(batch)
+    return updated
+
+
+def _backfill_batch(docs: list[dict]) -> int:
+    u_ids, i_ids, c_ids = set(), set(), set()
+    for doc in docs:
+        u, i, c = _referenced_ids(doc)
+        u_ids |= u
+        i_ids |= i
+        c_ids |= c
+    users, instruments, consumables = lookup_display_names(u_ids, i_ids, c_ids)
+    requests = [UpdateOne({"s_id": doc["s_id"]},
+                          {"$set": {"names": _select_names(doc, users, instruments, consumables)}})
+                for doc in docs]
+    res = surgery.bulk_write(requests, ordered=False)
+    return res.modified_count
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    log.info(f"backfilled names on {backfill_surgery_names()} surgeries")
@@ -0,0 +1,434 @@
+"""
+Populate the database with a realistic synthetic dataset for benchmarks and load tests.
+
+Users of every USER_DICT type, surgeries of the surgery catalog over several years, the instruments and supplies
+they used, spare stock and messages are generated from one seed, so the same arguments always give the same data.
+Popularity is Zipf skewed: a few surgeons, surgery types and nurses account for most surgeries. Instruments are
+retired after their uses and replaced, supplies are spent by the surgeries, names, stock counters, id counters and
+inbox counters are filled in the way the service maintains them. Documents are written with unordered bulk inserts.
+
+Run ``python -m app.core.workflow.synthetic_data --surgeries 1000000 --years 5`` against an empty database, or with
+``--drop`` to clear the collections first. Dropping is refused unless ``DAVINCI_MONGO_URI`` points at this machine or
+the uri is repeated with ``--yes-drop``. The dataset ends on ``--end-date``, a date derived from the seed by default,
+so it does not depend on the day of the run.
+"""
+import argparse
+import json
+import logging
+import os
+from datetime import datetime, timedelta
+
+import numpy as np
+from passlib.context import CryptContext
+from pymongo.errors import InvalidURI
+from pymongo.uri_parser import parse_uri
+
+from app.constant import USER_DICT, DC_DEPARTMENT
+from app.core.backend.nurse import get_consumable_ls
+from app.core.database import ensure_supply_indexes, ensure_user_indexes, ensure_instrument_indexes, \
+    rebuild_supply_stock
+from app.core.database.base import mongo, surgery, user, apparatus, supplies, supply_stock, message, message_count, \
+    counters
+from app.core.database.message import ensure_message_indexes, rebuild_message_counts
+from app.core.database.utils import reserve_ids
+from app.core.utils import generate_qrcode_bytes
+
+log = logging.getLogger(__name__)
+
+CATALOG = os.path.join(os.path.dirname(os.path.dirname(__file__)), "data", "surgery_to_instruments.json")
+# department of each surgery of the catalog, by keywords of its name, first match wins
+DEPARTMENT_KEYWORDS = {"胆胰外科": ("胰",), "肝脾外科": ("肝", "脾"), "胸外科": ("肺", "胸", "食管"),
+                       "妇科": ("子宫", "卵巢"), "泌尿外科": ("前列腺", "膀胱", "肾", "输尿管", "腹股沟"),
+                       "胃肠外科": ("结肠", "直肠")}
+SURNAMES = list("王李张刘陈杨黄赵吴周徐孙马朱胡郭何高林罗郑梁谢宋唐许韩冯邓曹彭曾肖田董袁潘于蒋蔡余杜叶程苏")
+GIVEN_NAMES = list("伟芳娜敏静丽强磊军洋勇艳杰娟涛明超秀霞平刚桂英华玉兰萍红鹏辉建国志文斌宇浩凯子淇晨欣怡婷")
+MESSAGE_CONTENTS = ["器械{}使用异常，请检查", "耗材库存不足，请及时补充", "手术记录填写有误，请协助修改",
+                    "二维码无法识别", "账号信息需要更新", "器械{}使用次数与实际不符"]
+FEEDBACKS = ["已处理", "已联系厂家", "已补充库存", "已更正记录"]
+INSTRUMENT_TIMES = 12
+INSTRUMENT_FAULT_RATE = 0.02
+CONSUMABLE_FAULT_RATE = 0.03
+# the default end date is this day plus seed % 365 days
+BASE_END_DATE = datetime(2023, 1, 1)
+LOCAL_HOSTS = ("localhost", "127.0.0.1", "::1")
+
+
+def zipf_weights(n: int, skew: float, rng: np.random.Generator) -> np.ndarray:
+    """Probabilities of n items following a Zipf law of exponent skew, in random order, uniform if skew is 0."""
+    weights = 1 / np.arange(1, n + 1) ** skew
+    return rng.permutation(weights / weights.sum())
+
+
+def department_of(s_name: str) -> str:
+    department = next((k for k, v in DEPARTMENT_KEYWORDS.items() if any(x in s_name for x in v)), "胃肠外科")
+    return DC_DEPARTMENT[department]
+
+
+def _names(rng: np.random.Generator, n: int) -> list:
+    surnames = rng.choice(SURNAMES, n)
+    lengths = rng.integers(1, 3, n)
+    return [str(s) + "".join(rng.choice(GIVEN_NAMES, k)) for s, k in zip(surnames, lengths)]
+
+
+def _phone_numbers(rng: np.random.Generator, n: int, taken: set) -> list:
+    numbers = []
+    while len(numbers) < n:
+        number = str(13000000000 + int(rng.integers(0, 10 ** 9)))
+        if number not in taken:
+            taken.add(number)
+            numbers.append(number)
+    return numbers
+
+
+def default_end_date(seed: int) -> datetime:
+    """End of the dataset when none is given, fixed for a seed."""
+    return BASE_END_DATE + timedelta(days=seed % 365)
+
+
+def _next_id(collection, key: str) -> int:
+    last = list(collection.find({}, {key: 1}).sort([(key, -1)]).limit(1))
+    return last[0][key] + 1 if last else 0
+
+
+def _insert(collection, docs: list):
+    if len(docs) != 0:
+        collection.insert_many(docs, ordered=False)
+
+
+class _InstrumentPool:
+    """A few instruments of each name in service, an exhausted one is retired and replaced by a new one."""
+
+    def __init__(self, rng: np.random.Generator, next_id: int, size: int, fast_qr: bool):
+        self.rng = rng
+        self.next_id = next_id
+        self.size = size
+        self.fast_qr = fast_qr
+        self._qr_code = None
+        self.active = {}
+        self.retired = []
+        self.created = 0
+
+    def _new(self, i_name: str, when: datetime) -> list:
+        i_id = self.next_id
+        self.next_id += 1
+        self.created += 1
+        return [i_id, i_name, INSTRUMENT_TIMES, when]
+
+    def use(self, i_name: str, when: datetime) -> int:
+        pool = self.active.setdefault(i_name, [])
+        while len(pool) < self.size:
+            pool.append(self._new(i_name, when))
+        k = int(self.rng.integers(len(pool)))
+        instrument = pool[k]
+        instrument[2] -= 1
+        if instrument[2] == 0:
+            self.retired.append(instrument)
+            pool[k] = self._new(i_name, when)
+        return instrument[0]
+
+    def _qr(self, i_id: int) -> bytes:
+        if not self.fast_qr:
+            return generate_qrcode_bytes(str(i_id))
+        # one picture of the same size for every instrument, rendering them is the slowest part of the generation
+        if self._qr_code is None:
+            self._qr_code = generate_qrcode_bytes(str(i_id))
+        return self._qr_code
+
+    def flush(self, final: bool = False) -> list:
+        instruments = self.retired
+        self.retired = []
+        if final:
+            instruments += [x for pool in self.active.values() for x in pool]
+            self.active = {}
+        return [dict(i_id=i_id, i_name=i_name, times=times, qr_code=self._qr(i_id), insert_time=when)
+                for i_id, i_name, times, when in instruments]
+
+
+def generate_users(rng: np.random.Generator, doctors: int, nurses: int, admins: int, password: str,
+                   end: datetime) -> dict:
+    """
+    Insert users of every type registered in the year before end, they all share the same password.
+
+    :return: {user_type: [{u_id, name}]}
+    """
+    code = CryptContext(schemes=["bcrypt"], deprecated="auto").hash(password)
+    taken = {x["u_id"] for x in user.find({}, {"_id": 0, "u_id": 1})}
+    accounts = {}
+    docs = []
+    for user_type, n in ((USER_DICT["医生"], doctors), (USER_DICT["护士"], nurses), (USER_DICT["管理员"], admins)):
+        accounts[user_type] = [{"u_id": u_id, "name": name}
+                               for u_id, name in zip(_phone_numbers(rng, n, taken), _names(rng, n))]
+        docs += [dict(u_id=x["u_id"], name=x["name"], user_type=user_type, code=code,
+                      insert_datetime=end - timedelta(days=int(rng.integers(0, 365))))
+                 for x in accounts[user_type]]
+    _insert(user, docs)
+    return accounts
+
+
+def generate_surgeries(rng: np.random.Generator,
+                       accounts: dict,
+                       n: int,
+                       years: float,
+                       skew: float,
+                       batch_size: int,
+                       pool_size: int,
+                       fast_qr: bool,
+                       end: datetime) -> dict:
+    """
+    Insert surgeries spread over the years before end, with the instruments and supplies they used.
+
+    Weekdays are four times as busy as weekends and activity grows by half over the period. Surgery types, chief
+    surgeons within a department and nurses are Zipf distributed.
+
+    :return: number of inserted surgeries, instruments and supplies
+    """
+    with open(CATALOG, encoding='utf-8') as f:
+        catalog = json.load(f)
+    s_names = list(catalog.keys())
+    s_weights = zipf_weights(len(s_names), skew, rng)
+
+    # doctors are spread over the departments that operate, chief surgeons are Zipf distributed in each of them
+    doctors = accounts[USER_DICT["医生"]]
+    nurses = accounts[USER_DICT["护士"]]
+    departments = sorted({department_of(x) for x in s_names})
+    staff = {d: doctors[i::len(departments)] or doctors for i, d in enumerate(departments)}
+    staff_weights = {d: zipf_weights(len(x), skew, rng) for d, x in staff.items()}
+    nurse_weights = zipf_weights(len(nurses), skew / 2, rng)
+    user_names = {x["u_id"]: x["name"] for x in doctors + nurses}
+
+    end = end.replace(hour=0, minute=0, second=0, microsecond=0)
+    n_days = max(int(years * 365), 1)
+    start = end - timedelta(days=n_days)
+    day_weights = np.array([(1 if (start + timedelta(days=i)).weekday() < 5 else 0.25) * (1 + 0.5 * i / n_days)
+                            for i in range(n_days)])
+    days = np.sort(rng.choice(n_days, n, p=day_weights / day_weights.sum()))
+
+    s_id = _next_id(surgery, "s_id")
+    admission_number = 1000000 + s_id
+    instruments = _InstrumentPool(rng, _next_id(apparatus, "i_id"), pool_size, fast_qr)
+    inserted = {"surgery": 0, "supplies": 0}
+    for chunk_start in range(0, n, batch_size):
+        size = min(batch_size, n - chunk_start)
+        kinds = rng.choice(len(s_names), size, p=s_weights)
+        begin_minutes = rng.integers(8 * 60, 18 * 60, size)
+        durations = np.clip(rng.lognormal(np.log(180), 0.35, size), 60, 600).astype(int)
+        patients = _names(rng, size)
+        consumable_names = [get_consumable_ls(catalog[s_names[k]]) for k in kinds]
+        c_id = reserve_ids(supplies, "c_id", sum(map(len, consumable_names)))
+
+        surgery_docs, supply_docs = [], []
+        for i in range(size):
+            s_name = s_names[kinds[i]]
+            department = department_of(s_name)
+            date = start + timedelta(days=int(days[chunk_start + i]))
+            begin_time = date + timedelta(minutes=int(begin_minutes[i]))
+            team = staff[department]
+            if len(team) > 1:
+                chief, associate = rng.choice(len(team), 2, replace=False, p=staff_weights[department])
+                associate_surgeon = team[associate]["u_id"]
+            else:
+                chief, associate_surgeon = 0, None
+            chief_surgeon = team[chief]["u_id"]
+            picked = rng.choice(len(nurses), 3, replace=False, p=nurse_weights)
+            instrument_nurse = [nurses[picked[0]]["u_id"]]
+            circulating_nurse = [nurses[x]["u_id"] for x in picked[1:1 + int(rng.integers(1, 3))]]
+
+            used_instruments, instrument_names = [], {}
+            for i_name in catalog[s_name]:
+                i_id = instruments.use(i_name, begin_time)
+                description = "故障" if rng.random() < INSTRUMENT_FAULT_RATE else "默认"
+                used_instruments.append({"id": i_id, "description": description})
+                instrument_names[str(i_id)] = i_name
+            used_consumables, consumable_names_doc = [], {}
+            for c_name in consumable_names[i]:
+                description = "破损" if rng.random() < CONSUMABLE_FAULT_RATE else "默认"
+                supply_docs.append(dict(c_id=c_id, c_name=c_name, description=description,
+                                        insert_time=date - timedelta(days=int(rng.integers(1, 60)))))
+                used_consumables.append(c_id)
+                consumable_names_doc[str(c_id)] = {"name": c_name, "description": description}
+                c_id += 1
+
+            u_ids = {chief_surgeon, associate_surgeon, *instrument_nurse, *circulating_nurse} - {None}
+            surgery_docs.append(dict(
+                s_id=s_id, p_name=patients[i], date=date, admission_number=admission_number, department=department,
+                s_name=s_name, chief_surgeon=chief_surgeon, associate_surgeon=associate_surgeon,
+                instrument_nurse=instrument_nurse, circulating_nurse=circulating_nurse, begin_time=begin_time,
+                end_time=begin_time + timedelta(minutes=int(durations[i])), instruments=used_instruments,
+                consumables=used_consumables,
+                names={"users": {x: user_names[x] for x in u_ids}, "instruments": instrument_names,
+                       "consumables": consumable_names_doc}))
+            s_id += 1
+            admission_number += 1
+
+        _insert(apparatus, instruments.flush())
+        _insert(supplies, supply_docs)
+        _insert(surgery, surgery_docs)
+        inserted["surgery"] += size
+        inserted["supplies"] += len(supply_docs)
+        log.info(f"inserted {inserted['surgery']}/{n} surgeries")
+    _insert(apparatus, instruments.flush(final=True))
+    inserted["apparatus"] = instruments.created
+    return inserted
+
+
+def generate_stock(stock: int, end: datetime) -> int:
+    """Insert unused supplies of every consumable name, stock of each, received at end."""
+    c_names = sorted(set(get_consumable_ls(["电剪"])))
+    total = stock * len(c_names)
+    if total == 0:
+        return 0
+    c_id = reserve_ids(supplies, "c_id", total)
+    _insert(supplies, [dict(c_id=c_id + i, c_name=c_name, insert_time=end, description="")
+                       for i, c_name in enumerate(x for x in c_names for _ in range(stock))])
+    return total
+
+
+def generate_messages(rng: np.random.Generator, accounts: dict, n: int, years: float, batch_size: int,
+                      end: datetime) -> int:
+    """
+    Insert messages of doctors and nurses sent over the years before end, older ones are mostly handled.
+
+    :return: number of inserted messages
+    """
+    senders = accounts[USER_DICT["医生"]] + accounts[USER_DICT["护士"]]
+    if n == 0 or len(senders) == 0:
+        return 0
+    span = years * 365 * 24 * 3600
+    ages = np.sort(rng.uniform(0, span, n))[::-1]
+    m_id = _next_id(message, "m_id")
+    for chunk_start in range(0, n, batch_size):
+        docs = []
+        for age in ages[chunk_start:chunk_start + batch_size]:
+            recent = age < 30 * 24 * 3600
+            status = int(rng.choice([1, 2, 3], p=[0.5, 0.2, 0.3] if recent else [0.05, 0.05, 0.9]))
+            sender = senders[int(rng.integers(len(senders)))]
+            content = MESSAGE_CONTENTS[int(rng.integers(len(MESSAGE_CONTENTS)))].format(int(rng.integers(0, 1000)))
+            docs.append(dict(m_id=m_id, status=status, priority=int(rng.choice([1, 2, 3], p=[0.6, 0.3, 0.1])),
+                             feedback="NULL" if status == 1 else FEEDBACKS[int(rng.integers(len(FEEDBACKS)))],
+                             u_id=sender["u_id"], u_name=sender["name"],
+                             insert_time=end - timedelta(seconds=float(age)), content=content))
+            m_id += 1
+        _insert(message, docs)
+    return n
+
+
+def is_local_uri(uri: str) -> bool:
+    """Whether every host of a mongodb uri is this machine, mongodb+srv uris never are."""
+    try:
+        nodes = parse_uri(uri)["nodelist"] if uri.startswith("mongodb://") else []
+    except (InvalidURI, ValueError):
+        return False
+    return len(nodes) != 0 and all(host in LOCAL_HOSTS or host.endswith(".sock") for host, _ in nodes)
+
+
+def drop_collections(confirm: str = None):
+    """
+    Drop the collections the dataset is written to.
+
+    :param confirm: DAVINCI_MONGO_URI repeated, needed unless it points at this machine or the client is mongomock
+    :raise ValueError: if the database may be a shared one and confirm does not match
+    """
+    uri = mongo.settings.uri
+    in_memory = type(mongo.client).__module__.startswith("mongomock")
+    if not (in_memory or is_local_uri(uri) or confirm == uri):
+        raise ValueError(f"refusing to drop the collections of {mongo.settings.db} on a database that is not local, "
+                         f"set DAVINCI_MONGO_URI to a local mongod or confirm with --yes-drop <DAVINCI_MONGO_URI>")
+    for collection in (surgery, user, apparatus, supplies, supply_stock, message, message_count, counters):
+        collection.drop()
+
+
+def generate(seed: int = 0,
+             surgeries: int = 100000,
+             years: float = 5,
+             doctors: int = 60,
+             nurses: int = 120,
+             admins: int = 5,
+             messages: int = 20000,
+             stock: int = 200,
+             skew: float = 1.1,
+             batch_size: int = 10000,
+             pool_size: int = 4,
+             password: str = "davinci",
+             fast_qr: bool = False,
+             drop: bool = False,
+             confirm_drop: str = None,
+             end_date: datetime = None) -> dict:
+    """
+    Generate the whole dataset.
+
+    :param seed: random seed, the same arguments and seed give the same data
+    :param surgeries: number of surgeries
+    :param years: surgeries and messages are spread over this many past years
+    :param doctors: number of doctors
+    :param nurses: number of nurses
+    :param admins: number of administrators
+    :param messages: number of messages
+    :param stock: unused supplies of each consumable name
+    :param skew: Zipf exponent of surgeon, surgery type and nurse popularity, 0 for uniform
+    :param batch_size: documents per insert_many
+    :param pool_size: instruments of each name in service at the same time
+    :param password: password of every generated user
+    :param fast_qr: share one rendered qr_code picture between all instruments
+    :param drop: drop the collections first
+    :param confirm_drop: DAVINCI_MONGO_URI repeated, to drop the collections of a database that is not local
+    :param end_date: the dataset ends on this day, default_end_date(seed) if None
+    :return: {"accounts": {user_type: [{u_id, name}]}, "password", "inserted": {collection: number}}
+    """
+    if doctors < 1 or nurses < 3:
+        raise ValueError("at least one doctor and three nurses are needed to staff the surgeries")
+    rng = np.random.default_rng(seed)
+    end = end_date or default_end_date(seed)
+    if drop:
+        drop_collections(confirm=confirm_drop)
+    accounts = generate_users(rng, doctors, nurses, admins, password, end)
+    inserted = generate_surgeries(rng, accounts, surgeries, years, skew, batch_size, pool_size, fast_qr, end)
+    inserted["supplies"] += generate_stock(stock, end)
+    inserted["message"] = generate_messages(rng, accounts, messages, years, batch_size, end)
+    inserted["user"] = doctors + nurses + admins
+
+    ensure_supply_indexes()
+    ensure_user_indexes()
+    ensure_instrument_indexes()
+    ensure_message_indexes()
+    rebuild_supply_stock()
+    rebuild_message_counts()
+    return {"accounts": accounts, "password": password, "inserted": inserted}
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Populate the database with a synthetic dataset.")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--surgeries", type=int, default=100000)
+    parser.add_argument("--years", type=float, default=5)
+    parser.add_argument("--doctors", type=int, default=60)
+    parser.add_argument("--nurses", type=int, default=120)
+    parser.add_argument("--admins", type=int, default=5)
+    parser.add_argument("--messages", type=int, default=20000)
+    parser.add_argument("--stock", type=int, default=200, help="unused supplies of each consumable name")
+    parser.add_argument("--skew", type=float, default=1.1, help="Zipf exponent of popularity, 0 for uniform")
+    parser.add_argument("--batch-size", type=int, default=10000)
+    parser.add_argument("--pool-size", type=int, default=4, help="instruments of each name in service")
+    parser.add_argument("--password", default="davinci", help="password of every generated user")
+    parser.add_argument("--fast-qr", action="store_true", help="share one qr_code picture between instruments")
+    parser.add_argument("--drop", action="store_true", help="drop the collections first")
+    parser.add_argument("--yes-drop", metavar="URI",
+                        help="DAVINCI_MONGO_URI repeated, to --drop the collections of a database that is not local")
+    parser.add_argument("--end-date", type=datetime.fromisoformat,
+                        help="last day of the dataset, YYYY-MM-DD, derived from the seed by default")
+    parser.add_argument("--accounts", help="write the generated accounts to this json file, for load tests")
+    args = parser.parse_args()
+    if "DAVINCI_MONGO_URI" not in os.environ:
+        parser.error("set DAVINCI_MONGO_URI to the database to populate, the default one is the shared deployment")
+
+    try:
+        res = generate(seed=args.seed, surgeries=args.surgeries, years=args.years, doctors=args.doctors,
+                       nurses=args.nurses, admins=args.admins, messages=args.messages, stock=args.stock,
+                       skew=args.skew, batch_size=args.batch_size, pool_size=args.pool_size, password=args.password,
+                       fast_qr=args.fast_qr, drop=args.drop, confirm_drop=args.yes_drop, end_date=args.end_date)
+    except ValueError as e:
+        parser.error(str(e))
+    if args.accounts:
+        with open(args.accounts, "w", encoding="utf-8") as f:
+            json.dump({"password": res["password"], "accounts": res["accounts"]}, f, ensure_ascii=False, indent=2)
+    log.info(f"inserted {res['inserted']}")
@@ -1,7 +1,27 @@
-from fastapi import FastAPI
+import logging
+
+from fastapi import FastAPI, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse
+from pymongo.errors import ExecutionTimeout
 from starlette.middleware.cors import CORSMiddleware
 
-from app.router import user, nurse, doctor, administrator
+from app.core.backend.user import authorize_admin_scope
+from app.core.database import ensure_supply_indexes, ensure_supply_stock, ensure_user_indexes, \
+    ensure_instrument_indexes
+from app.core.database.message import ensure_message_indexes, ensure_message_counts
+from app.core.database.aio.base import warmup
+from app.core.database.base import mongo
+from app.core.deadline import DeadlineExceeded, record_overrun
+from app.core.loop_watchdog import watchdog
+from app.core.metrics import MetricsMiddleware, command_metrics
+from app.core.profiler import ProfilerMiddleware
+from app.core.query_stats import DEBUG, QueryStatsMiddleware, query_stats
+from app.core.slow_queries import slow_queries
+from app.core.tracing import TracingMiddleware, command_spans
+from app.router import user, nurse, doctor, administrator, system
+
+log = logging.getLogger(__name__)
 
 app = FastAPI(
     title='DavinciService'
@@ -14,9 +34,55 @@ app.add_middleware(
     allow_methods=["*"],
     allow_headers=["*"]
 )
+app.add_middleware(MetricsMiddleware)
+mongo.command_events.subscribe(command_metrics)
+mongo.command_events.subscribe(query_stats)
+mongo.command_events.subscribe(slow_queries)
+mongo.command_events.subscribe(command_spans)
+if DEBUG:
+    app.add_middleware(QueryStatsMiddleware)
+app.add_middleware(TracingMiddleware)
+app.add_middleware(ProfilerMiddleware, authorize=authorize_admin_scope)
 
 app.include_router(user.router, prefix="")
 app.include_router(nurse.router, prefix="")
 app.include_router(doctor.router, prefix="")
 app.include_router(administrator.router, prefix="")
+app.include_router(system.router, prefix="")
+
+
+@app.exception_handler(DeadlineExceeded)
+@app.exception_handler(ExecutionTimeout)
+async def time_budget_exceeded(request: Request, exc: Exception):
+    record_overrun(request.url.path)
+    log.warning(f"{request.url.path} exceeded its time budget")
+    return JSONResponse(status_code=503, content={"detail": "Request exceeded its time budget, please narrow it down."})
+
+
+def _prepare_database():
+    if mongo.warmup():
+        ensure_supply_indexes()
+        ensure_user_indexes()
+        ensure_instrument_indexes()
+        ensure_message_indexes()
+        ensure_message_counts()
+        ensure_supply_stock()
+    else:
+        log.error("skip index creation, database is unreachable")
+
+
+@app.on_event("startup")
+async def start_watchdog():
+    watchdog.start()
+
+
+@app.on_event("shutdown")
+async def stop_watchdog():
+    watchdog.stop()
+
 
+@app.on_event("startup")
+async def warmup_database():
+    # a database that is down only delays startup by serverSelectionTimeoutMS, /ready reports it afterwards
+    await warmup()
+    await run_in_threadpool(_prepare_database)
@@ -2,6 +2,8 @@ from datetime import datetime
 from typing import Optional, Union
 from pydantic import BaseModel
 
+from app.model.page import Page
+
 
 class Doctor(BaseModel):
     u_id: str
@@ -23,3 +25,17 @@ class Message(BaseModel):
     feedback: Optional[str] = None
 
 
+class MessagePage(Message, Page):
+    pass
+
+
+class MessageTriage(BaseModel):
+    m_id: Optional[list[int]] = None
+    status_filter: Optional[Union[str, list[str]]] = None
+    priority_filter: Optional[Union[str, list[str]]] = None
+    begin_time: Optional[datetime] = None
+    end_time: Optional[datetime] = None
+    u_id: Optional[str] = None
+    status: Optional[str] = None
+    priority: Optional[str] = None
+    feedback: Optional[str] = None
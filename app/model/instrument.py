@@ -2,6 +2,8 @@ from datetime import datetime
 from typing import Optional, Union
 from pydantic import BaseModel
 
+from app.model.page import Page
+
 
 class Instrument(BaseModel):
     i_id: Optional[Union[int, list[int]]] = None
@@ -10,3 +12,7 @@ class Instrument(BaseModel):
     begin_time: Optional[datetime] = None
     end_time: Optional[datetime] = None
     validity: bool = None
+
+
+class InstrumentPage(Instrument, Page):
+    pass
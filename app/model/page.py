@@ -0,0 +1,11 @@
+from typing import Optional
+from pydantic import BaseModel, conint
+
+from app.constant import MAX_PAGE_SIZE
+
+
+class Page(BaseModel):
+    page: conint(ge=1) = 1
+    limit_size: conint(ge=1, le=MAX_PAGE_SIZE) = 20
+    sort_by: Optional[str] = None
+    descending: Optional[bool] = None
@@ -3,6 +3,8 @@ from typing import Union, Optional
 
 from pydantic import BaseModel
 
+from app.model.page import Page
+
 
 class Supply(BaseModel):
     begin_time: Optional[datetime] = None
@@ -13,11 +15,24 @@ class Supply(BaseModel):
     validity: Optional[bool] = None
 
 
+class SupplyPage(Supply, Page):
+    pass
+
+
+class SupplyInventory(Page):
+    c_name: Optional[Union[str, list[str]]] = None
+    detail: bool = False
+
+
 class SupplyGet(BaseModel):
     c_name: str
     num: int
 
 
+class SupplyManifest(BaseModel):
+    items: list[SupplyGet]
+
+
 class SupplyRevise(BaseModel):
     c_id: int
     description: str
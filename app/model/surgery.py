@@ -25,6 +25,7 @@ class SurgeryGet(BaseModel):
     end_time: Optional[datetime] = None
     department: Union[str, list[str]] = None
     s_name: Union[str, list[str]] = None
+    fields: Optional[list[str]] = None
 
 
 class SurgeryUpdate(BaseModel):
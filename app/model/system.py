@@ -0,0 +1,33 @@
+from typing import Optional
+
+from pydantic import BaseModel, conint, confloat
+
+from app.constant import MAX_PAGE_SIZE
+from app.core.profiler import MAX_PROFILE_SECONDS
+
+
+class SlowQueries(BaseModel):
+    top: conint(ge=1, le=MAX_PAGE_SIZE) = 20
+    sort_by: str = "total"
+    collection: Optional[str] = None
+    reset: bool = False
+
+
+class Traces(BaseModel):
+    limit: conint(ge=1, le=MAX_PAGE_SIZE) = 20
+    trace_id: Optional[str] = None
+    min_duration_ms: float = 0
+
+
+class Profile(BaseModel):
+    seconds: confloat(gt=0, le=MAX_PROFILE_SECONDS) = 10
+    interval_ms: conint(ge=1, le=1000) = 10
+    idle: bool = False
+    memory: bool = False
+    top: conint(ge=1, le=MAX_PAGE_SIZE) = 20
+    collapsed_only: bool = False
+
+
+class ProfileGet(BaseModel):
+    profile_id: str
+    collapsed_only: bool = False
@@ -1,6 +1,8 @@
 from typing import Optional, Union
 from pydantic import BaseModel
 
+from app.model.page import Page
+
 
 class User(BaseModel):
     u_id: Union[list[str], str] = None
@@ -8,3 +10,7 @@ class User(BaseModel):
     user_type: Optional[Union[list[str], str]] = None
     pwd: Optional[str] = None
     new_id: Optional[str] = None
+
+
+class UserPage(User, Page):
+    pass
@@ -1,23 +1,33 @@
 import os
 from typing import Union
 
-from fastapi import APIRouter, UploadFile, Depends
-from fastapi.responses import FileResponse
-from starlette.background import BackgroundTasks
+from fastapi import APIRouter, UploadFile, Depends, BackgroundTasks
+from fastapi.responses import FileResponse, StreamingResponse, PlainTextResponse
 
+from app.constant import DASHBOARD_TIME_BUDGET, ANALYTICS_TIME_BUDGET, LIST_TIME_BUDGET
 from app.core.backend.administrator import delete_user_by_uid, add_users_by_file, get_users, update_message_by_mid, \
-    get_message_by_filter, delete_message_by_mid
+    get_message_by_filter, delete_message_by_mid, get_users_page, get_message_page_by_filter, get_message_count, \
+    triage_messages_by_filter
 from app.core.backend.dashboard import get_surgery_dashboard, get_doctor_contribution, get_general_data
 from app.core.backend.instrument import get_all_instrument, revise_instrument, add_instruments_by_file, \
-    add_one_instrument, download_instrument_qr_code, delete_instruments_by_id, get_instrument_general
-from app.core.backend.supply import get_supply_general, insert_supplies, delete_supply_by_id, update_supply_description
+    add_one_instrument, download_instrument_qr_code, delete_instruments_by_id, get_instrument_general, \
+    get_instrument_page_general
+from app.core.backend.supply import get_supply_general, insert_supplies, delete_supply_by_id, \
+    update_supply_description, insert_supply_manifest, get_supply_page_general, get_supply_inventory_general
 from app.core.backend.surgery import get_surgery_by_tds, update_surgery_info, insert_surgery_admin
-from app.core.backend.user import register, revise_user_info, auth
-from app.model.doctor import Message
-from app.model.instrument import Instrument
+from app.core.backend.system import get_slow_query_report, get_traces, run_profile, get_profile
+from app.core.backend.user import register, revise_user_info, auth, require_admin
+from app.core.database.base import analytical_reads
+from app.core.deadline import time_budget
+from app.core.inbox import broker
+from app.core.response import FastJSONResponse
+from app.core.workflow.surgery_names import sync_user, sync_consumable
+from app.model.doctor import Message, MessagePage, MessageTriage
+from app.model.instrument import Instrument, InstrumentPage
 from app.model.surgery import SurgeryGet, SurgeryUpdate, Contribution
-from app.model.supply import Supply, SupplyGet, SupplyRevise
-from app.model.user import User
+from app.model.supply import Supply, SupplyGet, SupplyRevise, SupplyManifest, SupplyPage, SupplyInventory
+from app.model.system import SlowQueries, Traces, Profile, ProfileGet
+from app.model.user import User, UserPage
 
 router = APIRouter(prefix="/admin")
 
@@ -28,13 +38,25 @@ def add_user(user: User):
 
 
 @router.post('/revise_user', tags=['Admin'])
-def revise_user(user: User):
-    return revise_user_info(u_id=user.u_id, pwd=user.pwd, name=user.name, new_u_id=user.new_id)
+def revise_user(user: User, background_tasks: BackgroundTasks):
+    res = revise_user_info(u_id=user.u_id, pwd=user.pwd, name=user.name, new_u_id=user.new_id)
+    if user.name is not None:
+        background_tasks.add_task(sync_user, user.u_id, user.new_id)
+    return res
+
 
+@router.post('/get_user', tags=['Admin'], dependencies=[Depends(auth.decode_token)],
+             response_class=FastJSONResponse)
+async def get_users_api(user: User):
+    return FastJSONResponse(await get_users(u_id=user.u_id, user_type=user.user_type, name=user.name))
 
-@router.post('/get_user', tags=['Admin'], dependencies=[Depends(auth.decode_token)])
-def get_users_api(user: User):
-    return get_users(u_id=user.u_id, user_type=user.user_type, name=user.name)
+
+@router.post('/get_user_page', tags=['Admin'], dependencies=[Depends(auth.decode_token)],
+             response_class=FastJSONResponse)
+async def get_user_page_api(user: UserPage):
+    return FastJSONResponse(await get_users_page(page=user.page, limit_size=user.limit_size, sort_by=user.sort_by,
+                                                 descending=user.descending, u_id=user.u_id,
+                                                 user_type=user.user_type, name=user.name))
 
 
 @router.post('/delete_user', tags=['Admin'], dependencies=[Depends(auth.decode_token)])
@@ -55,16 +77,29 @@ async def upload_users(file: UploadFile):
     return res
 
 
-@router.get("/get_instruments", tags=['Admin'], dependencies=[Depends(auth.decode_token)])
+@router.get("/get_instruments", tags=['Admin'], dependencies=[Depends(auth.decode_token)],
+            response_class=FastJSONResponse)
 def get_instrument_api():
-    return get_all_instrument()
+    return FastJSONResponse(get_all_instrument())
 
 
-@router.post("/get_specific_instruments", tags=['Admin'], dependencies=[Depends(auth.decode_token)])
+@router.post("/get_specific_instruments", tags=['Admin'], dependencies=[Depends(auth.decode_token)],
+             response_class=FastJSONResponse)
 def get_instrument(instrument: Instrument):
-    return get_instrument_general(begin_time=instrument.begin_time, end_time=instrument.end_time,
-                                  times=instrument.times, i_id=instrument.i_id,
-                                  i_name=instrument.i_name, validity=instrument.validity)
+    return FastJSONResponse(get_instrument_general(begin_time=instrument.begin_time, end_time=instrument.end_time,
+                                                   times=instrument.times, i_id=instrument.i_id,
+                                                   i_name=instrument.i_name, validity=instrument.validity))
+
+
+@router.post("/get_instrument_page", tags=['Admin'], dependencies=[Depends(auth.decode_token)],
+             response_class=FastJSONResponse)
+def get_instrument_page_api(instrument: InstrumentPage):
+    return FastJSONResponse(get_instrument_page_general(page=instrument.page, limit_size=instrument.limit_size,
+                                                        sort_by=instrument.sort_by, descending=instrument.descending,
+                                                        begin_time=instrument.begin_time,
+                                                        end_time=instrument.end_time, times=instrument.times,
+                                                        i_id=instrument.i_id, i_name=instrument.i_name,
+                                                        validity=instrument.validity))
 
 
 @router.post("/revise_instruments", tags=['Admin'], dependencies=[Depends(auth.decode_token)])
@@ -107,11 +142,12 @@ def download_qrcode(instrument: Instrument):
     return response
 
 
-@router.post('/get_surgery', tags=['Admin'], dependencies=[Depends(auth.decode_token)])
+@router.post('/get_surgery', tags=['Admin'],
+             dependencies=[Depends(auth.decode_token), Depends(time_budget(LIST_TIME_BUDGET))])
 def get_surgery_api(surgery: Union[SurgeryGet, None]):
     return get_surgery_by_tds(page=surgery.page, limit_size=surgery.limit_size,
                               begin_time=surgery.begin_time, end_time=surgery.end_time,
-                              department=surgery.department, s_name=surgery.s_name)
+                              department=surgery.department, s_name=surgery.s_name, fields=surgery.fields)
 
 
 @router.post('/update_surgery', tags=['Admin'], dependencies=[Depends(auth.decode_token)])
@@ -142,11 +178,33 @@ def insert_surgery(surgery: SurgeryUpdate):
                                 instruments=surgery.instruments, consumables=surgery.consumables)
 
 
-@router.post('/get_supply', tags=['Admin'], dependencies=[Depends(auth.decode_token)])
+@router.post('/get_supply', tags=['Admin'], dependencies=[Depends(auth.decode_token)],
+             response_class=FastJSONResponse)
 def get_supply_api(supply: Union[Supply, None]):
-    return get_supply_general(begin_time=supply.begin_time, end_time=supply.end_time,
-                              c_id=supply.c_id, c_name=supply.c_name,
-                              description=supply.description, validity=supply.validity)
+    return FastJSONResponse(get_supply_general(begin_time=supply.begin_time, end_time=supply.end_time,
+                                               c_id=supply.c_id, c_name=supply.c_name,
+                                               description=supply.description, validity=supply.validity))
+
+
+@router.post('/get_supply_page', tags=['Admin'], dependencies=[Depends(auth.decode_token)],
+             response_class=FastJSONResponse)
+def get_supply_page_api(supply: SupplyPage):
+    return FastJSONResponse(get_supply_page_general(page=supply.page, limit_size=supply.limit_size,
+                                                    sort_by=supply.sort_by, descending=supply.descending,
+                                                    begin_time=supply.begin_time, end_time=supply.end_time,
+                                                    c_id=supply.c_id, c_name=supply.c_name,
+                                                    description=supply.description, validity=supply.validity))
+
+
+@router.post('/get_supply_inventory', tags=['Admin'],
+             dependencies=[Depends(auth.decode_token), Depends(time_budget(LIST_TIME_BUDGET)),
+                           Depends(analytical_reads)],
+             response_class=FastJSONResponse)
+def get_supply_inventory_api(inventory: SupplyInventory):
+    return FastJSONResponse(get_supply_inventory_general(c_name=inventory.c_name, detail=inventory.detail,
+                                                         page=inventory.page, limit_size=inventory.limit_size,
+                                                         sort_by=inventory.sort_by,
+                                                         descending=inventory.descending))
 
 
 @router.post("/insert_supply", tags=['Admin'], dependencies=[Depends(auth.decode_token)])
@@ -154,17 +212,26 @@ def insert_supply_api(supply: SupplyGet):
     return insert_supplies(c_name=supply.c_name, num=supply.num)
 
 
+@router.post("/insert_supply_manifest", tags=['Admin'], dependencies=[Depends(auth.decode_token)])
+def insert_supply_manifest_api(manifest: SupplyManifest):
+    return insert_supply_manifest(manifest=list(map(lambda x: {"c_name": x.c_name, "num": x.num}, manifest.items)))
+
+
 @router.post("/delete_supply", tags=['Admin'], dependencies=[Depends(auth.decode_token)])
 def delete_supply_api(c_id: Union[int, list[int]]):
     return delete_supply_by_id(c_id=c_id)
 
 
 @router.post("/revise_supply", tags=['Admin'], dependencies=[Depends(auth.decode_token)])
-def revise_supply(supply: SupplyRevise):
-    return update_supply_description(c_id=supply.c_id, description=supply.description)
+def revise_supply(supply: SupplyRevise, background_tasks: BackgroundTasks):
+    res = update_supply_description(c_id=supply.c_id, description=supply.description)
+    background_tasks.add_task(sync_consumable, supply.c_id)
+    return res
 
 
-@router.post("/get_surgery_dashboard", tags=['Admin'], dependencies=[Depends(auth.decode_token)])
+@router.post("/get_surgery_dashboard", tags=['Admin'],
+             dependencies=[Depends(auth.decode_token), Depends(time_budget(DASHBOARD_TIME_BUDGET)),
+                           Depends(analytical_reads)])
 def get_surgery_dashboard_api(supply: Supply):
     return get_surgery_dashboard(begin_time=supply.begin_time, end_time=supply.end_time)
 
@@ -174,10 +241,32 @@ def get_doctor_contribution_api(contribution: Contribution):
     return get_doctor_contribution(df=contribution.df, name=contribution.name)
 
 
-@router.post("/get_message", tags=['Admin'], dependencies=[Depends(auth.decode_token)])
-def get_message(message: Message):
-    return get_message_by_filter(status=message.status, priority=message.priority,
-                                 begin_time=message.begin_time, end_time=message.end_time)
+@router.post("/get_message", tags=['Admin'], dependencies=[Depends(require_admin)],
+             response_class=FastJSONResponse)
+async def get_message(message: Message):
+    return FastJSONResponse(await get_message_by_filter(status=message.status, priority=message.priority,
+                                                        begin_time=message.begin_time, end_time=message.end_time))
+
+
+@router.post("/get_message_page", tags=['Admin'], dependencies=[Depends(require_admin)],
+             response_class=FastJSONResponse)
+async def get_message_page(message: MessagePage):
+    return FastJSONResponse(await get_message_page_by_filter(page=message.page, limit_size=message.limit_size,
+                                                             sort_by=message.sort_by, descending=message.descending,
+                                                             status=message.status, priority=message.priority,
+                                                             begin_time=message.begin_time,
+                                                             end_time=message.end_time))
+
+
+@router.post("/get_message_count", tags=['Admin'], dependencies=[Depends(require_admin)])
+async def get_message_count_api():
+    return await get_message_count()
+
+
+@router.get("/message_stream", tags=['Admin'], dependencies=[Depends(require_admin)])
+async def message_stream():
+    return StreamingResponse(broker.stream(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
 
 
 @router.post("/update_message", tags=['Admin'], dependencies=[Depends(auth.decode_token)])
@@ -191,6 +280,46 @@ def delete_message(message: Message):
     return delete_message_by_mid(m_id=message.m_id)
 
 
-@router.post("/get_general_data", tags=['Admin'], dependencies=[Depends(auth.decode_token)])
+@router.post("/update_messages", tags=['Admin'], dependencies=[Depends(require_admin)])
+def update_messages(triage: MessageTriage):
+    return triage_messages_by_filter(m_id=triage.m_id, status_filter=triage.status_filter,
+                                     priority_filter=triage.priority_filter, begin_time=triage.begin_time,
+                                     end_time=triage.end_time, u_id=triage.u_id, status=triage.status,
+                                     priority=triage.priority, feedback=triage.feedback)
+
+
+@router.post("/delete_messages", tags=['Admin'], dependencies=[Depends(require_admin)])
+def delete_messages(triage: MessageTriage):
+    return triage_messages_by_filter(m_id=triage.m_id, status_filter=triage.status_filter,
+                                     priority_filter=triage.priority_filter, begin_time=triage.begin_time,
+                                     end_time=triage.end_time, u_id=triage.u_id, delete=True)
+
+
+@router.post("/get_general_data", tags=['Admin'],
+             dependencies=[Depends(auth.decode_token), Depends(time_budget(ANALYTICS_TIME_BUDGET)),
+                           Depends(analytical_reads)])
 def get_general():
     return get_general_data()
+
+
+@router.post("/get_slow_queries", tags=['Admin'], dependencies=[Depends(require_admin)])
+def get_slow_queries(slow: SlowQueries):
+    return get_slow_query_report(top=slow.top, sort_by=slow.sort_by, collection=slow.collection, reset=slow.reset)
+
+
+@router.post("/get_traces", tags=['Admin'], dependencies=[Depends(require_admin)])
+def get_traces_api(traces: Traces):
+    return get_traces(limit=traces.limit, trace_id=traces.trace_id, min_duration_ms=traces.min_duration_ms)
+
+
+@router.post("/profile", tags=['Admin'], dependencies=[Depends(require_admin)])
+async def profile_api(profile: Profile):
+    res = await run_profile(seconds=profile.seconds, interval_ms=profile.interval_ms, idle=profile.idle,
+                            memory=profile.memory, top=profile.top)
+    return PlainTextResponse(res["collapsed"]) if profile.collapsed_only else res
+
+
+@router.post("/get_profile", tags=['Admin'], dependencies=[Depends(require_admin)])
+def get_profile_api(profile: ProfileGet):
+    res = get_profile(profile.profile_id)
+    return PlainTextResponse(res["collapsed"]) if profile.collapsed_only else res
@@ -1,38 +1,77 @@
-from fastapi import APIRouter, Depends
+from typing import Optional
+
+from fastapi import APIRouter, Depends, HTTPException
+from fastapi.responses import StreamingResponse
 
 from app.core.backend.doctor import get_general_data_by_month, get_surgery_time_series, get_contribution_matrix, \
-    get_surgery_by_date, send_message, get_message_by_uid
+    get_surgery_by_date, send_message, get_message_by_uid, get_message_page_by_uid, get_message_count_by_uid
+from app.constant import ANALYTICS_TIME_BUDGET
 from app.core.backend.user import auth
-from app.model.doctor import Doctor
+from app.core.database.base import analytical_reads
+from app.core.deadline import time_budget
+from app.core.inbox import broker
+from app.model.doctor import Doctor, MessagePage
 
 router = APIRouter(prefix="/doctor")
 
 
-@router.post('/get_general_data', tags=['Doctor'], dependencies=[Depends(auth.decode_token)])
+@router.post('/get_general_data', tags=['Doctor'],
+             dependencies=[Depends(auth.decode_token), Depends(time_budget(ANALYTICS_TIME_BUDGET)),
+                           Depends(analytical_reads)])
 def get_general_data(doctor: Doctor):
     return get_general_data_by_month(surgeon_id=doctor.u_id, begin_time=doctor.begin_time, end_time=doctor.end_time)
 
 
-@router.post('/get_surgery_time_series', tags=['Doctor'], dependencies=[Depends(auth.decode_token)])
+@router.post('/get_surgery_time_series', tags=['Doctor'],
+             dependencies=[Depends(auth.decode_token), Depends(time_budget(ANALYTICS_TIME_BUDGET)),
+                           Depends(analytical_reads)])
 def get_surgery_time_series_api(doctor: Doctor):
     return get_surgery_time_series(surgeon_id=doctor.u_id, mode=doctor.mode)
 
 
-@router.post('/get_doctor_contribution', tags=['Doctor'], dependencies=[Depends(auth.decode_token)])
+@router.post('/get_doctor_contribution', tags=['Doctor'],
+             dependencies=[Depends(auth.decode_token), Depends(time_budget(ANALYTICS_TIME_BUDGET)),
+                           Depends(analytical_reads)])
 def get_doctor_contribution(doctor: Doctor):
     return get_contribution_matrix(surgeon_id=doctor.u_id)
 
 
-@router.post('/get_surgery_by_date', tags=['Doctor'], dependencies=[Depends(auth.decode_token)])
+@router.post('/get_surgery_by_date', tags=['Doctor'],
+             dependencies=[Depends(auth.decode_token), Depends(time_budget(ANALYTICS_TIME_BUDGET)),
+                           Depends(analytical_reads)])
 def get_surgery_by_date_api(doctor: Doctor):
     return get_surgery_by_date(surgeon_id=doctor.u_id, date=doctor.date)
 
 
 @router.post('/send_message', tags=['Doctor'], dependencies=[Depends(auth.decode_token)])
-def send_message_api(doctor: Doctor):
-    return send_message(u_id=doctor.u_id, u_name=doctor.u_name, message=doctor.message)
+async def send_message_api(doctor: Doctor):
+    return await send_message(u_id=doctor.u_id, u_name=doctor.u_name, message=doctor.message)
+
+
+def _own_inbox(u_id: Optional[str], subject: str) -> str:
+    """The token subject, inboxes can only be read by their owner."""
+    if u_id is not None and u_id != subject:
+        raise HTTPException(status_code=403, detail="Can only read your own messages.")
+    return subject
+
+
+@router.post("/get_message", tags=['Admin'])
+async def get_message(doctor: Doctor, subject: str = Depends(auth.decode_token)):
+    return await get_message_by_uid(u_id=_own_inbox(doctor.u_id, subject))
+
+
+@router.post("/get_message_page", tags=['Doctor'])
+async def get_message_page(message: MessagePage, subject: str = Depends(auth.decode_token)):
+    return await get_message_page_by_uid(u_id=_own_inbox(message.u_id, subject), page=message.page,
+                                         limit_size=message.limit_size)
+
+
+@router.post("/get_message_count", tags=['Doctor'])
+async def get_message_count(doctor: Doctor, subject: str = Depends(auth.decode_token)):
+    return await get_message_count_by_uid(u_id=_own_inbox(doctor.u_id, subject))
 
 
-@router.post("/get_message", tags=['Admin'], dependencies=[Depends(auth.decode_token)])
-def get_message(doctor: Doctor):
-    return get_message_by_uid(u_id=doctor.u_id)
+@router.get("/message_stream", tags=['Doctor'])
+async def message_stream(u_id: Optional[str] = None, subject: str = Depends(auth.decode_token)):
+    return StreamingResponse(broker.stream(u_id=_own_inbox(u_id, subject)), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
@@ -14,8 +14,8 @@ def get_surgery_name_api():
 
 
 @router.post('/get_consumable_stock', tags=['Nurse'], dependencies=[Depends(auth.decode_token)])
-def get_surgery_name_api(instruments: list):
-    return get_consumable_stock(instruments=instruments)
+async def get_consumable_stock_api(instruments: list):
+    return await get_consumable_stock(instruments=instruments)
 
 
 @router.post('/get_instrument_ls', tags=['Nurse'], dependencies=[Depends(auth.decode_token)])
@@ -0,0 +1,16 @@
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+from app.core.backend.system import get_readiness, get_metrics
+
+router = APIRouter()
+
+
+@router.get('/ready', tags=['System'])
+async def ready():
+    return await get_readiness()
+
+
+@router.get('/metrics', tags=['System'], response_class=PlainTextResponse)
+def metrics():
+    return PlainTextResponse(get_metrics(), media_type="text/plain; version=0.0.4")
@@ -1,13 +1,14 @@
-from fastapi import APIRouter, Depends
+from fastapi import APIRouter, Depends, BackgroundTasks
 from app.core.backend.user import login, register, auth, revise_user_info
+from app.core.workflow.surgery_names import sync_user
 from app.model.user import User
 
 router = APIRouter()
 
 
 @router.post('/login', tags=["User"])
-def login_api(user: User):
-    return login(u_id=user.u_id, pwd=user.pwd)
+async def login_api(user: User):
+    return await login(u_id=user.u_id, pwd=user.pwd)
 
 
 @router.post('/register', tags=["User"])
@@ -16,8 +17,11 @@ def register_api(user: User):
 
 
 @router.post('/revise', dependencies=[Depends(auth.decode_token)], tags=["User"])
-def revise_api(user: User):
-    return revise_user_info(u_id=user.u_id, pwd=user.pwd, name=user.name, new_u_id=user.new_id)
+def revise_api(user: User, background_tasks: BackgroundTasks):
+    res = revise_user_info(u_id=user.u_id, pwd=user.pwd, name=user.name, new_u_id=user.new_id)
+    if user.name is not None:
+        background_tasks.add_task(sync_user, user.u_id, user.new_id)
+    return res
 
 
 @router.get('/protected', dependencies=[Depends(auth.decode_token)], tags=["User"])
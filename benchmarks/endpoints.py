@@ -0,0 +1,428 @@
+"""
+Endpoint benchmarks.
+
+The app is started in-process with the starlette TestClient against a local mongod (``DAVINCI_MONGO_URI``) or, with
+``--mongomock``, an in-memory stand-in shared by the pymongo and motor clients. The database is dropped before each
+size, so a run without ``--mongomock`` needs ``DAVINCI_MONGO_URI`` set to this machine, or the uri repeated with
+``--yes-drop``. For every dataset size the database
+is seeded by ``app.core.workflow.synthetic_data``, then each router endpoint is called ``--requests`` times after a
+warmup and its p50/p95/p99 latencies, mean, max, throughput and errors are written as JSON. The endpoints that are not
+benchmarked are listed with the reason, routes added without a case show up as uncovered.
+
+    python -m benchmarks.endpoints run --sizes 1000,10000,100000 --out after.json
+    python -m benchmarks.endpoints compare before.json after.json --tolerance 0.2
+
+``compare`` exits with 1 when an endpoint got slower than the tolerance, so it can gate a CI job. mongomock numbers
+only show the cost spent in the service, run against mongod to compare query plans and indexes.
+"""
+import argparse
+import functools
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+PERCENTILES = (50, 95, 99)
+# endpoints that are not benchmarked and why
+SKIPPED = {
+    "POST /admin/delete_user": "destructive, would empty the dataset between iterations",
+    "POST /admin/delete_instruments": "destructive, would empty the dataset between iterations",
+    "POST /admin/delete_supply": "destructive, would empty the dataset between iterations",
+    "POST /admin/delete_message": "destructive, would empty the dataset between iterations",
+    "POST /admin/delete_messages": "destructive, would empty the dataset between iterations",
+    "POST /admin/upload_users": "spreadsheet upload, writes temp.xlsx in the working directory",
+    "POST /admin/upload_instruments": "spreadsheet upload, writes temp.xlsx in the working directory",
+    "POST /admin/add_instrument": "writes the qr_code picture under BASE_DATA_TEMP_DIR",
+    "POST /admin/download_instrument_qrcode": "writes temp.png in the working directory",
+    "GET /admin/message_stream": "server-sent events, the response never ends",
+    "GET /doctor/message_stream": "server-sent events, the response never ends",
+    "POST /admin/profile": "diagnostic, profiles the worker for seconds",
+    "POST /admin/get_profile": "diagnostic, needs a request profiled with X-Profile",
+}
+
+
+def use_mongomock():
+    """
+    Replace the pymongo and motor clients by mongomock clients sharing one in-memory server.
+
+    Must run before the app is imported, the clients are created at import time.
+    """
+    import mongomock
+    import mongomock_motor
+    import motor.motor_asyncio
+    import pymongo
+
+    store = mongomock.store.ServerStore()
+    pymongo.MongoClient = functools.partial(mongomock.MongoClient, _store=store)
+
+    def _motor_client(*args, **kwargs):
+        return mongomock_motor.AsyncMongoMockClient(mock_mongo_client=mongomock.MongoClient(_store=store))
+
+    motor.motor_asyncio.AsyncIOMotorClient = _motor_client
+
+
+def _iso(value: datetime) -> str:
+    return value.isoformat()
+
+
+def build_context(accounts: dict, password: str) -> dict:
+    """Ids, names and dates of the seeded dataset the cases are built from."""
+    from app.core.database.base import surgery, apparatus, supplies, message
+
+    busiest = list(surgery.aggregate([{"$group": {"_id": "$chief_surgeon", "count": {"$sum": 1}}},
+                                      {"$sort": {"count": -1}}, {"$limit": 1}]))
+    doctor = busiest[0]["_id"] if busiest else accounts[1][0]["u_id"]
+    last = list(surgery.find({"chief_surgeon": doctor}).sort([("date", -1)]).limit(1))
+    latest = list(surgery.find({}).sort([("date", -1)]).limit(1))
+    end = latest[0]["date"] if latest else datetime.now()
+    s_names = list(surgery.aggregate([{"$group": {"_id": "$s_name", "count": {"$sum": 1}}},
+                                      {"$sort": {"count": -1}}, {"$limit": 1}]))
+    names = {x["u_id"]: x["name"] for v in accounts.values() for x in v}
+    return {
+        "password": password,
+        "admin": accounts[0][0]["u_id"],
+        "doctor": doctor,
+        "doctor_name": names.get(doctor),
+        "associate": next(x["u_id"] for x in accounts[1] if x["u_id"] != doctor) if len(accounts[1]) > 1 else doctor,
+        "nurses": [x["u_id"] for x in accounts[2][:3]],
+        "nurse": accounts[2][0]["u_id"],
+        "nurse_name": accounts[2][0]["name"],
+        "date": _iso(last[0]["date"] if last else end),
+        "begin_time": _iso(end - timedelta(days=365)),
+        "end_time": _iso(end + timedelta(days=1)),
+        "s_name": s_names[0]["_id"] if s_names else "",
+        "s_ids": [x["s_id"] for x in surgery.find({}, {"s_id": 1}).limit(100)],
+        "i_ids": [x["i_id"] for x in apparatus.find({"times": {"$gt": 1}}, {"i_id": 1}).limit(100)],
+        "c_ids": [x["c_id"] for x in supplies.find({}, {"c_id": 1}).limit(100)],
+        "c_names": sorted(supplies.distinct("c_name"))[:3],
+        "m_ids": [x["m_id"] for x in message.find({}, {"m_id": 1}).limit(100)],
+        "df": [],
+    }
+
+
+def _pick(values: list, i: int):
+    return values[i % len(values)] if values else 0
+
+
+def _surgery_update(ctx: dict, i: int) -> dict:
+    return {"p_name": f"压测{i}", "date": ctx["date"], "begin_time": ctx["date"], "end_time": ctx["date"],
+            "admission_number": 900000000 + i, "department": "胃肠外科", "s_name": ctx["s_name"],
+            "chief_surgeon": ctx["doctor"], "associate_surgeon": ctx["associate"],
+            "instrument_nurse": ctx["nurses"][:1], "circulating_nurse": ctx["nurses"][1:]}
+
+
+# "METHOD path": (role whose token is sent, body of the i-th call or None, query parameters or None)
+CASES = {
+    "GET /ready": (None, None, None),
+    "GET /metrics": (None, None, None),
+    "GET /protected": ("admin", None, None),
+    "POST /login": (None, lambda ctx, i: {"u_id": ctx["nurse"], "pwd": ctx["password"]}, None),
+    "POST /register": (None, lambda ctx, i: {"u_id": f"bench-register-{ctx['run']}-{i}", "name": "压测",
+                                             "user_type": "护士", "pwd": ctx["password"]}, None),
+    "POST /revise": ("nurse", lambda ctx, i: {"u_id": ctx["nurse"], "name": ctx["nurse_name"]}, None),
+    "GET /nurse/get_surgery_name": ("nurse", None, None),
+    "POST /nurse/get_consumable_stock": ("nurse", lambda ctx, i: ctx["c_names"], None),
+    "POST /nurse/get_instrument_ls": ("nurse", None, lambda ctx, i: {"s_name": ctx["s_name"]}),
+    "POST /nurse/insert_surgery_user": ("nurse", lambda ctx, i: {
+        **_surgery_update(ctx, i), "chief_surgeon": ctx["doctor_name"], "associate_surgeon": ctx["doctor_name"],
+        "instrument_nurse": [{"value": ctx["nurses"][0], "is_selected": True}],
+        "circulating_nurse": [{"value": x, "is_selected": True} for x in ctx["nurses"][1:]],
+        "instruments": [{"i_id": _pick(ctx["i_ids"], i), "description": "默认"}],
+        "consumables": [{"name": x, "description": "默认"} for x in ctx["c_names"][:1]]}, None),
+    "POST /nurse/add_surgery": ("nurse", lambda ctx, i: {
+        "ls_c_name": [{"c_name": x, "description": "默认"} for x in ctx["c_names"][:1]],
+        "ls_i_id": [_pick(ctx["i_ids"], i)], "p_name": f"压测{i}", "admission_number": 910000000 + i,
+        "department": "胃肠外科", "s_name": ctx["s_name"], "chief_surgeon": ctx["doctor_name"],
+        "associate_surgeon": ctx["doctor_name"], "instrument_nurse": [ctx["nurse_name"]],
+        "circulating_nurse": [ctx["nurse_name"]], "begin_time": ctx["date"], "end_time": ctx["date"]}, None),
+    "POST /doctor/get_general_data": ("doctor", lambda ctx, i: {"u_id": ctx["doctor"]}, None),
+    "POST /doctor/get_surgery_time_series": ("doctor", lambda ctx, i: {"u_id": ctx["doctor"],
+                                                                       "mode": ("year", "month", "day")[i % 3]},
+                                             None),
+    "POST /doctor/get_doctor_contribution": ("doctor", lambda ctx, i: {"u_id": ctx["doctor"]}, None),
+    "POST /doctor/get_surgery_by_date": ("doctor", lambda ctx, i: {"u_id": ctx["doctor"], "date": ctx["date"]},
+                                         None),
+    "POST /doctor/send_message": ("doctor", lambda ctx, i: {"u_id": ctx["doctor"], "u_name": ctx["doctor_name"],
+                                                            "message": f"压测消息{i}"}, None),
+    "POST /doctor/get_message": ("doctor", lambda ctx, i: {"u_id": ctx["doctor"]}, None),
+    "POST /doctor/get_message_page": ("doctor", lambda ctx, i: {"u_id": ctx["doctor"], "page": 1}, None),
+    "POST /doctor/get_message_count": ("doctor", lambda ctx, i: {"u_id": ctx["doctor"]}, None),
+    "POST /admin/add_user": ("admin", lambda ctx, i: {"u_id": f"bench-add-{ctx['run']}-{i}", "name": "压测",
+                                                      "user_type": "医生", "pwd": ctx["password"]}, None),
+    "POST /admin/revise_user": ("admin", lambda ctx, i: {"u_id": ctx["doctor"], "name": ctx["doctor_name"]},
+                                None),
+    "POST /admin/get_user": ("admin", lambda ctx, i: {}, None),
+    "POST /admin/get_user_page": ("admin", lambda ctx, i: {"page": 1}, None),
+    "GET /admin/get_instruments": ("admin", None, None),
+    "POST /admin/get_specific_instruments": ("admin", lambda ctx, i: {"i_id": ctx["i_ids"][:10]}, None),
+    "POST /admin/get_instrument_page": ("admin", lambda ctx, i: {"page": 1 + i % 5}, None),
+    "POST /admin/revise_instruments": ("admin", lambda ctx, i: {"i_id": _pick(ctx["i_ids"], i), "times": 12},
+                                       None),
+    "POST /admin/get_surgery": ("admin", lambda ctx, i: {"page": 1 + i % 5, "limit_size": 20}, None),
+    "POST /admin/update_surgery": ("admin", lambda ctx, i: {"s_id": _pick(ctx["s_ids"], i), "p_name": f"压测{i}"},
+                                   None),
+    "POST /admin/insert_surgery_admin": ("admin", lambda ctx, i: {
+        **_surgery_update(ctx, i), "instruments": [{"id": _pick(ctx["i_ids"], i), "description": "默认"}],
+        "consumables": [{"id": _pick(ctx["c_ids"], i), "description": "默认"}]}, None),
+    "POST /admin/get_supply": ("admin", lambda ctx, i: {"c_name": ctx["c_names"][:1],
+                                                        "begin_time": ctx["begin_time"]}, None),
+    "POST /admin/get_supply_page": ("admin", lambda ctx, i: {"page": 1 + i % 5}, None),
+    "POST /admin/get_supply_inventory": ("admin", lambda ctx, i: {"c_name": ctx["c_names"][:1], "detail": i % 2 == 1},
+                                         None),
+    "POST /admin/insert_supply": ("admin", lambda ctx, i: {"c_name": _pick(ctx["c_names"], i), "num": 1}, None),
+    "POST /admin/insert_supply_manifest": ("admin", lambda ctx, i: {"items": [{"c_name": x, "num": 2}
+                                                                              for x in ctx["c_names"]]}, None),
+    "POST /admin/revise_supply": ("admin", lambda ctx, i: {"c_id": _pick(ctx["c_ids"], i), "description": "默认"},
+                                  None),
+    "POST /admin/get_surgery_dashboard": ("admin", lambda ctx, i: {"begin_time": ctx["begin_time"],
+                                                                   "end_time": ctx["end_time"]}, None),
+    "POST /admin/get_doctor_contribution": ("admin", lambda ctx, i: {"df": ctx["df"], "name": ctx["doctor"]},
+                                            None),
+    "POST /admin/get_message": ("admin", lambda ctx, i: {"status": "未处理"}, None),
+    "POST /admin/get_message_page": ("admin", lambda ctx, i: {"page": 1 + i % 5}, None),
+    "POST /admin/get_message_count": ("admin", None, None),
+    "POST /admin/update_message": ("admin", lambda ctx, i: {"m_id": _pick(ctx["m_ids"], i),
+                                                            "priority": ("默认", "普通")[i % 2]}, None),
+    "POST /admin/update_messages": ("admin", lambda ctx, i: {"m_id": ctx["m_ids"][:20], "status": "处理中"}, None),
+    "POST /admin/get_general_data": ("admin", None, None),
+    "POST /admin/get_slow_queries": ("admin", lambda ctx, i: {}, None),
+    "POST /admin/get_traces": ("admin", lambda ctx, i: {"limit": 5}, None),
+}
+
+
+def app_routes(app) -> list:
+    from fastapi.routing import APIRoute
+
+    return sorted(f"{method} {route.path}" for route in app.routes if isinstance(route, APIRoute)
+                  for method in route.methods if method != "HEAD")
+
+
+def measure(client, endpoint: str, ctx: dict, tokens: dict, requests: int, warmup: int, concurrency: int) -> dict:
+    """
+    Call one endpoint warmup + requests times.
+
+    :return: {"requests", "errors", "p50_ms", "p95_ms", "p99_ms", "mean_ms", "max_ms", "rps", "error"}
+    """
+    method, path = endpoint.split(" ", 1)
+    role, body, params = CASES[endpoint]
+    headers = {"token": tokens[role]} if role else {}
+
+    def _call(i: int):
+        kwargs = {"headers": headers}
+        if body is not None:
+            kwargs["json"] = body(ctx, i)
+        if params is not None:
+            kwargs["params"] = params(ctx, i)
+        start = time.perf_counter()
+        response = client.request(method, path, **kwargs)
+        return time.perf_counter() - start, response.status_code, response.text[:200]
+
+    for i in range(warmup):
+        _call(i)
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        results = list(pool.map(_call, range(warmup, warmup + requests)))
+    elapsed = time.perf_counter() - start
+
+    latencies = np.array([x[0] for x in results]) * 1000
+    errors = [x for x in results if x[1] >= 400]
+    percentiles = np.percentile(latencies, PERCENTILES)
+    result = {"requests": requests, "errors": len(errors)}
+    result.update({f"p{p}_ms": round(float(v), 3) for p, v in zip(PERCENTILES, percentiles)})
+    result.update({"mean_ms": round(float(latencies.mean()), 3), "max_ms": round(float(latencies.max()), 3),
+                   "rps": round(requests / elapsed, 1)})
+    if errors:
+        result["error"] = f"{errors[0][1]} {errors[0][2]}"
+    return result
+
+
+def _login(client, u_id: str, password: str) -> str:
+    response = client.post("/login", json={"u_id": u_id, "pwd": password})
+    response.raise_for_status()
+    return response.json()["token"]
+
+
+def _git_commit() -> str:
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(sizes: list, requests: int = 50, warmup: int = 5, concurrency: int = 1, seed: int = 0,
+        endpoints: list = None, mongomock: bool = False, yes_drop: str = None) -> dict:
+    """
+    Seed and benchmark every dataset size.
+
+    :param sizes: numbers of surgeries
+    :param requests: timed calls of each endpoint
+    :param warmup: untimed calls before them
+    :param concurrency: threads calling the endpoint at the same time
+    :param seed: seed of the generated dataset
+    :param endpoints: only these "METHOD path" if given
+    :param mongomock: use the in-memory stand-in instead of DAVINCI_MONGO_URI
+    :param yes_drop: DAVINCI_MONGO_URI repeated, to seed a database that is not on this machine
+    :return: {"meta", "sizes": {size: {"seed_seconds", "inserted", "endpoints": {endpoint: result}}}, "skipped",
+             "uncovered"}
+    :raise ValueError: if the database to drop is neither mongomock, nor local, nor confirmed by yes_drop
+    """
+    if mongomock:
+        use_mongomock()
+    elif "DAVINCI_MONGO_URI" not in os.environ:
+        raise ValueError("every size drops the database, set DAVINCI_MONGO_URI to a local mongod or use --mongomock")
+    os.environ.setdefault("JWT_SECRET_KEY", "benchmark")
+    from fastapi.testclient import TestClient
+
+    from app.core.workflow import synthetic_data
+    from app.main import app
+
+    uri = os.environ.get("DAVINCI_MONGO_URI")
+    if not mongomock and not synthetic_data.is_local_uri(uri) and yes_drop != uri:
+        raise ValueError("every size drops the database, DAVINCI_MONGO_URI is not local, "
+                         "confirm with --yes-drop <DAVINCI_MONGO_URI>")
+
+    routes = app_routes(app)
+    selected = [x for x in routes if x in CASES and (not endpoints or x in endpoints)]
+    report = {"meta": {"started": datetime.now().isoformat(timespec="seconds"), "commit": _git_commit(),
+                       "python": platform.python_version(),
+                       "database": "mongomock" if mongomock else os.environ.get("DAVINCI_MONGO_URI", "default"),
+                       "requests": requests, "warmup": warmup, "concurrency": concurrency, "seed": seed},
+              "sizes": {},
+              "skipped": {x: SKIPPED[x] for x in routes if x in SKIPPED},
+              "uncovered": [x for x in routes if x not in CASES and x not in SKIPPED]}
+    for x in report["uncovered"]:
+        log.warning(f"{x} has no benchmark case")
+
+    # a failing endpoint is reported with its 500s instead of stopping the run
+    with TestClient(app, raise_server_exceptions=False) as client:
+        for size in sizes:
+            start = time.perf_counter()
+            seeded = synthetic_data.generate(seed=seed, surgeries=size, messages=max(size // 20, 100),
+                                             fast_qr=True, drop=True, confirm_drop=yes_drop)
+            seed_seconds = round(time.perf_counter() - start, 1)
+            log.info(f"seeded {size} surgeries in {seed_seconds}s")
+            ctx = build_context(seeded["accounts"], seeded["password"])
+            ctx["run"] = f"{size}-{int(time.time())}"
+            tokens = {role: _login(client, ctx[role], ctx["password"]) for role in ("admin", "doctor", "nurse")}
+            dashboard = client.post("/admin/get_surgery_dashboard", headers={"token": tokens["admin"]},
+                                    json={"begin_time": ctx["begin_time"], "end_time": ctx["end_time"]})
+            if dashboard.status_code == 200:
+                # the page posts back the dashboard records it got, capped to keep the body realistic
+                ctx["df"] = dashboard.json().get("df", [])[:5000]
+
+            results = {}
+            for endpoint in selected:
+                results[endpoint] = measure(client, endpoint, ctx, tokens, requests, warmup, concurrency)
+                log.info(f"{size} {endpoint}: p50 {results[endpoint]['p50_ms']}ms "
+                         f"p99 {results[endpoint]['p99_ms']}ms {results[endpoint]['rps']}/s")
+            report["sizes"][str(size)] = {"seed_seconds": seed_seconds, "inserted": seeded["inserted"],
+                                          "endpoints": results}
+    return report
+
+
+def compare(before: dict, after: dict, tolerance: float = 0.2, min_delta_ms: float = 1.0) -> list:
+    """
+    Endpoints slower in after than in before.
+
+    A percentile regresses when it grows by more than tolerance and by more than min_delta_ms, so sub-millisecond
+    noise is ignored. Throughput regresses when it drops by more than tolerance, and an endpoint that started to
+    fail regresses whatever its latency.
+
+    :return: [{"size", "endpoint", "metric", "before", "after", "change"}]
+    """
+    regressions = []
+    for size, data in after["sizes"].items():
+        old = before["sizes"].get(size)
+        if old is None:
+            continue
+        for endpoint, new in data["endpoints"].items():
+            base = old["endpoints"].get(endpoint)
+            if base is None:
+                continue
+            changes = []
+            for p in PERCENTILES:
+                key = f"p{p}_ms"
+                if new[key] > base[key] * (1 + tolerance) and new[key] - base[key] > min_delta_ms:
+                    changes.append(key)
+            if new["rps"] < base["rps"] * (1 - tolerance):
+                changes.append("rps")
+            if new["errors"] > 0 and base["errors"] == 0:
+                changes.append("errors")
+            for key in changes:
+                change = (new[key] - base[key]) / base[key] if base[key] else None
+                regressions.append({"size": size, "endpoint": endpoint, "metric": key, "before": base[key],
+                                    "after": new[key], "change": None if change is None else round(change, 3)})
+    return regressions
+
+
+def _print_report(report: dict):
+    print(f"{'size':>8}  {'endpoint':<42}{'p50':>9}{'p95':>9}{'p99':>9}{'rps':>9}{'errors':>7}")
+    for size, data in report["sizes"].items():
+        for endpoint, x in data["endpoints"].items():
+            print(f"{size:>8}  {endpoint:<42}{x['p50_ms']:>9}{x['p95_ms']:>9}{x['p99_ms']:>9}{x['rps']:>9}"
+                  f"{x['errors']:>7}")
+    for endpoint, reason in report["skipped"].items():
+        print(f"skipped {endpoint}: {reason}")
+    for endpoint in report["uncovered"]:
+        print(f"uncovered {endpoint}")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Benchmark every endpoint against a seeded database.")
+    commands = parser.add_subparsers(dest="command", required=True)
+    run_parser = commands.add_parser("run", help="seed and benchmark")
+    run_parser.add_argument("--sizes", default="1000,10000", help="comma separated numbers of surgeries")
+    run_parser.add_argument("--requests", type=int, default=50, help="timed calls of each endpoint")
+    run_parser.add_argument("--warmup", type=int, default=5)
+    run_parser.add_argument("--concurrency", type=int, default=1)
+    run_parser.add_argument("--seed", type=int, default=0)
+    run_parser.add_argument("--endpoint", action="append", help='only this "METHOD path", repeatable')
+    run_parser.add_argument("--mongomock", action="store_true", help="in-memory database instead of a mongod")
+    run_parser.add_argument("--yes-drop", metavar="URI",
+                            help="DAVINCI_MONGO_URI repeated, to drop and seed a database that is not local")
+    run_parser.add_argument("--out", help="write the results to this json file")
+    compare_parser = commands.add_parser("compare", help="flag the regressions between two runs")
+    compare_parser.add_argument("before")
+    compare_parser.add_argument("after")
+    compare_parser.add_argument("--tolerance", type=float, default=0.2, help="relative change allowed")
+    compare_parser.add_argument("--min-delta-ms", type=float, default=1.0, help="absolute change ignored")
+    args = parser.parse_args(argv)
+
+    if args.command == "run":
+        try:
+            report = run(sizes=[int(x) for x in args.sizes.split(",")], requests=args.requests, warmup=args.warmup,
+                         concurrency=args.concurrency, seed=args.seed, endpoints=args.endpoint,
+                         mongomock=args.mongomock, yes_drop=args.yes_drop)
+        except ValueError as e:
+            parser.error(str(e))
+        if args.out:
+            with open(args.out, "w", encoding="utf-8") as fp:
+                json.dump(report, fp, ensure_ascii=False, indent=2)
+        _print_report(report)
+        return 0
+
+    with open(args.before, encoding="utf-8") as fp:
+        before = json.load(fp)
+    with open(args.after, encoding="utf-8") as fp:
+        after = json.load(fp)
+    regressions = compare(before, after, args.tolerance, args.min_delta_ms)
+    for x in regressions:
+        change = "" if x["change"] is None else f" ({x['change']:+.0%})"
+        print(f"REGRESSION {x['size']} {x['endpoint']} {x['metric']}: {x['before']} -> {x['after']}{change}")
+    print(f"{len(regressions)} regression(s) beyond {args.tolerance:.0%}")
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(main())
@@ -0,0 +1,420 @@
+"""
+Role-mix load test.
+
+Sessions of nurses, doctors and administrators arrive at a running service as a Poisson process whose rate follows a
+ramp profile, so the load is open: a slow service does not slow the arrivals down, it piles sessions up as real
+users do. Each session logs in with an account written by ``synthetic_data --accounts``, then runs the scenario of
+its role with think times between the steps:
+
+    nurse   surgery names, instrument list, consumable stock, instrument lookup, record the surgery
+    doctor  home screen: general data, time series, contribution, inbox count and first page, sometimes a message
+    admin   dashboard, general data, inbox, surgery list, supply inventory, sometimes a doctor's contribution
+
+A profile is a list of stages ``DURATION:RATE[:MIX]``, the session rate ramps linearly from the rate of the previous
+stage (0 for the first one) to RATE sessions per second over DURATION seconds, with the role MIX of the stage, e.g.
+``nurse=8,doctor=1,admin=1``. The report gives the latency percentiles and error rates per role and endpoint, and per
+time window, and the saturation point: the first window whose p95 exceeds ``--slo-ms``, whose error rate exceeds
+``--max-error-rate`` or where sessions were dropped because ``--max-sessions`` were already running.
+
+    python -m app.core.workflow.synthetic_data --surgeries 100000 --drop --fast-qr --accounts accounts.json
+    python -m benchmarks.load --base-url http://localhost:8000 --accounts accounts.json --preset shift --out load.json
+"""
+import argparse
+import asyncio
+import json
+import logging
+import random
+import sys
+from datetime import datetime, timedelta
+
+import httpx
+import numpy as np
+
+from app.constant import DC_DEPARTMENT, USER_DICT
+
+log = logging.getLogger(__name__)
+
+# user_type of the accounts of each role
+ROLES = {"nurse": USER_DICT["护士"], "doctor": USER_DICT["医生"], "admin": USER_DICT["管理员"]}
+DEFAULT_MIX = {"nurse": 5, "doctor": 3, "admin": 1}
+PERCENTILES = (50, 95, 99)
+# (duration, sessions per second at the end of the stage, role mix or None for --mix)
+PRESETS = {
+    "ramp": [(60, 1, None), (60, 5, None), (60, 10, None), (60, 20, None), (60, 40, None)],
+    "step": [(5, 2, None), (55, 2, None), (5, 5, None), (55, 5, None), (5, 10, None), (55, 10, None),
+             (5, 20, None), (55, 20, None)],
+    # nurses record surgeries in the morning, doctors open their home screens at noon, admins look at the dashboard
+    "shift": [(30, 3, {"nurse": 8, "doctor": 1, "admin": 1}), (90, 3, {"nurse": 8, "doctor": 1, "admin": 1}),
+              (30, 4, {"nurse": 2, "doctor": 7, "admin": 1}), (90, 4, {"nurse": 2, "doctor": 7, "admin": 1}),
+              (30, 2, {"nurse": 1, "doctor": 2, "admin": 5}), (90, 2, {"nurse": 1, "doctor": 2, "admin": 5})],
+}
+
+
+def parse_mix(value: str) -> dict:
+    """``nurse=5,doctor=3,admin=1`` to {"nurse": 5.0, ...}"""
+    mix = {}
+    for item in filter(None, value.split(",")):
+        role, weight = item.split("=")
+        if role not in ROLES:
+            raise ValueError(f"unknown role {role}, expected one of {', '.join(ROLES)}")
+        mix[role] = float(weight)
+    return mix
+
+
+def parse_stage(value: str) -> tuple:
+    """``DURATION:RATE[:MIX]`` to (duration, rate, mix or None)"""
+    parts = value.split(":", 2)
+    return float(parts[0]), float(parts[1]), parse_mix(parts[2]) if len(parts) == 3 else None
+
+
+class Profile:
+    def __init__(self, stages: list, mix: dict):
+        """
+        :param stages: [(duration, rate, mix or None)], the rate ramps from the previous stage's
+        :param mix: role mix of the stages without one
+        """
+        self.stages = []
+        start, rate = 0.0, 0.0
+        for duration, end_rate, stage_mix in stages:
+            self.stages.append((start, start + duration, rate, end_rate, stage_mix or mix))
+            start, rate = start + duration, end_rate
+        self.duration = start
+        self.max_rate = max([x[3] for x in self.stages] + [0])
+
+    def at(self, t: float) -> tuple:
+        """Session rate and role mix at t seconds."""
+        for start, end, begin_rate, end_rate, mix in self.stages:
+            if t < end:
+                return begin_rate + (end_rate - begin_rate) * (t - start) / (end - start), mix
+        return 0.0, self.stages[-1][4]
+
+
+class StepFailed(Exception):
+    """A step of the scenario failed, the rest of the session depends on it."""
+
+
+class Recorder:
+    def __init__(self):
+        self.requests = []
+        self.arrivals = []
+        self.dropped = []
+        self.sessions = []
+        self.unfinished = 0
+
+    def request(self, t: float, role: str, endpoint: str, latency: float, error: str = None):
+        self.requests.append((t, role, endpoint, latency, error))
+
+
+def _percentiles(latencies: list) -> dict:
+    if not latencies:
+        return {f"p{p}_ms": None for p in PERCENTILES}
+    return {f"p{p}_ms": round(float(v), 1) for p, v in zip(PERCENTILES, np.percentile(latencies, PERCENTILES))}
+
+
+class Session:
+    def __init__(self, client: httpx.AsyncClient, recorder: Recorder, rng: random.Random, role: str, account: dict,
+                 accounts: dict, password: str, tokens: dict, think: float, start: float):
+        self.client = client
+        self.recorder = recorder
+        self.rng = rng
+        self.role = role
+        self.account = account
+        self.accounts = accounts
+        self.password = password
+        self.tokens = tokens
+        self.think_time = think
+        self.start = start
+        self.headers = {}
+
+    async def call(self, method: str, path: str, **kwargs):
+        """Send one request and record it, its json body is returned."""
+        loop = asyncio.get_running_loop()
+        begin = loop.time()
+        error = None
+        try:
+            response = await self.client.request(method, path, headers=self.headers, **kwargs)
+            if response.status_code >= 400:
+                error = str(response.status_code)
+            else:
+                return response.json()
+        except httpx.TimeoutException:
+            error = "timeout"
+        except httpx.HTTPError as e:
+            error = type(e).__name__
+        finally:
+            end = loop.time()
+            self.recorder.request(end - self.start, self.role, f"{method} {path}", (end - begin) * 1000, error)
+        raise StepFailed(f"{method} {path}: {error}")
+
+    async def think(self):
+        if self.think_time > 0:
+            await asyncio.sleep(self.rng.uniform(0, 2 * self.think_time))
+
+    async def login(self):
+        u_id = self.account["u_id"]
+        token = None if self.tokens is None else self.tokens.get(u_id)
+        if token is None:
+            token = (await self.call("POST", "/login", json={"u_id": u_id, "pwd": self.password}))["token"]
+            if self.tokens is not None:
+                self.tokens[u_id] = token
+        self.headers = {"token": token}
+
+
+async def nurse(s: Session):
+    s_name = s.rng.choice(await s.call("GET", "/nurse/get_surgery_name"))
+    instruments = await s.call("POST", "/nurse/get_instrument_ls", params={"s_name": s_name})
+    stock = await s.call("POST", "/nurse/get_consumable_stock", json=instruments)
+    await s.think()
+    # stands in for scanning the qr_code of every instrument on the cart
+    page = await s.call("POST", "/admin/get_instrument_page", json={"i_name": instruments, "validity": True,
+                                                                    "limit_size": 100})
+    by_name = {}
+    for x in page["data"]:
+        by_name.setdefault(x["i_name"], x["i_id"])
+    await s.think()
+    doctors = s.rng.sample(s.accounts["doctor"], min(2, len(s.accounts["doctor"])))
+    others = s.rng.sample(s.accounts["nurse"], min(2, len(s.accounts["nurse"])))
+    nurses = [s.account["u_id"]] + [x["u_id"] for x in others]
+    end = datetime.now().replace(microsecond=0)
+    await s.call("POST", "/nurse/insert_surgery_user", json={
+        "p_name": "压测", "date": end.replace(hour=0, minute=0, second=0).isoformat(),
+        "begin_time": (end - timedelta(hours=3)).isoformat(), "end_time": end.isoformat(),
+        "admission_number": s.rng.randrange(10 ** 8, 10 ** 9), "department": s.rng.choice(list(DC_DEPARTMENT)),
+        "s_name": s_name, "chief_surgeon": doctors[0]["name"], "associate_surgeon": doctors[-1]["name"],
+        "instrument_nurse": [{"value": nurses[0], "is_selected": True}],
+        "circulating_nurse": [{"value": x, "is_selected": True} for x in nurses[1:]],
+        "instruments": [{"i_id": x, "description": "默认"} for x in by_name.values()],
+        "consumables": [{"name": x["c_name"], "description": "默认"} for x in stock if x["nums"] > 0]})
+
+
+async def doctor(s: Session):
+    body = {"u_id": s.account["u_id"]}
+    await s.call("POST", "/doctor/get_general_data", json=body)
+    await s.call("POST", "/doctor/get_surgery_time_series", json={**body, "mode": "month"})
+    await s.call("POST", "/doctor/get_doctor_contribution", json=body)
+    await s.call("POST", "/doctor/get_message_count", json=body)
+    await s.think()
+    await s.call("POST", "/doctor/get_message_page", json={**body, "page": 1})
+    if s.rng.random() < 0.1:
+        await s.think()
+        await s.call("POST", "/doctor/send_message", json={**body, "u_name": s.account["name"],
+                                                           "message": "耗材库存不足，请及时补充"})
+
+
+async def admin(s: Session):
+    dashboard = await s.call("POST", "/admin/get_surgery_dashboard", json={})
+    await s.call("POST", "/admin/get_general_data")
+    await s.call("POST", "/admin/get_message_count")
+    await s.think()
+    await s.call("POST", "/admin/get_message_page", json={"page": 1})
+    await s.think()
+    await s.call("POST", "/admin/get_surgery", json={"page": 1, "limit_size": 20})
+    await s.call("POST", "/admin/get_supply_inventory", json={})
+    df = dashboard.get("df", [])
+    if df and s.rng.random() < 0.3:
+        await s.think()
+        await s.call("POST", "/admin/get_doctor_contribution",
+                     json={"df": df, "name": s.rng.choice(df)["chief_surgeon"]})
+
+
+SCENARIOS = {"nurse": nurse, "doctor": doctor, "admin": admin}
+
+
+async def _session(s: Session):
+    loop = asyncio.get_running_loop()
+    begin = loop.time() - s.start
+    ok = True
+    try:
+        await s.login()
+        await SCENARIOS[s.role](s)
+    except StepFailed as e:
+        ok = False
+        log.debug(f"{s.role} session of {s.account['u_id']} stopped at {e}")
+    finally:
+        s.recorder.sessions.append((begin, loop.time() - s.start, s.role, ok))
+
+
+async def run(base_url: str, accounts: dict, password: str, profile: Profile, think: float = 1.0,
+              reuse_tokens: bool = False, max_sessions: int = 500, timeout: float = 30, drain: float = 30,
+              seed: int = 0) -> Recorder:
+    """
+    Run the load profile against a service.
+
+    :param base_url: url of the service
+    :param accounts: {role: [{"u_id", "name"}]}
+    :param password: password of every account
+    :param profile: session arrival rates and role mixes
+    :param think: mean think time between steps, seconds
+    :param reuse_tokens: log every account in once instead of once per session
+    :param max_sessions: sessions running at the same time, new ones are dropped beyond
+    :param timeout: request timeout, seconds
+    :param drain: seconds left to the running sessions at the end of the profile
+    :param seed: seed of the arrivals and choices
+    """
+    rng = random.Random(seed)
+    recorder = Recorder()
+    tokens = {} if reuse_tokens else None
+    limits = httpx.Limits(max_connections=max_sessions, max_keepalive_connections=max_sessions)
+    loop = asyncio.get_running_loop()
+    running = set()
+    async with httpx.AsyncClient(base_url=base_url, timeout=timeout, limits=limits) as client:
+        start = loop.time()
+        while True:
+            # thinning of a Poisson process at the peak rate gives the arrivals of the varying rate
+            if profile.max_rate <= 0:
+                break
+            await asyncio.sleep(rng.expovariate(profile.max_rate))
+            t = loop.time() - start
+            if t >= profile.duration:
+                break
+            rate, mix = profile.at(t)
+            if rng.random() * profile.max_rate >= rate:
+                continue
+            roles = [x for x in mix if mix[x] > 0 and accounts.get(x)]
+            if not roles:
+                continue
+            role = rng.choices(roles, [mix[x] for x in roles])[0]
+            recorder.arrivals.append((t, role))
+            if len(running) >= max_sessions:
+                recorder.dropped.append((t, role))
+                continue
+            session = Session(client, recorder, random.Random(rng.random()), role, rng.choice(accounts[role]),
+                              accounts, password, tokens, think, start)
+            task = loop.create_task(_session(session))
+            running.add(task)
+            task.add_done_callback(running.discard)
+        if running:
+            done, pending = await asyncio.wait(set(running), timeout=drain)
+            for task in pending:
+                task.cancel()
+            recorder.unfinished = len(pending)
+    return recorder
+
+
+def report(recorder: Recorder, profile: Profile, window: float = 10, slo_ms: float = 1000,
+           max_error_rate: float = 0.01) -> dict:
+    """
+    Aggregate the recorded requests.
+
+    :return: {"summary", "endpoints": {role: {endpoint: stats}}, "errors": {kind: count}, "windows": [...],
+             "saturation": first saturated window or None, "peak_rps": best throughput before it}
+    """
+    requests = recorder.requests
+    errors = {}
+    endpoints = {}
+    for t, role, endpoint, latency, error in requests:
+        endpoints.setdefault(role, {}).setdefault(endpoint, []).append((latency, error))
+        if error is not None:
+            errors[error] = errors.get(error, 0) + 1
+    stats = {role: {endpoint: {"requests": len(x), "errors": sum(1 for _, e in x if e is not None),
+                               "error_rate": round(sum(1 for _, e in x if e is not None) / len(x), 4),
+                               **_percentiles([latency for latency, _ in x])}
+                    for endpoint, x in sorted(v.items())} for role, v in endpoints.items()}
+
+    windows = []
+    n = int(np.ceil(max([profile.duration] + [x[0] for x in requests]) / window))
+    for k in range(n):
+        begin, end = k * window, (k + 1) * window
+        batch = [x for x in requests if begin <= x[0] < end]
+        failed = sum(1 for x in batch if x[4] is not None)
+        windows.append({
+            "start": begin, "offered_sessions_per_s": round(profile.at(begin + window / 2)[0], 2),
+            "arrivals": sum(1 for x in recorder.arrivals if begin <= x[0] < end),
+            "dropped": sum(1 for x in recorder.dropped if begin <= x[0] < end),
+            "running": sum(1 for x in recorder.sessions if x[0] < end <= x[1]),
+            "rps": round(len(batch) / window, 1), "error_rate": round(failed / len(batch), 4) if batch else 0,
+            **_percentiles([x[3] for x in batch])})
+
+    saturation, peak = None, 0.0
+    for x in windows:
+        reasons = []
+        if x["p95_ms"] is not None and x["p95_ms"] > slo_ms:
+            reasons.append(f"p95 {x['p95_ms']}ms over {slo_ms}ms")
+        if x["error_rate"] > max_error_rate:
+            reasons.append(f"error rate {x['error_rate']:.1%} over {max_error_rate:.1%}")
+        if x["dropped"] > 0:
+            reasons.append(f"{x['dropped']} sessions dropped, max sessions running")
+        if reasons:
+            saturation = {**x, "reasons": reasons}
+            break
+        peak = max(peak, x["rps"])
+
+    sessions = recorder.sessions
+    summary = {"duration": profile.duration, "arrivals": len(recorder.arrivals), "dropped": len(recorder.dropped),
+               "sessions": len(sessions), "failed_sessions": sum(1 for x in sessions if not x[3]),
+               "unfinished_sessions": recorder.unfinished, "requests": len(requests),
+               "errors": sum(errors.values()),
+               "error_rate": round(sum(errors.values()) / len(requests), 4) if requests else 0,
+               **_percentiles([x[3] for x in requests])}
+    return {"summary": summary, "endpoints": stats, "errors": errors, "windows": windows, "saturation": saturation,
+            "peak_rps": peak}
+
+
+def load_accounts(path: str) -> tuple:
+    """Accounts json of synthetic_data to ({role: [{"u_id", "name"}]}, password)."""
+    with open(path, encoding="utf-8") as fp:
+        data = json.load(fp)
+    accounts = {role: data["accounts"].get(str(user_type), []) for role, user_type in ROLES.items()}
+    return accounts, data["password"]
+
+
+def _print_report(result: dict):
+    s = result["summary"]
+    print(f"{s['arrivals']} sessions arrived, {s['dropped']} dropped, {s['failed_sessions']} failed, "
+          f"{s['requests']} requests, error rate {s['error_rate']:.2%}, p50 {s['p50_ms']}ms p95 {s['p95_ms']}ms "
+          f"p99 {s['p99_ms']}ms")
+    print(f"{'start':>6}{'offered/s':>11}{'running':>9}{'rps':>8}{'errors':>8}{'p50':>9}{'p95':>9}{'p99':>9}")
+    for x in result["windows"]:
+        print(f"{x['start']:>6.0f}{x['offered_sessions_per_s']:>11}{x['running']:>9}{x['rps']:>8}"
+              f"{x['error_rate']:>8.1%}{str(x['p50_ms']):>9}{str(x['p95_ms']):>9}{str(x['p99_ms']):>9}")
+    for role, endpoints in result["endpoints"].items():
+        for endpoint, x in endpoints.items():
+            print(f"{role:<7}{endpoint:<42}{x['requests']:>7}{x['error_rate']:>8.1%}{str(x['p50_ms']):>9}"
+                  f"{str(x['p95_ms']):>9}{str(x['p99_ms']):>9}")
+    if result["saturation"] is None:
+        print(f"no saturation, peak {result['peak_rps']} requests/s")
+    else:
+        x = result["saturation"]
+        print(f"saturated at {x['start']:.0f}s, {x['offered_sessions_per_s']} sessions/s, {x['rps']} requests/s: "
+              f"{'; '.join(x['reasons'])}. Peak before it {result['peak_rps']} requests/s")
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Load test a running service with a mix of user roles.")
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--accounts", required=True, help="accounts json written by synthetic_data --accounts")
+    parser.add_argument("--preset", choices=sorted(PRESETS), default="ramp")
+    parser.add_argument("--stage", action="append", help="DURATION:RATE[:MIX], repeatable, replaces the preset")
+    parser.add_argument("--mix", default=",".join(f"{k}={v}" for k, v in DEFAULT_MIX.items()),
+                        help="role mix of the stages without one")
+    parser.add_argument("--think", type=float, default=1.0, help="mean think time between steps, seconds")
+    parser.add_argument("--reuse-tokens", action="store_true", help="log every account in once")
+    parser.add_argument("--max-sessions", type=int, default=500)
+    parser.add_argument("--timeout", type=float, default=30)
+    parser.add_argument("--drain", type=float, default=30, help="seconds left to the sessions running at the end")
+    parser.add_argument("--window", type=float, default=10, help="seconds of each report window")
+    parser.add_argument("--slo-ms", type=float, default=1000, help="p95 latency of a saturated window")
+    parser.add_argument("--max-error-rate", type=float, default=0.01, help="error rate of a saturated window")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--out", help="write the report to this json file")
+    args = parser.parse_args(argv)
+
+    accounts, password = load_accounts(args.accounts)
+    stages = [parse_stage(x) for x in args.stage] if args.stage else PRESETS[args.preset]
+    profile = Profile(stages, parse_mix(args.mix))
+    recorder = asyncio.run(run(args.base_url, accounts, password, profile, think=args.think,
+                               reuse_tokens=args.reuse_tokens, max_sessions=args.max_sessions, timeout=args.timeout,
+                               drain=args.drain, seed=args.seed))
+    result = report(recorder, profile, window=args.window, slo_ms=args.slo_ms, max_error_rate=args.max_error_rate)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as fp:
+            json.dump(result, fp, ensure_ascii=False, indent=2)
+    _print_report(result)
+    return 0
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    # one line per request otherwise
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+    sys.exit(main())
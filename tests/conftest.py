@@ -0,0 +1,135 @@
+"""
+Fixtures of the test suite.
+
+The app runs against the in-memory mongomock server of the endpoint benchmarks, seeded once with a small synthetic
+dataset. mongomock does not go through pymongo's command monitoring, so its collection methods are wrapped to
+publish the command events query budgets count, one event per command pymongo would have sent.
+"""
+import os
+import time
+from contextvars import ContextVar
+from itertools import count, groupby
+from types import SimpleNamespace
+
+import pytest
+
+# never let the suite reach the default database, the clients are replaced by mongomock below anyway
+os.environ["DAVINCI_MONGO_URI"] = "mongodb://localhost:27017"
+os.environ.setdefault("JWT_SECRET_KEY", "test")
+
+from benchmarks.endpoints import use_mongomock  # noqa: E402
+
+use_mongomock()
+
+import mongomock  # noqa: E402
+from pymongo import DeleteMany, DeleteOne, InsertOne  # noqa: E402
+
+PASSWORD = "davinci"
+
+_depth: ContextVar = ContextVar("mongomock_depth", default=0)
+_request_id = count(1)
+
+
+def _bulk_commands(requests) -> list:
+    """(command name, filter) of the commands a bulk write is split into, one per run of the same write type."""
+    def _kind(x):
+        if isinstance(x, InsertOne):
+            return "insert"
+        return "delete" if isinstance(x, (DeleteOne, DeleteMany)) else "update"
+
+    return [(kind, getattr(next(ops), "_filter", None) or {}) for kind, ops in groupby(requests, _kind)]
+
+
+# collection method: (command name, command without the collection) of the calls, a list of them for bulk writes
+_COMMANDS = {
+    "find": lambda f=None, *a, **k: ("find", {"filter": f or {}}),
+    "find_one": lambda f=None, *a, **k: ("find", {"filter": f if isinstance(f, dict) else {"_id": f} if f else {}}),
+    "aggregate": lambda pipeline, *a, **k: ("aggregate", {"pipeline": pipeline}),
+    "count_documents": lambda f, *a, **k: ("aggregate", {"pipeline": [{"$match": f}]}),
+    "estimated_document_count": lambda *a, **k: ("count", {}),
+    "distinct": lambda key, f=None, *a, **k: ("distinct", {"key": key, "query": f or {}}),
+    "insert_one": lambda *a, **k: ("insert", {}),
+    "insert_many": lambda *a, **k: ("insert", {}),
+    "update_one": lambda f, *a, **k: ("update", {"updates": [{"q": f}]}),
+    "update_many": lambda f, *a, **k: ("update", {"updates": [{"q": f}]}),
+    "replace_one": lambda f, *a, **k: ("update", {"updates": [{"q": f}]}),
+    "delete_one": lambda f, *a, **k: ("delete", {"deletes": [{"q": f}]}),
+    "delete_many": lambda f, *a, **k: ("delete", {"deletes": [{"q": f}]}),
+    "find_one_and_update": lambda f, *a, **k: ("findAndModify", {"query": f}),
+    "find_one_and_replace": lambda f, *a, **k: ("findAndModify", {"query": f}),
+    "find_one_and_delete": lambda f, *a, **k: ("findAndModify", {"query": f}),
+    "bulk_write": lambda requests, *a, **k: [
+        (kind, {"updates" if kind == "update" else "deletes": [{"q": f}]} if kind != "insert" else {})
+        for kind, f in _bulk_commands(requests)],
+    "create_index": lambda *a, **k: ("createIndexes", {}),
+    "create_indexes": lambda *a, **k: ("createIndexes", {}),
+    "index_information": lambda *a, **k: ("listIndexes", {}),
+    "drop_index": lambda *a, **k: ("dropIndexes", {}),
+    "drop": lambda *a, **k: ("drop", {}),
+}
+
+
+def _monitored(name: str, method, describe):
+    def _call(self, *args, **kwargs):
+        if _depth.get() != 0:
+            # mongomock implements some methods with others, only the outermost call is a command
+            return method(self, *args, **kwargs)
+        from app.core.database.base import mongo
+
+        commands = describe(*args, **kwargs)
+        commands = commands if isinstance(commands, list) else [commands]
+        events = [SimpleNamespace(command_name=command_name, command={command_name: self.name, **command},
+                                  database_name=self.database.name, request_id=next(_request_id),
+                                  operation_id=None, connection_id=("mongomock", 27017), duration_micros=0,
+                                  reply={"ok": 1}, failure=None)
+                  for command_name, command in commands]
+        for event in events:
+            mongo.command_events.started(event)
+        token = _depth.set(1)
+        start = time.perf_counter()
+        try:
+            result = method(self, *args, **kwargs)
+        except Exception as e:
+            for event in events:
+                event.failure = {"errmsg": str(e)}
+                mongo.command_events.failed(event)
+            raise
+        finally:
+            _depth.reset(token)
+        for event in events:
+            event.duration_micros = int((time.perf_counter() - start) * 1e6 / len(events))
+            mongo.command_events.succeeded(event)
+        return result
+
+    _call.__name__ = name
+    return _call
+
+
+for _name, _describe in _COMMANDS.items():
+    setattr(mongomock.collection.Collection, _name,
+            _monitored(_name, getattr(mongomock.collection.Collection, _name), _describe))
+
+
+@pytest.fixture(scope="session")
+def seeded():
+    from app.core.workflow import synthetic_data
+
+    return synthetic_data.generate(seed=0, surgeries=500, messages=100, fast_qr=True, drop=True, password=PASSWORD)
+
+
+@pytest.fixture(scope="session")
+def client(seeded):
+    from fastapi.testclient import TestClient
+
+    from app.main import app
+
+    with TestClient(app, raise_server_exceptions=False) as client:
+        yield client
+
+
+@pytest.fixture(scope="session")
+def tokens(seeded) -> dict:
+    from app.core.backend.user import auth
+
+    return {role: auth.encode_token(seeded["accounts"][code][0]["u_id"])
+            for role, code in (("admin", 0), ("doctor", 1), ("nurse", 2))}
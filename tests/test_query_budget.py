@@ -0,0 +1,70 @@
+"""
+Database round trips of the hot endpoints.
+
+Each endpoint declares the Mongo commands it may send with ``query_budget``, a query added in a loop fails the
+budget or the N+1 check.
+"""
+import os
+
+import pytest
+
+from app.core.database.base import apparatus, supplies
+from app.core.query_stats import query_budget
+
+CORE_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "app", "core")
+
+
+@pytest.fixture
+def core_dir(monkeypatch):
+    # the surgery to instruments table is read under BASE_CORE_DIR, the Docker layout
+    monkeypatch.setattr("app.core.backend.nurse.BASE_CORE_DIR", CORE_DIR)
+
+
+def _surgery(seeded: dict, instruments: list, consumables: list) -> dict:
+    doctor = seeded["accounts"][1][0]["name"]
+    nurses = [x["u_id"] for x in seeded["accounts"][2][:2]]
+    return {"p_name": "测试", "date": "2023-05-01T08:00:00", "begin_time": "2023-05-01T08:00:00",
+            "end_time": "2023-05-01T10:00:00", "admission_number": 900000001, "department": "胃肠外科",
+            "s_name": "机器人援助下胸腺切除", "chief_surgeon": doctor, "associate_surgeon": doctor,
+            "instrument_nurse": [{"value": nurses[0], "is_selected": True}],
+            "circulating_nurse": [{"value": nurses[1], "is_selected": True}],
+            "instruments": instruments, "consumables": consumables}
+
+
+def test_get_surgery(client, tokens):
+    with query_budget(2):
+        response = client.post("/admin/get_surgery", headers={"token": tokens["admin"]},
+                               json={"page": 2, "limit_size": 20})
+    assert response.status_code == 200
+    assert len(response.json()) == 20
+
+
+def test_get_instrument_ls(client, tokens, core_dir):
+    with query_budget(0):
+        response = client.post("/nurse/get_instrument_ls", headers={"token": tokens["nurse"]},
+                               params={"s_name": "机器人援助下胸腺切除"})
+    assert response.status_code == 200
+    assert len(response.json()) != 0
+
+
+def test_insert_surgery_user(client, seeded):
+    i_id = apparatus.find_one({"times": {"$gt": 1}})["i_id"]
+    c_name = supplies.find_one({"description": ""})["c_name"]
+    # staff 2, instrument uses 2, supply claim 3, display names 3, the surgery 2
+    with query_budget(12):
+        response = client.post("/nurse/insert_surgery_user", json=_surgery(
+            seeded, [{"i_id": i_id, "description": "默认"}], [{"name": c_name, "description": "默认"}]))
+    assert response.status_code == 200
+
+
+def test_insert_surgery_user_without_instruments_and_consumables(client, seeded):
+    with query_budget(5):
+        response = client.post("/nurse/insert_surgery_user", json=_surgery(seeded, [], []))
+    assert response.status_code == 200
+
+
+def test_insert_surgery_user_unknown_instrument(client, seeded):
+    with query_budget(3):
+        response = client.post("/nurse/insert_surgery_user", json=_surgery(
+            seeded, [{"i_id": -1, "description": "默认"}], []))
+    assert response.status_code == 400